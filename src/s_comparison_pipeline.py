@@ -0,0 +1,364 @@
+import datetime
+import dotenv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from os import environ, makedirs
+from pathlib import Path
+from time import time
+from numpy import around
+from matplotlib import pyplot as plt
+import s_comparison_stats
+import s_visualize_comparison
+import t_compare
+import t_comparison_store
+import t_download_manifest
+import t_granule_pairs
+import t_laads_tools
+
+# Load the environmental variables
+dotenv.load_dotenv()
+
+
+# Get the [vnp url, vj1 url] pairs of a product for a list of tiles and dates from the URL catalogs (the newest version
+# of each granule), and a dictionary of file name to the expected (size, checksum) of each file
+def get_pair_urls(product, tiles, dates, vnp_archive_set="5000", vj1_archive_set="3194"):
+    # Start the index of the pairs
+    pair_index = t_granule_pairs.GranulePairIndex()
+    # Dictionary for the file checks
+    file_checks = {}
+    # For each satellite and its archive set
+    for satellite, archive_set in [("VNP", vnp_archive_set), ("VJ1", vj1_archive_set)]:
+        # Retrieve a dictionary of the URLs on LAADS
+        urls_dict = t_laads_tools.LaadsUrlsDict(f"{satellite}{product}", archive_set=archive_set)
+        # Get the files for the tiles and dates
+        files_list = urls_dict.get_files_from_dates(tiles, dates=dates)
+        # Add each file's URL to the index
+        for tile, date, file_name, target_url in files_list:
+            pair_index.add(target_url)
+        # Get the files' checks
+        file_checks.update(urls_dict.get_file_checks([file_name for tile, date, file_name, target_url in files_list]))
+        # Close the dictionary
+        urls_dict.close()
+    # Report the pairs and unpaired granules
+    pair_index.report()
+    # Return the pairs and file checks
+    return pair_index.get_pairs(), file_checks
+
+
+# Find a granule that is already in the archive (in the download manifest, or in the output directory or its archive set
+# directory). Returns its path relative to the output directory, or None if it is not there
+def find_local_file(target_url, manifest):
+    # Name of the granule
+    file_name = target_url.split('/')[-1]
+    # Path in the manifest (if any)
+    manifest_path = manifest.get_file_path(file_name)
+    # If it is in the manifest and still there
+    if manifest_path is not None and manifest_path.exists():
+        # Return the path relative to the output directory
+        return str(manifest_path.relative_to(manifest.root_path))
+    # For the output directory and the archive set directory
+    for relative_path in [file_name, f"{t_granule_pairs.parse_granule(target_url).archive_set}/{file_name}"]:
+        # If the granule is there
+        if Path(environ['output_files_path'] + relative_path).is_file():
+            # Return the path
+            return relative_path
+    # Return None
+    return None
+
+
+# Thread worker function: download a file to the scratch directory (a directory path relative to the output directory)
+# Returns the file name (relative to the output directory), or None if the download failed
+def download_worker(target_url, session_pool, scheduler, scratch_path, expected_size=None, expected_checksum=None):
+    # Start time for the file
+    ptime = time()
+    # Get this thread's LAADS session
+    s = session_pool.get_session()
+    # Get the requested file from the URL (True if it was written and checked, otherwise None)
+    success = t_laads_tools.get_VIIRS_file(s,
+                                           target_url,
+                                           write_local=True,
+                                           return_file=False,
+                                           expected_size=expected_size,
+                                           expected_checksum=expected_checksum,
+                                           scheduler=scheduler,
+                                           output_path=environ['output_files_path'] + scratch_path)
+    # Print the time taken
+    print(f"{target_url.split('/')[-1]} downloaded in {around(time() - ptime, decimals=2)} seconds.")
+    # Return the file name if it succeeded
+    return scratch_path + target_url.split('/')[-1] if success else None
+
+
+# Process worker function: compare every band of a pair of downloaded files, plotting each band if save_figs
+# Returns a list of report rows, one per band, and a dictionary of band to comparison (for the comparison store)
+def compare_worker(vnp_file_name, vj1_file_name, albedo_sat, save_figs=False):
+    # Open the vnp and vj1 files as h5py File objects
+    vnp_file, vj1_file = t_compare.open_files(vnp_file_name, vj1_file_name)[:2]
+    # If either file could not be opened
+    if vnp_file is None:
+        # Raise an error (recorded as a failure by main)
+        raise OSError(f'Files {vnp_file_name} and {vj1_file_name} could not be opened.')
+    # Get the product, tile and date, and the settings for the product
+    product, tile, year, doy = t_compare.get_file_details(vnp_file_name)
+    keyword, figure_keyword, scale_factor = t_compare.get_product_settings(product)
+    # List for the rows and dictionary for the comparisons
+    rows = []
+    comparisons = {}
+    # For each key (band) that begins with the product keyword
+    for key in t_compare.get_band_keys(vnp_file, keyword):
+        # Compare the band (keeping the arrays only for the figure; the granules are evicted, so nothing is cached)
+        comparison = s_visualize_comparison.compare_band(vnp_file, vj1_file, key, scale_factor, keep_arrays=save_figs)
+        # If saving figures
+        if save_figs:
+            # Plot the band
+            s_visualize_comparison.plot_band(comparison,
+                                             key,
+                                             product,
+                                             tile,
+                                             year,
+                                             doy,
+                                             figure_keyword,
+                                             albedo_sat,
+                                             s_visualize_comparison.get_results_path(product, tile, year, doy),
+                                             save_figs=True,
+                                             show_figs=False)
+            # Drop the arrays
+            comparison.vnp_array = comparison.vj1_array = comparison.diff_array = None
+        # Add its row and the comparison
+        rows.append(s_comparison_stats.get_report_row(comparison, product, tile, year, doy, key))
+        comparisons[key] = comparison
+    # Close the files
+    vnp_file.close()
+    vj1_file.close()
+    # Return the rows and comparisons
+    return rows, comparisons
+
+
+# Remove a file downloaded by the pipeline, and its partial file (if they are there)
+def evict_file(file_name):
+    # Path to the file
+    file_path = Path(environ['output_files_path'] + file_name)
+    # Remove it and its partial file
+    file_path.unlink(missing_ok=True)
+    t_laads_tools.get_partial_path(file_path).unlink(missing_ok=True)
+
+
+# Main function
+# Streams the VNP/VJ1 pairs of a product for a list of tiles and dates through download -> compare -> evict: each pair
+# is downloaded (by a pool of threads), compared as soon as both files have landed (by a pool of worker processes, with
+# figures if save_figs), its statistics saved to the comparison store and its downloads removed. Granules already in
+# the archive (the download manifest, or the output directory) are read in place and never removed; the others are
+# downloaded to a scratch directory in the output directory (scratch_path) and only those are evicted. A pair is only
+# started while the files being downloaded, waiting or compared fit in max_disk_bytes (their catalog sizes, or
+# granule_size_estimate if unknown; one pair is always allowed), so the downloads stay ahead of the comparisons without
+# filling the disk. Pairs already in the comparison store are skipped, so a stopped run can be started again.
+# Writes the statistics of the run to a CSV report in the output directory and returns its path.
+def main(product,
+         tiles,
+         dates,
+         albedo_sat=1,
+         save_figs=False,
+         max_disk_bytes=20 * 1024 ** 3,
+         granule_size_estimate=200 * 1024 ** 2,
+         max_downloads=8,
+         max_workers=None,
+         vnp_archive_set="5000",
+         vj1_archive_set="3194",
+         scratch_path='pipeline_scratch/',
+         report_name='pipeline_stats.csv'):
+
+    # Mark start time
+    stime = time()
+    # Get the pairs and their file checks
+    pairs, file_checks = get_pair_urls(product, tiles, dates, vnp_archive_set=vnp_archive_set,
+                                       vj1_archive_set=vj1_archive_set)
+    # Open the comparison store and the download manifest (for the granules already in the archive)
+    store = t_comparison_store.ComparisonStore()
+    manifest = t_download_manifest.DownloadManifest()
+    # Make the scratch directory if there is none
+    makedirs(environ['output_files_path'] + scratch_path, exist_ok=True)
+    # Queue of the (pair index, pair) still to start, without those already in the store
+    pending = deque((pair_index, pair) for pair_index, pair in enumerate(pairs)
+                    if not store.has_date(*t_compare.get_file_details(pair[0])))
+    # Print update
+    print(f"{len(pending)} of {len(pairs)} pairs to compare.")
+    # Bytes reserved on disk by the started pairs (pair index to bytes)
+    reserved = {}
+    # Files of each started pair (pair index to a dictionary of URL to file name, None if its download failed)
+    pair_files = {}
+    # Files downloaded by this run for each started pair (pair index to a list of file names, the only ones evicted)
+    pair_downloads = {}
+    # Dictionaries of download future to (pair index, URL) and compare future to pair index
+    download_futures = {}
+    compare_futures = {}
+    # Dictionary of pair index to its rows
+    pair_rows = {}
+    # Request scheduler for the downloads (adapts the number of concurrent downloads, up to max_downloads)
+    scheduler = t_laads_tools.RequestScheduler(initial_limit=min(3, max_downloads), max_limit=max_downloads)
+
+    # Get the bytes a pair's downloads will take on disk (the granules already in the archive take none)
+    def get_pair_bytes(pair):
+        # Return the catalog sizes (or the estimate)
+        return sum((file_checks.get(target_url.split('/')[-1], (None, None))[0] or granule_size_estimate)
+                   for target_url in pair if find_local_file(target_url, manifest) is None)
+
+    # Finish a pair: remove the files this run downloaded for it and release its bytes
+    def finish_pair(pair_index):
+        # Forget the files
+        pair_files.pop(pair_index)
+        # Remove the downloads (and any partial files)
+        for file_name in pair_downloads.pop(pair_index):
+            evict_file(file_name)
+        # Release the bytes
+        reserved.pop(pair_index)
+
+    # Start a pool of LAADS sessions (one per download thread), a ThreadPoolExecutor for the downloads and a
+    # ProcessPoolExecutor for the comparisons (each worker uses the non-interactive Agg backend)
+    with t_laads_tools.LaadsSessionPool(pool_size=max_downloads) as session_pool, \
+            ThreadPoolExecutor(max_workers=max_downloads) as download_executor, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=plt.switch_backend,
+                                initargs=('Agg',)) as compare_executor:
+
+        # Submit the comparison of a pair once both of its files are there (finishing it if either download failed)
+        def check_pair(pair_index):
+            # If both files of the pair are not finished yet
+            if len(pair_files[pair_index]) < 2:
+                # Wait for them
+                return
+            # If both are there
+            if all(pair_files[pair_index].values()):
+                # Submit the comparison (the file names in the order of the pair)
+                compare_futures[compare_executor.submit(compare_worker,
+                                                        *(pair_files[pair_index][target_url]
+                                                          for target_url in pairs[pair_index]),
+                                                        albedo_sat,
+                                                        save_figs=save_figs)] = pair_index
+            # Otherwise
+            else:
+                # Print a warning
+                print(f'Warning: Pair {pairs[pair_index][0].split("/")[-1]} could not be downloaded.')
+                # Finish the pair
+                finish_pair(pair_index)
+
+        # Start pairs while they fit in the disk budget
+        def start_pairs():
+            # While there are pairs to start, and the next one fits (or nothing is started)
+            while pending and (not reserved or sum(reserved.values()) + get_pair_bytes(pending[0][1]) <=
+                               max_disk_bytes):
+                # Get the next pair
+                pair_index, pair = pending.popleft()
+                # Reserve its bytes
+                reserved[pair_index] = get_pair_bytes(pair)
+                pair_files[pair_index] = {}
+                pair_downloads[pair_index] = []
+                # For each file
+                for target_url in pair:
+                    # Get its path if it is already in the archive
+                    local_file = find_local_file(target_url, manifest)
+                    # If it is
+                    if local_file is not None:
+                        # Read it in place
+                        pair_files[pair_index][target_url] = local_file
+                        # Next file
+                        continue
+                    # Record the download as this run's (so it, or its partial file, is evicted)
+                    pair_downloads[pair_index].append(scratch_path + target_url.split('/')[-1])
+                    # Submit the download
+                    download_futures[download_executor.submit(download_worker,
+                                                              target_url,
+                                                              session_pool,
+                                                              scheduler,
+                                                              scratch_path,
+                                                              *file_checks.get(target_url.split('/')[-1],
+                                                                               (None, None)))] = \
+                        (pair_index, target_url)
+                # Submit the comparison if both files were already there
+                check_pair(pair_index)
+
+        # Start the first pairs
+        start_pairs()
+        # While there are downloads or comparisons running
+        while download_futures or compare_futures:
+            # Wait for any of them to finish
+            done_futures = wait(list(download_futures) + list(compare_futures), return_when=FIRST_COMPLETED)[0]
+            # For each finished future
+            for done_future in done_futures:
+                # If it is a download
+                if done_future in download_futures:
+                    # Get its pair and URL
+                    pair_index, target_url = download_futures.pop(done_future)
+                    # Try to get the file name
+                    try:
+                        pair_files[pair_index][target_url] = done_future.result()
+                    # If the download failed (any error in the worker)
+                    except Exception as error:
+                        # Print a warning
+                        print(f'Warning: Download of {target_url} failed ({error!r}).')
+                        # Record the failure
+                        pair_files[pair_index][target_url] = None
+                    # Submit the comparison if both files are there
+                    check_pair(pair_index)
+                # Otherwise (a comparison)
+                else:
+                    # Get its pair
+                    pair_index = compare_futures.pop(done_future)
+                    # Try to get the rows and comparisons
+                    try:
+                        pair_rows[pair_index], comparisons = done_future.result()
+                    # If the comparison failed (any error in the worker)
+                    except Exception as error:
+                        # Print a warning
+                        print(f'Warning: Pair {pairs[pair_index][0].split("/")[-1]} failed ({error!r}).')
+                    # Otherwise
+                    else:
+                        # Save the comparisons (in one transaction)
+                        store.add_comparisons(comparisons, *t_compare.get_file_details(pairs[pair_index][0]))
+                    # Finish the pair
+                    finish_pair(pair_index)
+            # Start any pairs that now fit
+            start_pairs()
+
+    # Close the store and manifest
+    store.close()
+    manifest.close()
+    # Report the download throughput
+    scheduler.report()
+    # Write the report (the rows in the order of the pairs)
+    report_path = s_comparison_stats.write_report([row for pair_index in sorted(pair_rows)
+                                                   for row in pair_rows[pair_index]], report_name)
+    # Print update
+    print(f"{len(pair_rows)}/{len(pairs)} pairs compared in {around(time() - stime, decimals=2)} seconds, "
+          f"report written to {report_path}.")
+    # Return the path
+    return report_path
+
+
+if __name__ == '__main__':
+
+    # USER-DEFINED INPUTS
+    # Product base name (e.g. for VNP43MA3 versus VJ143MA3, enter "43MA3")
+    product_base = "43MA3"
+    # Tile list
+    tile_list = ["h09v05", "h12v04", "h17v01"]
+    # Date list
+    date_list = [datetime.date(year=2021, month=7, day=20)]
+    # Albedo saturation value for plots
+    albedo_sat = 1
+    # Save the figures? True/False
+    save_figures = False
+    # Disk budget for the granules in the pipeline (bytes)
+    max_disk_bytes = 20 * 1024 ** 3
+    # Number of download threads and comparison worker processes (None for every core)
+    max_downloads = 8
+    max_workers = None
+
+    # END USER INPUTS
+
+    # Call main function
+    main(product_base,
+         tile_list,
+         date_list,
+         albedo_sat=albedo_sat,
+         save_figs=save_figures,
+         max_disk_bytes=max_disk_bytes,
+         max_downloads=max_downloads,
+         max_workers=max_workers)
@@ -0,0 +1,232 @@
+import csv
+import dotenv
+from pathlib import Path
+from os import environ
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
+import t_band_cache
+import t_compare
+import t_comparison_store
+import t_granule_pairs
+import t_laads_tools
+
+# Load the environmental variables
+dotenv.load_dotenv()
+
+
+# Get the report row for the comparison of a band (a dictionary of column name to value)
+def get_report_row(comparison, product, tile, year, doy, key):
+    # Get the t-test, regression and quantiles of the differences
+    t_stat, p_value = comparison.get_t_test()
+    slope, intercept, r_value = comparison.get_regression()
+    diff_q05, diff_median, diff_q95 = comparison.get_diff_quantiles([0.05, 0.5, 0.95])
+    # Return the row
+    return {"product": product,
+            "tile": tile,
+            "year": year,
+            "doy": doy,
+            "band": key,
+            "vnp_count": comparison.vnp_count,
+            "vj1_count": comparison.vj1_count,
+            "count": comparison.count,
+            "value_min": comparison.overall_min,
+            "value_max": comparison.overall_max,
+            "vnp_mean": comparison.vnp_mean,
+            "vj1_mean": comparison.vj1_mean,
+            "diff_mean": comparison.diff_mean,
+            "diff_std": comparison.get_diff_std(),
+            "diff_min": comparison.diff_min,
+            "diff_max": comparison.diff_max,
+            "diff_q05": diff_q05,
+            "diff_median": diff_median,
+            "diff_q95": diff_q95,
+            "t_stat": t_stat,
+            "p_value": p_value,
+            "rmse": comparison.get_rmse(),
+            "relative_bias": comparison.get_relative_bias(),
+            "slope": slope,
+            "intercept": intercept,
+            "r_value": r_value,
+            "kde_overlap": t_compare.get_kde_overlap(comparison, bw_adjust=0.5)}
+
+
+# Worker function: compare every band of a pair of files (statistics only, block by block, no arrays kept)
+# Returns a list of report rows, one per band, and a dictionary of band to comparison (for the comparison store)
+# If use_cache, the decoded bands of local files are taken from (or added to) the decoded band cache (off by default,
+# as each band of each granule adds a ~23 MB file to the cache directory, see t_band_cache)
+def pair_worker(vnp_file_name, vj1_file_name, remote=False, use_cache=False):
+    # If reading the files remotely, connect to LAADS
+    session_obj = t_laads_tools.connect_to_laads() if remote else None
+    # Open the vnp and vj1 files as h5py File objects
+    vnp_file, vj1_file = t_compare.open_files(vnp_file_name, vj1_file_name, session_obj=session_obj)[:2]
+    # If either file could not be opened
+    if vnp_file is None:
+        # Raise an error (recorded as a failure by main)
+        raise OSError(f'Files {vnp_file_name} and {vj1_file_name} could not be opened.')
+    # Get the product, tile and date, and the settings for the product
+    product, tile, year, doy = t_compare.get_file_details(vnp_file_name)
+    keyword, figure_keyword, scale_factor = t_compare.get_product_settings(product)
+    # Open the decoded band cache (local files only)
+    cache = t_band_cache.DecodedBandCache() if use_cache and not remote else None
+    # List for the rows and dictionary for the comparisons
+    rows = []
+    comparisons = {}
+    # For each key (band) that begins with the product keyword
+    for key in t_compare.get_band_keys(vnp_file, keyword):
+        # Compare the band
+        comparison = t_compare.compare_file_band(vnp_file,
+                                                 vj1_file,
+                                                 key,
+                                                 scale_factor,
+                                                 value_counts=True,
+                                                 keep_arrays=False,
+                                                 cache=cache)
+        # Add its row and the comparison
+        rows.append(get_report_row(comparison, product, tile, year, doy, key))
+        comparisons[key] = comparison
+    # Close the files
+    vnp_file.close()
+    vj1_file.close()
+    # If there is a session
+    if session_obj is not None:
+        # Close it
+        session_obj.close()
+    # Return the rows and comparisons
+    return rows, comparisons
+
+
+# Write report rows to a CSV file in the output directory, returning its path
+def write_report(rows, report_name):
+    # Path to the report
+    report_path = Path(environ['output_files_path'] + report_name)
+    # Write the report
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["product"])
+        writer.writeheader()
+        writer.writerows(rows)
+    # Return the path
+    return report_path
+
+
+# Main function
+# Computes the comparison statistics of every band of a list of [vnp file, vj1 file] pairs, without plotting, and
+# writes them to a CSV report in the output directory (one row per product, tile, date and band, in the order of the
+# pairs). The pairs are spread over a pool of worker processes (max_workers=None uses every core); a pair that fails is
+# reported and left out. If store_comparisons, each band's comparison is also saved to the comparison store, so the
+# statistics can later be aggregated over any tiles, dates and bands (see get_aggregate_rows).
+# Returns the path to the report.
+def main(comparisons_list, report_name='comparison_stats.csv', max_workers=None, remote=False,
+         store_comparisons=True, use_cache=False):
+
+    # Open the comparison store (if saving to it)
+    store = t_comparison_store.ComparisonStore() if store_comparisons else None
+    # Dictionary of pair index to its rows
+    pair_rows = {}
+    # Start time
+    stime = time()
+    # Start a ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Submit each pair
+        future_events = {executor.submit(pair_worker, vnp_file_name, vj1_file_name, remote=remote,
+                                         use_cache=use_cache): pair_index
+                         for pair_index, (vnp_file_name, vj1_file_name) in enumerate(comparisons_list)}
+        # As each pair finishes
+        for completed_event in as_completed(future_events):
+            # Get the pair
+            pair_index = future_events[completed_event]
+            # Try to get the rows
+            try:
+                pair_rows[pair_index], comparisons = completed_event.result()
+            # If the pair failed (any error in the worker)
+            except Exception as error:
+                # Print a warning
+                print(f'Warning: Pair {comparisons_list[pair_index][0]} failed ({error!r}).')
+                # Skip to the next pair
+                continue
+            # If saving the comparisons
+            if store is not None:
+                # Save them (in one transaction)
+                store.add_comparisons(comparisons, *t_compare.get_file_details(comparisons_list[pair_index][0]))
+    # If there is a store
+    if store is not None:
+        # Close it
+        store.close()
+    # Put the rows in the order of the pairs
+    rows = [row for pair_index in sorted(pair_rows) for row in pair_rows[pair_index]]
+    # Write the report
+    report_path = write_report(rows, report_name)
+    # Print update
+    print(f"{len(rows)} bands of {len(pair_rows)}/{len(comparisons_list)} pairs written to {report_path} in "
+          f"{round(time() - stime, 2)} seconds.")
+    # Return the path
+    return report_path
+
+
+# Get the report rows aggregated from the comparison store for a product, one per band (optionally for lists of tiles
+# and bands and a range of dates, datetime.date objects, inclusive). The tile, year and DOY columns are replaced by the
+# number of tiles and the first and last dates merged into each row.
+def get_aggregate_rows(product, tiles=None, bands=None, start_date=None, end_date=None):
+    # Open the comparison store
+    store = t_comparison_store.ComparisonStore()
+    # List for the rows
+    rows = []
+    # Get the saved keys for the subset
+    keys = store.get_keys(product, tiles=tiles, bands=bands, start_date=start_date, end_date=end_date)
+    # For each band in the subset
+    for band in sorted({band for tile, date, band in keys}):
+        # Get the dates of the band
+        dates = [date for tile, date, key_band in keys if key_band == band]
+        # Merge its comparisons
+        comparison = store.get_comparison(product, tiles=tiles, bands=[band], start_date=start_date,
+                                          end_date=end_date)
+        # Get its row
+        row = get_report_row(comparison, product, None, None, None, band)
+        # Add it, with the number of tiles and the range of dates in place of the tile and date
+        rows.append({"product": product,
+                     "tiles": len({tile for tile, date, key_band in keys if key_band == band}),
+                     "start_date": min(dates).isoformat(),
+                     "end_date": max(dates).isoformat(),
+                     **{column: value for column, value in row.items()
+                        if column not in ("product", "tile", "year", "doy")}})
+    # Close the store
+    store.close()
+    # Return the rows
+    return rows
+
+
+if __name__ == '__main__':
+
+    # USER-DEFINED INPUTS
+    # Comparisons list
+    comparisons_list = [
+                        [str(Path('5000/VNP43MA3.A2021201.h09v05.001.2021277141246.h5')),
+                         str(Path('3194/VJ143MA3.A2021201.h09v05.002.2021209072428.h5'))],
+                        [str(Path('5000/VNP43MA3.A2021201.h12v04.001.2021277141433.h5')),
+                         str(Path('3194/VJ143MA3.A2021201.h12v04.002.2021209080251.h5'))],
+                        [str(Path('5000/VNP43MA3.A2021201.h17v01.001.2021277141743.h5')),
+                         str(Path('3194/VJ143MA3.A2021201.h17v01.002.2021209082154.h5'))],
+                        [str(Path('5000/VNP43MA4.A2021201.h09v05.001.2021277141246.h5')),
+                         str(Path('3194/VJ143MA4.A2021201.h09v05.002.2021209072428.h5'))],
+                        [str(Path('5000/VNP43MA4.A2021201.h12v04.001.2021277141433.h5')),
+                         str(Path('3194/VJ143MA4.A2021201.h12v04.002.2021209080251.h5'))],
+                        [str(Path('5000/VNP43MA4.A2021201.h17v01.001.2021277141743.h5')),
+                         str(Path('3194/VJ143MA4.A2021201.h17v01.002.2021209082154.h5'))]]
+    # Pair the granules in the output directory instead of using the comparisons list? True/False
+    find_pairs = False
+    # Number of worker processes (None for every core)
+    max_workers = None
+    # Keep the decoded bands in the band cache, so comparing the same granules again skips decoding? True/False
+    # (writes a ~23 MB .npy file per band per granule to band_cache/, or $band_cache_path, capped at 2 GiB)
+    use_cache = False
+
+    # END USER INPUTS
+
+    # If pairing the granules in the output directory
+    if find_pairs:
+        # Build the index of the newest VNP/VJ1 pairs, report the unpaired granules and compare every pair
+        pair_index = t_granule_pairs.build_pair_index()
+        pair_index.report()
+        comparisons_list = pair_index.get_pairs()
+
+    # Call main function
+    main(comparisons_list, max_workers=max_workers, use_cache=use_cache)
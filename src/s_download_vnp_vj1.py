@@ -1,66 +1,59 @@
 import t_laads_tools
+import t_download_manifest
+import t_async_download
+import t_download_journal
 import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import time
 from numpy import around
-from os import walk, environ
+from os import environ
 from dotenv import load_dotenv
 from pathlib import Path
 
 
 # Function for our multi-threaded workers to use
-def worker_function(target_url):
+def worker_function(target_url, session_pool, scheduler, expected_size=None, expected_checksum=None, journal=None):
     # Start time for the file
     ptime = time()
-    # Start a LAADS session (the requests session object is not thread-safe so we need one per thread)
-    s = t_laads_tools.connect_to_laads()
-    # Get the requested file from the URL
-    h5file = t_laads_tools.get_VIIRS_file(s, target_url, write_local=True)
+    # If there is a journal
+    if journal is not None:
+        # Record that the download has started
+        journal.mark_in_flight(target_url)
+    # Get this thread's LAADS session (reused for each of the thread's files, keeping the connection alive)
+    s = session_pool.get_session()
+    # Get the requested file from the URL (True if it was written and checked, otherwise None)
+    success = t_laads_tools.get_VIIRS_file(s,
+                                           target_url,
+                                           write_local=True,
+                                           return_file=False,
+                                           expected_size=expected_size,
+                                           expected_checksum=expected_checksum,
+                                           scheduler=scheduler)
     # Print the time taken
     print(f"{target_url.split('/')[-1]} downloaded in {around(time() - ptime, decimals=2)} seconds.")
-    # Return the file
-    return h5file
+    # Return whether the download succeeded
+    return success
 
 
-# Function to check whether files have already been downloaded
-def check_for_files(url_dict, tiles, dates, url_list=None):
+# Function to check whether files have already been downloaded (set difference of the catalog against the manifest)
+def check_for_files(url_dict, tiles, dates, manifest, url_list=None):
     # If no ongoing url list was provided
     if not url_list:
         # Make an empty list
         url_list = []
-    # For each tile
-    for tile in tiles:
-        # For each date
-        for date in dates:
-            # Get the file name
-            file_name = url_dict.get_url_from_date(tile, date, file_only=True)
-            # If the file has not previously been downloaded
-            if not check_for_file(file_name):
-                # Get the url from date
-                target_url = url_dict.get_url_from_date(tile, date)
-                # If there was an url
-                if target_url:
-                    # Add URL to list
-                    url_list.append(target_url)
+    # Get the files the catalog has for the tiles and dates
+    files_list = url_dict.get_files_from_dates(tiles, dates=dates)
+    # Get the names of the files that have not previously been downloaded
+    missing_names = {file_name for tile, date, file_name, target_url in files_list} - \
+        manifest.get_file_names(product=url_dict.data_product)
+    # Add the URLs of the missing files to the list
+    url_list.extend(target_url for tile, date, file_name, target_url in files_list if file_name in missing_names)
     # Return URL list
     return url_list
 
 
-# Function to check whether a single file has already been downloaded
-def check_for_file(file_name):
-    # For each file in the output directory
-    for root, dirs, files in walk(Path(environ['output_files_path'])):
-        for file in files:
-            # If it matches the file name
-            if file_name == file:
-                # Return True
-                return True
-    # If we made it this far, file was not found, return False
-    return False
-
-
-# Main function
-def main(archive_set, product, tiles, dates):
+# Function to get the URLs of the files that have not been downloaded, and their expected (size, checksum)
+def get_download_list(archive_set, product, tiles, dates, manifest):
 
     # Mark start time
     stime = time()
@@ -85,29 +78,124 @@ def main(archive_set, product, tiles, dates):
     # If the archive set is not 5000 (VNP products only)
     if archive_set != "5000":
         # Get list of URLs for VJ1 files that are not already downloaded
-        url_list = check_for_files(vj1_dict, tiles, dates, url_list=url_list)
+        url_list = check_for_files(vj1_dict, tiles, dates, manifest, url_list=url_list)
     # If the archive set is not 3194 (VJ1 products only)
     if archive_set != "3194":
         # Update list of URLs for VNP files that are not already downloaded
-        url_list = check_for_files(vnp_dict, tiles, dates, url_list=url_list)
+        url_list = check_for_files(vnp_dict, tiles, dates, manifest, url_list=url_list)
+    # Get the expected size and checksum of each file from the catalogs (keyed by file name)
+    file_names = [target_url.split('/')[-1] for target_url in url_list]
+    file_checks = {}
+    # If the archive set is not 5000 (VNP products only)
+    if archive_set != "5000":
+        file_checks.update(vj1_dict.get_file_checks(file_names))
+    # If the archive set is not 3194 (VJ1 products only)
+    if archive_set != "3194":
+        file_checks.update(vnp_dict.get_file_checks(file_names))
     # Report time elapsed
     print(f"List of {len(url_list)} URLs formed in {around(time() - ptime, decimals=2)} seconds.")
-    # Checkpoint the time
-    ptime = time()
 
-    # Start a ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        # Submit the tasks from the url list to the worker function
-        future_events = {executor.submit(worker_function, target_url): target_url for target_url in
-                         url_list}
-        # As each worker finishes its work (i.e. as each worker function finishes)
-        for completed_event in as_completed(future_events):
-            # The completed events are keys for the future_events dictionary
-            # Referencing the value for the key returns the inputs that were submitted to the worker (the url in this case)
-            original_task = future_events[completed_event]
-            # Calling the .result() method returns whatever is returned by the function the workers performed
-            # In this case we submitted tasks to the worker_function which returns the h5file object
-            h5obj = completed_event.result()
+    # Return the URL list and file checks
+    return url_list, file_checks
+
+
+# Main function
+# If a job name is provided the downloads are recorded in a journal, and running the same job again resumes it from the
+# journal (without rebuilding the URL list from the catalogs and manifest)
+def main(archive_set,
+         product,
+         tiles,
+         dates,
+         max_workers=8,
+         use_async=False,
+         max_in_flight=64,
+         job_name=None,
+         retry_failed=False):
+
+    # Mark start time
+    stime = time()
+
+    # Open the manifest of downloaded files
+    manifest = t_download_manifest.DownloadManifest()
+    # If there is a job name, open the journal
+    journal = t_download_journal.DownloadJournal(job_name) if job_name else None
+    # If the job has been started before
+    if journal is not None and journal.has_job():
+        # Get the URLs still to download from the journal
+        url_list, file_checks = journal.get_pending(retry_failed=retry_failed)
+        # Print update
+        print(f"Resuming job {job_name} with {len(url_list)} URLs to download.")
+    # Otherwise
+    else:
+        # Get the URLs of the files that have not been downloaded
+        url_list, file_checks = get_download_list(archive_set, product, tiles, dates, manifest)
+        # If there is a journal
+        if journal is not None:
+            # Queue the URLs
+            journal.queue(url_list, file_checks)
+
+    # Record a finished download in the manifest and journal
+    def record_download(target_url, file_path):
+        # If the download succeeded
+        if file_path is not None:
+            # Get the catalog size and checksum the file was verified against (if any)
+            expected_size, expected_checksum = file_checks.get(target_url.split('/')[-1], (None, None))
+            # Record the file in the manifest (with the verified checksum and size, so it is not hashed again)
+            manifest.add_file(file_path, checksum=expected_checksum, size=expected_size)
+            # If there is a journal
+            if journal is not None:
+                # Record the file as done
+                journal.mark_done(target_url, Path(file_path).stat().st_size)
+        # Otherwise, if there is a journal
+        elif journal is not None:
+            # Record the file as failed
+            journal.mark_failed(target_url)
+
+    # If using the asyncio engine
+    if use_async:
+        # Download the files (with up to max_in_flight transfers at once)
+        t_async_download.get_VIIRS_files(url_list,
+                                         max_in_flight=max_in_flight,
+                                         file_checks=file_checks,
+                                         on_start=journal.mark_in_flight if journal is not None else None,
+                                         on_complete=record_download)
+    # Otherwise (threads)
+    else:
+        # Request scheduler for the downloads (adapts the number of concurrent downloads, up to the number of workers)
+        scheduler = t_laads_tools.RequestScheduler(initial_limit=min(3, max_workers), max_limit=max_workers)
+        # Start a pool of LAADS sessions (one per worker thread) and a ThreadPoolExecutor
+        with t_laads_tools.LaadsSessionPool(pool_size=max_workers) as session_pool, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Submit the tasks from the url list to the worker function
+            future_events = {executor.submit(worker_function,
+                                             target_url,
+                                             session_pool,
+                                             scheduler,
+                                             *file_checks.get(target_url.split('/')[-1], (None, None)),
+                                             journal): target_url for target_url in url_list}
+            # As each worker finishes its work (i.e. as each worker function finishes)
+            for completed_event in as_completed(future_events):
+                # The completed events are keys for the future_events dictionary
+                # Referencing the value for the key returns the inputs that were submitted to the worker
+                # (the url in this case)
+                original_task = future_events[completed_event]
+                # Calling the .result() method returns whatever is returned by the function the workers performed
+                # In this case we submitted tasks to the worker_function which returns whether the download succeeded
+                success = completed_event.result()
+                # Record the download
+                record_download(original_task,
+                                Path(environ["output_files_path"] + original_task.split('/')[-1]) if success else None)
+
+        # Report the download throughput
+        scheduler.report()
+
+    # Close the manifest
+    manifest.close()
+    # If there is a journal
+    if journal is not None:
+        # Report the job's progress and close the journal
+        journal.report()
+        journal.close()
 
     # Report on the overall time taken
     print(f"All downloads finished in {around(time() - stime, decimals=2)} seconds.")
@@ -1,5 +1,9 @@
-from t_laads_tools import LaadsUrlsDict
+from t_laads_tools import spider_VIIRS_availability
 
-snpp_dict = LaadsUrlsDict("VNP43MA3", archive_set="5000")
-jpss1_dict = LaadsUrlsDict("VJ143MA3", archive_set="3194")
-snpp_dict = LaadsUrlsDict("VNP43MA4", archive_set="5000")
\ No newline at end of file
+# Update the SNPP and JPSS1 catalogs in one run (the day listings share one pool of worker threads)
+# Only the days since each catalog's latest file are fetched, and the superseded files are removed
+spider_VIIRS_availability([("VNP43MA3", "5000"),
+                           ("VJ143MA3", "3194"),
+                           ("VNP43MA4", "5000")],
+                          cleanup_old_files=True,
+                          max_workers=8)
@@ -1,14 +1,16 @@
-import h5py
 from pathlib import Path
-from os import environ, mkdir
-from os.path import exists
+from os import environ, makedirs
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import time
 import dotenv
 import numpy as np
 from matplotlib import pyplot as plt
 import matplotlib as mpl
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-import seaborn as sns
-from scipy import stats as st
+import t_band_cache
+import t_compare
+import t_granule_pairs
+import t_laads_tools
 
 # Load the environmental variables
 dotenv.load_dotenv()
@@ -21,264 +23,518 @@ mpl.rc('xtick', labelsize=12)
 mpl.rc('ytick', labelsize=12)
 plt.rcParams['text.usetex'] = False
 
-
-# Main function
-def main(vnp_file_name, vj1_file_name, albedo_sat, save_figs=False, show_figs=True):
+# Bin edges of the joint VNP/VJ1 histogram (fine, uniform bins the hexbin plot is drawn from), of the marginal
+# histograms (whole numbers of joint bins) and of the difference histogram
+joint_bins = np.linspace(-0.1, 1.2, 521)
+marginal_bins = np.arange(0, 1, 0.025)
+diff_bins = np.arange(-1, 1, 0.05)
 
 
-
-    # Open the vnp and vj1 files as h5py File objects
-    vnp_file = h5py.File(Path(environ['output_files_path'] + vnp_file_name))
-    vj1_file = h5py.File(Path(environ['output_files_path'] + vj1_file_name))
-
-    # Split the name for the different Archive Sets
-    vnp_file_name = vnp_file_name.split('\\')[-1]
-    # Split out the product, tile name and the date
-    split_name = vnp_file_name.split('.')
-    tile = split_name[2]
-    year = split_name[1][1:5]
-    doy = split_name[1][5:8]
-    product = split_name[0][3:]
+# Get the path for the results of a product, tile and date (making the directory if there is none)
+def get_results_path(product, tile, year, doy):
+    # Path for results
+    results_path = Path(environ['output_files_path'] + f'{product}_{year}_{doy}_{tile}/')
+    # Make the directory if there is none (several workers may try at once)
+    makedirs(results_path, exist_ok=True)
+    # Return the path
+    return results_path
+
+
+# Compare a band of the vnp and vj1 files, with the joint and difference histograms for the hexbin, marginal and
+# difference plots and the value counts for the kernel density estimates (the decoded bands taken from the cache, if
+# there is one). Returns a BandComparison object
+def compare_band(vnp_file, vj1_file, key, scale_factor, keep_arrays=True, cache=None):
+    # Return the comparison
+    return t_compare.compare_file_band(vnp_file,
+                                       vj1_file,
+                                       key,
+                                       scale_factor,
+                                       value_bins=joint_bins,
+                                       diff_bins=diff_bins,
+                                       value_counts=True,
+                                       keep_arrays=keep_arrays,
+                                       cache=cache)
+
+
+# Class for the six panel comparison figure of a band, built once and reused
+# The maps, colorbars, histogram bars and axes are made when the figure is built, with placeholder data. Plotting a
+# band swaps in its images, bar heights, KDE and hexbin artists, limits and labels, so the layout and colorbars are
+# not rebuilt for every band.
+class ComparisonFigure:
+
+    __slots__ = ["fig", "vnp_image", "vj1_image", "diff_image", "vnp_ax", "vj1_ax", "diff_map_ax", "kde_ax",
+                 "hexbin_ax", "histx_ax", "histy_ax", "diff_hist_ax", "hexbin", "one_to_one", "histx_bars",
+                 "histy_bars", "diff_bars", "hex_cmap", "hex_norm"]
+
+    def __init__(self, shape, marginal_bins, diff_bins):
+
+        # Get a colormap object for the maps (saturation set per band)
+        norm = mpl.colors.Normalize(vmin=0, vmax=1)
+        cmap = mpl.colormaps["seismic"].copy()
+        cmap.set_bad('black')
+        # Get a colormap object for the percent diffs
+        perc_norm = mpl.colors.Normalize(vmin=-0.1, vmax=0.1)
+        perc_cmap = mpl.colormaps["seismic"].copy()
+        perc_cmap.set_bad('k')
+        # Placeholder array for the maps
+        placeholder = np.full(shape, np.nan, dtype=np.float32)
+
+        # Establish figure
+        self.fig = plt.figure(figsize=(16, 10))
+
+        # Subplot 1: VNP map
+        self.vnp_ax = self.fig.add_subplot(2, 3, 1)
+        self.vnp_image = self.vnp_ax.imshow(placeholder, cmap=cmap, norm=norm)
+        # Make the tick marks invisible
+        self.vnp_ax.get_xaxis().set_visible(False)
+        self.vnp_ax.get_yaxis().set_visible(False)
+        # Set up the colorbar by dividing the subplot with an extra axis
+        divider = make_axes_locatable(self.vnp_ax)
+        cax = divider.append_axes("right", size="5%", pad=0.05)
+        self.fig.colorbar(self.vnp_image, cax=cax)
+
+        # Subplot 2: VJ1 map
+        self.vj1_ax = self.fig.add_subplot(2, 3, 2)
+        self.vj1_image = self.vj1_ax.imshow(placeholder, cmap=cmap, norm=norm)
+        # Make the tick marks invisible
+        self.vj1_ax.get_xaxis().set_visible(False)
+        self.vj1_ax.get_yaxis().set_visible(False)
+        # Set up the colorbar by dividing the subplot with an extra axis
+        divider = make_axes_locatable(self.vj1_ax)
+        cax = divider.append_axes("right", size="5%", pad=0.05)
+        self.fig.colorbar(self.vj1_image, cax=cax)
+
+        # Subplot 3: Difference map
+        self.diff_map_ax = self.fig.add_subplot(2, 3, 3)
+        self.diff_image = self.diff_map_ax.imshow(placeholder, cmap=perc_cmap, norm=perc_norm)
+        # Make the tick marks invisible
+        self.diff_map_ax.get_xaxis().set_visible(False)
+        self.diff_map_ax.get_yaxis().set_visible(False)
+        # Set up the colorbar by dividing the subplot with an extra axis
+        divider = make_axes_locatable(self.diff_map_ax)
+        cax = divider.append_axes("right", size="5%", pad=0.05)
+        cbar = self.fig.colorbar(self.diff_image, cax=cax, ticks=[-0.1, 0, 0.1])
+        # Set custom tick labels for the colorbar
+        cbar.ax.set_yticklabels(['< -0.1', '0', '> +0.1'])
+
+        # Subplot 4: Kernel Density Plot (drawn per band)
+        self.kde_ax = self.fig.add_subplot(2, 3, 4)
+
+        # Subplot 5: Complicated hexbin + histograms plot
+        ax = self.fig.add_subplot(2, 3, 5)
+        # Turn off original axis for subplot (we're just going to use the space)
+        ax.axis('off')
+        # Histogram size (height for top histogram, width for right histogram)
+        hist_size = 0.03
+        # Space between each histogram and axis
+        spacing = 0.002
+
+        # Definitions for the hexbin plot axes based on spatial properties of the subplot
+        left = ax.get_position().x0
+        width = ax.get_position().x1 - ax.get_position().x0 - hist_size
+        bottom = ax.get_position().y0
+        height = ax.get_position().y1 - ax.get_position().y0 - hist_size
+
+        # Define the three plot spaces
+        rect_hexbin = [left, bottom, width, height]
+        rect_histx = [left, bottom + height + spacing, width, hist_size]
+        rect_histy = [left + width + spacing, bottom, hist_size, height]
+
+        # Get axes corresponding to the hexbin space
+        self.hexbin_ax = self.fig.add_axes(rect_hexbin)
+        # Get a colormap object for the hex bins
+        self.hex_norm = mpl.colors.Normalize(vmin=1, vmax=5000)
+        self.hex_cmap = mpl.colormaps["jet"].copy()
+        # Set bad (np.nan) and under (< vmin) colors
+        self.hex_cmap.set_bad('k')
+        self.hex_cmap.set_under('white')
+        # No hexbin plot yet
+        self.hexbin = None
+        # Plot the 1:1 line (end set per band)
+        self.one_to_one = self.hexbin_ax.plot([0, 1], [0, 1], 'k', linestyle='--')[0]
+
+        # Set up the axis-mounted histograms
+        ax.tick_params(direction='in', top=True, right=True)
+        self.histx_ax = self.fig.add_axes(rect_histx)
+        self.histx_ax.tick_params(direction='in', labelbottom=False)
+        self.histx_ax.axis('off')
+        self.histy_ax = self.fig.add_axes(rect_histy)
+        self.histy_ax.tick_params(direction='in', labelleft=False)
+        self.histy_ax.axis('off')
+
+        # Draw the histogram bars (heights set per band)
+        self.histx_bars = self.histx_ax.hist(marginal_bins[:-1],
+                                             bins=marginal_bins,
+                                             weights=np.zeros(len(marginal_bins) - 1),
+                                             rwidth=0.9,
+                                             color='dimgrey')[2]
+        self.histy_bars = self.histy_ax.hist(marginal_bins[:-1],
+                                             bins=marginal_bins,
+                                             weights=np.zeros(len(marginal_bins) - 1),
+                                             orientation='horizontal',
+                                             rwidth=0.9,
+                                             color='dimgrey')[2]
+
+        # Subplot 6: Histogram of differences
+        self.diff_hist_ax = self.fig.add_subplot(2, 3, 6)
+        # Draw the major tick gridlines (zorder controls plotting order)
+        self.diff_hist_ax.grid(which='major', axis='y', zorder=0)
+        # Draw the histogram bins (zorder of at least 3 was required to plot in the foreground)
+        self.diff_bars = self.diff_hist_ax.hist(diff_bins[:-1],
+                                           bins=diff_bins,
+                                           weights=np.zeros(len(diff_bins) - 1),
+                                           color='dimgrey',
+                                           zorder=3)[2]
+        self.diff_hist_ax.set_ylabel("Frequency")
+
+    # Plot a band's comparison on the figure
+    def update(self, comparison, key, product, tile, year, doy, figure_keyword, albedo_sat):
+
+        # Get the overall max and mins between the arrays
+        overall_max = comparison.overall_max
+        overall_min = comparison.overall_min
+
+        # Get 1 sample 2-tailed t-test to see if mean of differences is non-zero
+        diff_mean = comparison.diff_mean
+        t_stat, p_value = comparison.get_t_test()
+
+        # Subplots 1-3: swap in the maps (the colorbars follow the images' limits)
+        self.vnp_image.set_data(comparison.vnp_array)
+        self.vnp_image.set_clim(0, albedo_sat)
+        self.vnp_ax.set_title(f"VNP{product}")
+        self.vj1_image.set_data(comparison.vj1_array)
+        self.vj1_image.set_clim(0, albedo_sat)
+        self.vj1_ax.set_title(f"Layer: {key}, Tile: {tile}, Year: {year}, DOY: {doy} \n\n VJ1{product}")
+        self.diff_image.set_data(comparison.diff_array)
+        self.diff_map_ax.set_title(f"Difference (VNP{product} - VJ1{product})")
+
+        # Subplot 4: Kernel Density Plot
+        # Remove the previous band's density plots
+        for artist in list(self.kde_ax.collections) + list(self.kde_ax.lines):
+            artist.remove()
+        # Bandwidth for smoothing
+        bandwidth = 0.5
+        # For the VNP and VJ1 data
+        for value_counts, color, label in ((comparison.vnp_value_counts, 'C0', f"VNP{product}"),
+                                           (comparison.vj1_value_counts, 'C1', f"VJ1{product}")):
+            # Get the kernel density estimate (from the value counts, same as seaborn's kdeplot with bw_adjust)
+            support, density = t_compare.get_kde(value_counts, comparison.scale_factor, bw_adjust=bandwidth)
+            # If there is an estimate
+            if density is not None:
+                # Fill it
+                self.kde_ax.fill_between(support,
+                                         density,
+                                         facecolor=mpl.colors.to_rgba(color, 0.25),
+                                         edgecolor=mpl.colors.to_rgba(color, 1),
+                                         label=label)
+        # Rescale to the new density plots (densities start at 0)
+        self.kde_ax.relim()
+        self.kde_ax.autoscale_view()
+        self.kde_ax.set_ylim(bottom=0)
+        # Set axis labels and title
+        self.kde_ax.set_xlabel(figure_keyword)
+        self.kde_ax.set_ylabel("Density")
+        self.kde_ax.set_title(f"Kernel Density Estimates (bandwidth: {bandwidth})")
+        # If there are density plots
+        if self.kde_ax.collections:
+            # Add a legend (labelled from the plots, so a missing estimate does not shift the labels)
+            self.kde_ax.legend()
+        # Otherwise, if the previous band left a legend
+        elif self.kde_ax.get_legend() is not None:
+            # Remove it
+            self.kde_ax.get_legend().remove()
+
+        # Subplot 5: hexbin + histograms plot
+        # If there is a previous hexbin plot
+        if self.hexbin is not None:
+            # Remove it
+            self.hexbin.remove()
+        # Centres of the joint histogram bins
+        centres = (comparison.value_bins[:-1] + comparison.value_bins[1:]) / 2
+        # Rows (VNP bins) and columns (VJ1 bins) with any pairs
+        vnp_occupied = np.flatnonzero(comparison.joint_hist.any(axis=1))
+        vj1_occupied = np.flatnonzero(comparison.joint_hist.any(axis=0))
+        # If there are any pairs
+        if vnp_occupied.size:
+            # Extent of the pairs (the edges of the outermost occupied bins)
+            extent = (comparison.value_bins[vnp_occupied[0]], comparison.value_bins[vnp_occupied[-1] + 1],
+                      comparison.value_bins[vj1_occupied[0]], comparison.value_bins[vj1_occupied[-1] + 1])
+            # Get the bin centres and counts within the extent
+            vnp_grid, vj1_grid = np.meshgrid(centres[vnp_occupied[0]:vnp_occupied[-1] + 1],
+                                             centres[vj1_occupied[0]:vj1_occupied[-1] + 1],
+                                             indexing='ij')
+            counts = comparison.joint_hist[vnp_occupied[0]:vnp_occupied[-1] + 1,
+                                           vj1_occupied[0]:vj1_occupied[-1] + 1]
+        # Otherwise
+        else:
+            # Empty plot
+            extent = None
+            vnp_grid = vj1_grid = counts = np.empty(0)
+        # Plot hexbin plot from the joint histogram (each bin centre weighted by its count, the counts summed per hex)
+        self.hexbin = self.hexbin_ax.hexbin(vnp_grid.ravel(),
+                                            vj1_grid.ravel(),
+                                            C=counts.ravel(),
+                                            reduce_C_function=np.sum,
+                                            gridsize=50,
+                                            extent=extent,
+                                            cmap=self.hex_cmap,
+                                            norm=self.hex_norm)
+        # Move the end of the 1:1 line
+        self.one_to_one.set_data([0, overall_max], [0, overall_max])
+        # Set axes limits and labels
+        self.hexbin_ax.set_xlim(overall_min, overall_max)
+        self.hexbin_ax.set_ylim(overall_min, overall_max)
+        self.hexbin_ax.set_xlabel(f'VNP{product} {figure_keyword}')
+        self.hexbin_ax.set_ylabel(f'VJ1{product} {figure_keyword}')
+        # Get the marginal histograms from the joint histogram (rebinned into the bars)
+        vnp_hist = comparison.get_vnp_hist(bins=marginal_bins)
+        vj1_hist = comparison.get_vj1_hist(bins=marginal_bins)
+        # Set the histogram bar heights
+        for bar, count in zip(self.histx_bars, vnp_hist):
+            bar.set_height(count)
+        for bar, count in zip(self.histy_bars, vj1_hist):
+            bar.set_width(count)
+        # Set axis limits
+        self.histx_ax.set_ylim(0, vnp_hist.max() * 1.05 or 1)
+        self.histy_ax.set_xlim(0, vj1_hist.max() * 1.05 or 1)
+        self.histx_ax.set_xlim(self.hexbin_ax.get_xlim())
+        self.histy_ax.set_ylim(self.hexbin_ax.get_ylim())
+
+        # Subplot 6: Histogram of differences
+        # Set the bar heights (fraction of all the pixels)
+        frequencies = comparison.diff_hist / comparison.diff_array.size
+        for bar, frequency in zip(self.diff_bars, frequencies):
+            bar.set_height(frequency)
+        # Construct title label
+        title_label = 'Differences: '
+        title_label += u'\u03bc:' + f'{np.around(diff_mean, decimals=3)} '
+        title_label += f't: {np.around(t_stat, decimals=2)} '
+
+        if p_value < 0.01:
+            p_value_label = '<0.01'
+        else:
+            p_value_label = np.around(p_value, decimals=2)
+
+        title_label += f'p: {p_value_label}'
+
+        # Set limits and labels
+        self.diff_hist_ax.set_title(title_label)
+        self.diff_hist_ax.set_xlim(comparison.diff_min, comparison.diff_max)
+        self.diff_hist_ax.set_ylim(0, frequencies.max() * 1.05 or 1)
+        self.diff_hist_ax.set_xlabel(f"Difference (VNP{product} - VJ1{product})")
+
+
+# Dictionary of the figures built by this process, keyed by the shape of the maps (reused from band to band)
+comparison_figures = {}
+
+
+# Plot the comparison of a band as a six panel figure, saving and/or showing it
+# When the figure is not shown, the figure built for the first band of this shape is reused (the Agg backend is
+# forced, so no window is ever opened); a shown figure is built fresh and closed afterwards
+def plot_band(comparison, key, product, tile, year, doy, figure_keyword, albedo_sat, results_path, save_figs=False,
+              show_figs=True):
 
     # If it's the harvard forest tile
     if tile == 'h12v04':
         # Adjust saturation for albedo
         albedo_sat = 0.6
 
-# Establish the keywords and scale factor for the product
-    # <> support dictionary?
-    keyword = "Albedo"
-    figure_keyword = "Albedo"
-    scale_factor = 0.001
-    if product == "43MA4":
-        keyword = "Nadir"
-        figure_keyword = "NBAR"
-        scale_factor = 0.0001
+    # If showing figures
+    if show_figs:
+        # Build a new figure
+        figure = ComparisonFigure(comparison.vnp_array.shape, marginal_bins, comparison.diff_bins)
+    # Otherwise
+    else:
+        # If the backend is interactive
+        if mpl.get_backend().lower() != 'agg':
+            # Switch to the non-interactive Agg backend (closes any open figures)
+            plt.switch_backend('Agg')
+            comparison_figures.clear()
+        # If there is no figure for this shape yet
+        if comparison.vnp_array.shape not in comparison_figures:
+            # Build one
+            comparison_figures[comparison.vnp_array.shape] = ComparisonFigure(comparison.vnp_array.shape,
+                                                                              marginal_bins,
+                                                                              comparison.diff_bins)
+        # Get the figure
+        figure = comparison_figures[comparison.vnp_array.shape]
+
+    # Plot the band
+    figure.update(comparison, key, product, tile, year, doy, figure_keyword, albedo_sat)
+
+    # If saving figures
+    if save_figs:
+        figure.fig.savefig(Path(str(results_path) + f'/{key}.png'), dpi='figure', format='png')
+    # If showing figures
+    if show_figs:
+        plt.show()
+        # Close figure
+        plt.close(figure.fig)
 
-    # Path for results
-    results_path = Path(environ['output_files_path'] + f'{product}_{year}_{doy}_{tile}/')
 
-    # If there is no directory for these results
-    if not exists(results_path):
-        # Make one
-        mkdir(results_path)
-
-    # Get a colormap object for the percent diffs
-    perc_norm = mpl.colors.Normalize(vmin=-0.1, vmax=0.1)
-    cmap = mpl.cm.get_cmap("seismic").copy()
-    cmap.set_bad('k')
-    perc_cmap = mpl.cm.ScalarMappable(cmap=cmap, norm=perc_norm)
-
-    # For each key (band)
-    for key in vnp_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'].keys():
-        # If the key begins with the product keyword
-        if key.split('_')[0] == keyword:
-
-            # Get the arrays for the specific band
-            vnp_array = np.array(vnp_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][key])
-            vj1_array = np.array(vj1_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][key])
-
-            # Swap the fill values (32767 for signed 16 bit integer) for numpy NaN values
-            vnp_filter_array = np.where(vnp_array != 32767, vnp_array, np.nan)
-            vj1_filter_array = np.where(vj1_array != 32767, vj1_array, np.nan)
-
-            # Get the quality flag band key
-            quality_key = f'BRDF_Albedo_Band_Mandatory_Quality_' + key.split('_')[-1]
-
-            # Get the quality flag arrays for the band
-            vnp_qual = np.array(vnp_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][quality_key])
-            vj1_qual = np.array(vj1_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][quality_key])
-
-            # Swap the low quality values (>0 in the quality flags) for numpy NaN values
-            vnp_filter_array = np.where(vnp_qual == 0, vnp_filter_array, np.nan)
-            vj1_filter_array = np.where(vj1_qual == 0, vj1_filter_array, np.nan)
-
-            # Subtract the VJ1 band values from the SNPP values, apply scale factor
-            diff_array = np.multiply(np.subtract(vnp_filter_array, vj1_filter_array), scale_factor)
-
-            # Transform to a 1D arrays
-            oned_diff = np.reshape(diff_array, diff_array.shape[0] * diff_array.shape[1])
-
-            # Apply the scale factors
-            vnp_filter_array = np.multiply(vnp_filter_array, scale_factor)
-            vj1_filter_array = np.multiply(vj1_filter_array, scale_factor)
-
-            # Transform to a 1D arrays
-            oned_vnp = np.reshape(vnp_filter_array, vnp_filter_array.shape[0] * vnp_filter_array.shape[1])
-            oned_vj1 = np.reshape(vj1_filter_array, vj1_filter_array.shape[0] * vj1_filter_array.shape[1])
-
-            # Get the overall max and mins between the arrays
-            overall_max = max(np.nanmax(vnp_filter_array), np.nanmax(vj1_filter_array))
-            overall_min = min(np.nanmin(vnp_filter_array), np.nanmin(vj1_filter_array))
-
-            # Get 1 sample 2-tailed t-test to see if mean of differences is non-zero
-            diff_mean = np.nanmean(oned_diff)
-            t_stat, p_value = st.ttest_1samp(a=oned_diff, popmean=0, nan_policy='omit')
-
-            # PLOTTING DATA
-
-            # Get a colormap object
-            norm = mpl.colors.Normalize(vmin=0, vmax=albedo_sat)
-            cmap = mpl.cm.get_cmap("seismic").copy()
-            cmap.set_bad('black')
-            my_cmap = mpl.cm.ScalarMappable(cmap=cmap, norm=norm)
-
-            # Establish figure
-            fig = plt.figure(figsize=(16, 10))
-
-            # Subplot 1: VNP map
-            ax = fig.add_subplot(2, 3, 1)
-            ax.imshow(vnp_filter_array, cmap=my_cmap.cmap, norm=norm)
-            ax.set_title(f"VNP{product}")
-            # Make the tick marks invisible
-            ax.get_xaxis().set_visible(False)
-            ax.get_yaxis().set_visible(False)
-            # Set up the colorbar by dividing the subplot with an extra axis
-            divider = make_axes_locatable(ax)
-            cax = divider.append_axes("right", size="5%", pad=0.05)
-            plt.colorbar(my_cmap, cax=cax)
-
-            # Subplot 2: VJ1 map
-            ax = fig.add_subplot(2, 3, 2)
-            ax.imshow(vj1_filter_array, cmap=my_cmap.cmap, norm=norm)
-            ax.set_title(f"Layer: {key}, Tile: {tile}, Year: {year}, DOY: {doy} \n\n VJ1{product}")
-            # Make the tick marks invisible
-            ax.get_xaxis().set_visible(False)
-            ax.get_yaxis().set_visible(False)
-            # Set up the colorbar by dividing the subplot with an extra axis
-            divider = make_axes_locatable(ax)
-            cax = divider.append_axes("right", size="5%", pad=0.05)
-            plt.colorbar(my_cmap, cax=cax)
-
-            # Subplot 3: Difference map
-            ax = fig.add_subplot(2, 3, 3)
-            ax.imshow(diff_array, cmap=perc_cmap.cmap, norm=perc_norm)
-            ax.set_title(f"Difference (VNP{product} - VJ1{product})")
-            # Make the tick marks invisible
-            ax.get_xaxis().set_visible(False)
-            ax.get_yaxis().set_visible(False)
-            # Set up the colorbar by dividing the subplot with an extra axis
-            divider = make_axes_locatable(ax)
-            cax = divider.append_axes("right", size="5%", pad=0.05)
-            cbar = plt.colorbar(perc_cmap, cax=cax, ticks=[-0.1, 0, 0.1])
-            # Set custom tick labels for the colorbar
-            cbar.ax.set_yticklabels(['< -0.1', '0', '> +0.1'])
-
-            # Subplot 4: Kernel Density Plot
-            ax = fig.add_subplot(2, 3, 4)
-            # Bandwidth for smoothing
-            bandwidth = 0.5
-            # Add VNP data
-            sns.kdeplot(oned_vnp,
-                        ax=ax,
-                        x=figure_keyword,
-                        fill=True,
-                        bw_adjust=bandwidth)
-            # Add VJ1 data
-            sns.kdeplot(oned_vj1,
-                        ax=ax,
-                        x=figure_keyword,
-                        fill=True,
-                        bw_adjust=bandwidth)
-            # Set axis label and title
-            ax.set_xlabel(figure_keyword)
-            ax.set_title(f"Kernel Density Estimates (bandwidth: {bandwidth})")
-            # Add legend
-            plt.legend(labels=[f"VNP{product}", f"VJ1{product}"])
-
-            # Subplot 5: Complicated hexbin + histograms plot
-            ax = fig.add_subplot(2, 3, 5)
-            # Turn off original axis for subplot (we're just going to use the space)
-            ax.axis('off')
-            # Histogram size (height for top histogram, width for right histogram)
-            hist_size = 0.03
-            # Space between each histogram and axis
-            spacing = 0.002
-
-            # Definitions for the hexbin plot axes based on spatial properties of the subplot
-            left = ax.__dict__['_position'].x0
-            width = ax.__dict__['_position'].x1 - ax.__dict__['_position'].x0 - hist_size
-            bottom = ax.__dict__['_position'].y0
-            height = ax.__dict__['_position'].y1 - ax.__dict__['_position'].y0 - hist_size
-
-            # Define the three plot spaces
-            rect_hexbin = [left, bottom, width, height]
-            rect_histx = [left, bottom + height + spacing, width, hist_size]
-            rect_histy = [left + width + spacing, bottom, hist_size, height]
-
-            # Get axes corresponding to the hexbin space
-            ax_hexbin = plt.axes(rect_hexbin)
-            # Get a colormap object for the hex bins
-            hex_norm = mpl.colors.Normalize(vmin=1, vmax=5000)
-            cmap = mpl.cm.get_cmap("jet").copy()
-            # Set bad (np.nan) and under (< vmin) colors
-            cmap.set_bad('k')
-            cmap.set_under('white')
-            # Form a colormap based on the normalization
-            hex_cmap = mpl.cm.ScalarMappable(cmap=cmap, norm=hex_norm)
-
-            # Plot hexbin plot
-            ax_hexbin.hexbin(oned_vnp, oned_vj1, gridsize=50, cmap=hex_cmap.cmap, norm=hex_norm)
-            # Plot the 1:1 line
-            ax_hexbin.plot([0, overall_max], [0, overall_max], 'k', linestyle='--')
-            # Set axes limits and labels
-            ax_hexbin.set_xlim(overall_min, overall_max)
-            ax_hexbin.set_ylim(overall_min, overall_max)
-            ax_hexbin.set_xlabel(f'VNP{product} {figure_keyword}')
-            ax_hexbin.set_ylabel(f'VJ1{product} {figure_keyword}')
-
-            # Set up the axis-mounted histograms
-            ax.tick_params(direction='in', top=True, right=True)
-            ax_histx = plt.axes(rect_histx)
-            ax_histx.tick_params(direction='in', labelbottom=False)
-            ax_histx.axis('off')
-            ax_histy = plt.axes(rect_histy)
-            ax_histy.tick_params(direction='in', labelleft=False)
-            ax_histy.axis('off')
-
-            # Plot the histograms
-            ax_histx.hist(oned_vnp, bins=np.arange(0, 1, 0.025), rwidth=0.9, color='dimgrey')
-            ax_histy.hist(oned_vj1, bins=np.arange(0, 1, 0.025), orientation='horizontal', rwidth=0.9, color='dimgrey')
-            # Set axis limits
-            ax_histx.set_xlim(ax_hexbin.get_xlim())
-            ax_histy.set_ylim(ax_hexbin.get_ylim())
-
-            # Subplot 6: Histogram of differences
-            ax = fig.add_subplot(2, 3, 6)
-            # Draw the major tick gridlines (zorder controls plotting order)
-            grid = ax.grid(which='major', axis='y', zorder=0)
-            # Draw the histogram bins (zorder of at least 3 was required to plot in the foreground)
-            ax.hist(oned_diff,
-                    bins=np.arange(-1, 1, 0.05),
-                    weights=np.zeros_like(oned_diff) + 1. / oned_diff.size,
-                    color='dimgrey',
-                    zorder=3)
-            # Construct title label
-            title_label = f'Differences: '
-            title_label += u'\u03bc:' + f'{np.around(diff_mean, decimals=3)} '
-            title_label += f't: {np.around(t_stat, decimals=2)} '
-
-            if p_value < 0.01:
-                p_value_label = '<0.01'
-            else:
-                p_value_label = np.around(p_value, decimals=2)
-
-            title_label += f'p: {p_value_label}'
-
-            # Set limits and labels
-            ax.set_title(title_label)
-            ax.set_xlim(np.nanmin(oned_diff), np.nanmax(oned_diff))
-            ax.set_xlabel(f"Difference (VNP{product} - VJ1{product})")
-            ax.set_ylabel(f"Frequency")
-
-            # If saving figures
-            if save_figs:
-                plt.savefig(Path(str(results_path) + f'/{key}.png'), dpi='figure', format='png')
-            # If showing figures
-            if show_figs:
-                plt.show()
-            # Close figure
-            plt.close()
+# Main function
+# If remote, the file names are LAADS URLs and only the bands that are compared are read from LAADS (HTTP Range requests)
+# If use_cache, the decoded bands of local files are kept in the decoded band cache (the next run does not decode them;
+# off by default, as each band of each granule adds a ~23 MB file to the cache directory, see t_band_cache)
+def main(vnp_file_name, vj1_file_name, albedo_sat, save_figs=False, show_figs=True, remote=False, use_cache=False):
+
+    # If reading the files remotely, connect to LAADS
+    session_obj = t_laads_tools.connect_to_laads() if remote else None
+    # Open the vnp and vj1 files as h5py File objects
+    vnp_file, vj1_file, vnp_remote, vj1_remote = t_compare.open_files(vnp_file_name,
+                                                                      vj1_file_name,
+                                                                      session_obj=session_obj)
+    # If either file could not be opened
+    if vnp_file is None:
+        # Exit
+        return
+
+    # Get the product, tile and date, and the settings for the product
+    product, tile, year, doy = t_compare.get_file_details(vnp_file_name)
+    keyword, figure_keyword, scale_factor = t_compare.get_product_settings(product)
+
+    # Path for results
+    results_path = get_results_path(product, tile, year, doy)
+    # Open the decoded band cache (local files only)
+    cache = t_band_cache.DecodedBandCache() if use_cache and not remote else None
+
+    # For each key (band) that begins with the product keyword
+    for key in t_compare.get_band_keys(vnp_file, keyword):
+        # Compare the band
+        comparison = compare_band(vnp_file, vj1_file, key, scale_factor, cache=cache)
+        # Plot it
+        plot_band(comparison,
+                  key,
+                  product,
+                  tile,
+                  year,
+                  doy,
+                  figure_keyword,
+                  albedo_sat,
+                  results_path,
+                  save_figs=save_figs,
+                  show_figs=show_figs)
+
+    # If the files were read remotely
+    if remote:
+        # Report the bytes transferred
+        print(f"Read {round((vnp_remote.bytes_transferred + vj1_remote.bytes_transferred) / 1e6, 2)} MB of "
+              f"{round((vnp_remote.size + vj1_remote.size) / 1e6, 2)} MB remotely.")
+        # Close the session
+        session_obj.close()
+
+
+# Worker function for run_comparisons: compare and plot one band of a pair of files (opening them in the worker)
+# Returns the comparison without its arrays (so it is cheap to send back from the worker process)
+def band_worker(vnp_file_name, vj1_file_name, key, albedo_sat, save_figs=True, remote=False, use_cache=False):
+    # If reading the files remotely, connect to LAADS
+    session_obj = t_laads_tools.connect_to_laads() if remote else None
+    # Open the vnp and vj1 files as h5py File objects
+    vnp_file, vj1_file, vnp_remote, vj1_remote = t_compare.open_files(vnp_file_name,
+                                                                      vj1_file_name,
+                                                                      session_obj=session_obj)
+    # If either file could not be opened
+    if vnp_file is None:
+        # Raise an error (recorded as a failure by run_comparisons)
+        raise OSError(f'Files {vnp_file_name} and {vj1_file_name} could not be opened.')
+    # Get the product, tile and date, and the settings for the product
+    product, tile, year, doy = t_compare.get_file_details(vnp_file_name)
+    keyword, figure_keyword, scale_factor = t_compare.get_product_settings(product)
+    # Open the decoded band cache (local files only)
+    cache = t_band_cache.DecodedBandCache() if use_cache and not remote else None
+    # Compare the band
+    comparison = compare_band(vnp_file, vj1_file, key, scale_factor, keep_arrays=save_figs, cache=cache)
+    # If saving figures
+    if save_figs:
+        # Plot the band (never shown from a worker)
+        plot_band(comparison,
+                  key,
+                  product,
+                  tile,
+                  year,
+                  doy,
+                  figure_keyword,
+                  albedo_sat,
+                  get_results_path(product, tile, year, doy),
+                  save_figs=True,
+                  show_figs=False)
+        # Drop the arrays
+        comparison.vnp_array = comparison.vj1_array = comparison.diff_array = None
+    # Close the files
+    vnp_file.close()
+    vj1_file.close()
+    # If there is a session
+    if session_obj is not None:
+        # Close it
+        session_obj.close()
+    # Return the comparison
+    return comparison
+
+
+# Compare (and plot) a list of [vnp file, vj1 file] pairs, spreading the (pair, band) work items over a pool of worker
+# processes (max_workers=None uses every core). A pair or band that fails is reported and recorded as None, without
+# stopping the batch. Returns a list with, for each pair (in the order given), a list of (band key, BandComparison or
+# None) in band order, or None if the pair's bands could not be listed.
+def run_comparisons(comparisons_list, albedo_sat, save_figs=True, max_workers=None, remote=False, use_cache=False):
+    # Dictionary of pair index to its band keys (None if the pair failed)
+    pair_keys = {}
+    # If reading the files remotely, connect to LAADS (to list the bands)
+    session_obj = t_laads_tools.connect_to_laads() if remote else None
+    # For each pair
+    for pair_index, (vnp_file_name, vj1_file_name) in enumerate(comparisons_list):
+        # Try to list its bands
+        try:
+            # Open the vnp and vj1 files (checking that both can be read)
+            vnp_file, vj1_file = t_compare.open_files(vnp_file_name, vj1_file_name, session_obj=session_obj)[:2]
+            # If either file could not be opened
+            if vnp_file is None:
+                # Raise an error
+                raise OSError
+            # Get the keys of the bands that begin with the product keyword
+            keyword = t_compare.get_product_settings(t_compare.get_file_details(vnp_file_name)[0])[0]
+            pair_keys[pair_index] = t_compare.get_band_keys(vnp_file, keyword)
+            # Close the files
+            vnp_file.close()
+            vj1_file.close()
+        # If it fails (missing or unreadable file)
+        except (OSError, KeyError, IndexError):
+            # Print a warning
+            print(f'Warning: Files {vnp_file_name} and {vj1_file_name} could not be opened.')
+            # Record the failure
+            pair_keys[pair_index] = None
+    # If there is a session
+    if session_obj is not None:
+        # Close it
+        session_obj.close()
+    # Dictionary of (pair index, band key) to comparison
+    results = {}
+    # Start time
+    stime = time()
+    # Start a ProcessPoolExecutor (each worker uses the non-interactive Agg backend, so it never opens a window)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=plt.switch_backend, initargs=('Agg',)) as executor:
+        # Submit each band of each pair
+        future_events = {executor.submit(band_worker, *comparisons_list[pair_index], key, albedo_sat,
+                                         save_figs=save_figs, remote=remote, use_cache=use_cache): (pair_index, key)
+                         for pair_index, keys in pair_keys.items() if keys is not None for key in keys}
+        # As each band finishes
+        for completed_event in as_completed(future_events):
+            # Get the pair and band
+            pair_index, key = future_events[completed_event]
+            # Try to get the result
+            try:
+                results[(pair_index, key)] = completed_event.result()
+            # If the band failed (any error in the worker)
+            except Exception as error:
+                # Print a warning
+                print(f'Warning: Band {key} of {comparisons_list[pair_index][0]} failed ({error!r}).')
+                # Record the failure
+                results[(pair_index, key)] = None
+    # Print update
+    print(f"{sum(comparison is not None for comparison in results.values())}/{len(future_events)} bands of "
+          f"{len(comparisons_list)} pairs compared in {round(time() - stime, 2)} seconds.")
+    # Return the results in the order of the pairs and bands
+    return [[(key, results[(pair_index, key)]) for key in pair_keys[pair_index]]
+            if pair_keys[pair_index] is not None else None for pair_index in range(len(comparisons_list))]
 
 
 if __name__ == '__main__':
@@ -294,6 +550,13 @@ if __name__ == '__main__':
     show_figures = False
     # Save the figures? True/False
     save_figures = True
+    # Pair the granules in the output directory instead of using the comparisons list? True/False
+    find_pairs = False
+    # Number of worker processes for the batch (None for every core)
+    max_workers = None
+    # Keep the decoded bands in the band cache, so comparing the same granules again skips decoding? True/False
+    # (writes a ~23 MB .npy file per band per granule to band_cache/, or $band_cache_path, capped at 2 GiB)
+    use_cache = False
 
     # Comparisons list
     previous_list = [[str(Path('3397/VNP43MA3.A2021201.h12v04.002.2022121140615.h5')),
@@ -318,9 +581,24 @@ if __name__ == '__main__':
 
     # END USER INPUTS
 
-    for comparison in comparisons_list:
-        vnp_file = comparison[0]
-        vj1_file = comparison[1]
-
-        # Call main function
-        main(vnp_file, vj1_file, albedo_sat, save_figs=save_figures, show_figs=show_figures)
+    # If pairing the granules in the output directory
+    if find_pairs:
+        # Build the index of the newest VNP/VJ1 pairs, report the unpaired granules and compare every pair
+        pair_index = t_granule_pairs.build_pair_index()
+        pair_index.report()
+        comparisons_list = pair_index.get_pairs()
+
+    # If showing figures
+    if show_figures:
+        # Compare the pairs one at a time (so the figures appear in order)
+        for comparison in comparisons_list:
+            vnp_file = comparison[0]
+            vj1_file = comparison[1]
+
+            # Call main function
+            main(vnp_file, vj1_file, albedo_sat, save_figs=save_figures, show_figs=show_figures, use_cache=use_cache)
+    # Otherwise
+    else:
+        # Compare the pairs' bands in parallel
+        run_comparisons(comparisons_list, albedo_sat, save_figs=save_figures, max_workers=max_workers,
+                        use_cache=use_cache)
@@ -0,0 +1,256 @@
+import asyncio
+import aiohttp
+import hashlib
+import h5py
+import dotenv
+import t_laads_tools
+from random import uniform
+from time import time
+from os import environ, replace
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+
+# Download a VIIRS H5 file from LAADS to the output directory with an aiohttp session, streaming it chunk by chunk
+# Uses the same .part files, HTTP Range resumption and size/checksum (or h5py) checks as t_laads_tools.stream_VIIRS_file
+# The file writes and hashing run in worker threads, so a slow disk does not stall the other transfers on the loop
+# on_start is an optional function called with the URL each time a request for the file is sent
+# Returns the path to the file, or None if it failed
+async def fetch_VIIRS_file(session,
+                           target_url,
+                           in_flight,
+                           chunk_size=64 * 1024,
+                           max_attempts=8,
+                           base_back_off=1,
+                           max_back_off=120,
+                           expected_size=None,
+                           expected_checksum=None,
+                           on_start=None):
+    # Path to the output file and its partial file
+    file_path = Path(environ["output_files_path"] + target_url.split('/')[-1])
+    part_path = t_laads_tools.get_partial_path(file_path)
+    # Checksum of the bytes in the partial file
+    checksum = None
+    # For each attempt
+    for attempt in range(max_attempts):
+        # Get the number of bytes we already have
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        # Request the rest of the file (all of it if we have nothing yet)
+        headers = {"Range": f"bytes={offset}-"} if offset else None
+        # Server's requested wait (if any)
+        retry_after = None
+        # Try to write the rest of the file (in one of the in-flight slots)
+        try:
+            async with in_flight:
+                # If there is a start function
+                if on_start is not None:
+                    # Call it
+                    on_start(target_url)
+                # Send the request
+                async with session.get(target_url, headers=headers) as r:
+                    # If the range starts at or past the end of the file (the partial file should be complete)
+                    if r.status == 416:
+                        # Size of the file (the expected size, or the total of a "bytes */total" content range)
+                        remote_size = expected_size if expected_size is not None else \
+                            int(r.headers.get("Content-Range", "/-1").split('/')[-1])
+                        # If we are checking a checksum
+                        if expected_checksum is not None:
+                            # Hash the partial file (in a thread)
+                            checksum = await asyncio.to_thread(t_laads_tools.hash_file, part_path, None, chunk_size)
+                        # If the partial file does not match the size or checksum
+                        if (remote_size >= 0 and offset != remote_size) or \
+                                (checksum is not None and checksum.hexdigest() != expected_checksum):
+                            # Print a warning
+                            print(f'Warning: Partial download of {target_url} does not match the file, restarting.')
+                            # Remove the partial file (so the next attempt starts from zero)
+                            part_path.unlink(missing_ok=True)
+                            checksum = None
+                            # Try again
+                            continue
+                        # Stop downloading
+                        break
+                    # If we are being throttled or there was a server error
+                    if r.status == 429 or r.status >= 500:
+                        # Print a warning
+                        print(f'Warning, bad response ({r.status}) for {target_url}.')
+                        # Get the server's requested wait
+                        retry_after = t_laads_tools.get_retry_after(r)
+                    # Otherwise, if the request failed (client error)
+                    elif r.status not in (200, 206):
+                        # Print a warning
+                        print(f'Warning: Bad response ({r.status}) for {target_url}.')
+                        # Return None
+                        return None
+                    # Otherwise (the file is coming)
+                    else:
+                        # If the server sent the whole file (it ignored or did not receive the range)
+                        if r.status == 200:
+                            # Start the partial file again
+                            offset = 0
+                            # Size of the file from the response
+                            response_size = int(r.headers.get("Content-Length", -1))
+                        # Otherwise (partial content)
+                        else:
+                            # Size of the file (from the "bytes start-end/total" content range)
+                            response_size = int(r.headers.get("Content-Range", "/-1").split('/')[-1])
+                        # If we are checking a checksum
+                        if expected_checksum is not None:
+                            # Hash the bytes we already have (if resuming, in a thread)
+                            checksum = await asyncio.to_thread(t_laads_tools.hash_file, part_path, None,
+                                                               chunk_size) if offset else hashlib.md5()
+                        # Open the partial file (appending if resuming, in a thread)
+                        f = await asyncio.to_thread(open, part_path, 'ab' if offset else 'wb')
+                        # Write the response to it a chunk at a time (each write and hash in a thread)
+                        try:
+                            async for chunk in r.content.iter_chunked(chunk_size):
+                                await asyncio.to_thread(write_chunk, f, chunk, checksum)
+                        # Close the file (in a thread)
+                        finally:
+                            await asyncio.to_thread(f.close)
+                        # If the size is unknown, or the partial file has reached it
+                        if response_size < 0 or part_path.stat().st_size >= response_size:
+                            # Stop downloading
+                            break
+                        # Print a warning
+                        print(f'Warning: Download of {target_url} ended early, resuming.')
+        # If the connection dropped or timed out
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Print a warning
+            print(f'Warning: Download of {target_url} was interrupted, resuming.')
+        # If the server told us how long to wait
+        if retry_after is not None:
+            # Use it (capped)
+            back_off = min(retry_after, max_back_off)
+        # Otherwise
+        else:
+            # Exponential back off with full jitter (capped)
+            back_off = uniform(0, min(max_back_off, base_back_off * 2 ** attempt))
+        # Wait before trying again (outside the in-flight slot)
+        await asyncio.sleep(back_off)
+    # If we ran out of attempts
+    else:
+        # Print a warning (the partial file is kept, so the next run resumes it)
+        print(f'Warning: Download of {target_url} did not finish after {max_attempts} attempts.')
+        # Return None
+        return None
+    # If there is an expected size or checksum
+    if expected_size is not None or expected_checksum is not None:
+        # If we are checking a checksum but did not hash the file as it arrived (it was already complete)
+        if expected_checksum is not None and checksum is None:
+            # Hash the file (in a thread, so the other transfers keep going)
+            checksum = await asyncio.to_thread(t_laads_tools.hash_file, part_path, None, chunk_size)
+        # If the size or checksum does not match
+        if (expected_size is not None and part_path.stat().st_size != expected_size) or \
+                (expected_checksum is not None and checksum.hexdigest() != expected_checksum):
+            # Print a warning
+            print(f'Warning: File {target_url} does not match its catalog size/checksum. Possibly incomplete.')
+            # Remove the partial file (so the next attempt starts from scratch)
+            part_path.unlink(missing_ok=True)
+            # Return None
+            return None
+    # Otherwise, try to convert into an h5 object
+    else:
+        try:
+            # Open with h5py from disk in a thread (checks integrity)
+            await asyncio.to_thread(check_h5_file, part_path)
+        # If it fails (corrupt file)
+        except OSError:
+            # Print a warning
+            print(f'Warning: File {target_url} could not be converted to h5. Possibly incomplete.')
+            # Remove the partial file (so the next attempt starts from scratch)
+            part_path.unlink(missing_ok=True)
+            # Return None
+            return None
+    # Rename the partial file to the output file (atomic on the same filesystem)
+    replace(part_path, file_path)
+    # Return the path
+    return file_path
+
+
+# Write a chunk to an open file and add it to a checksum object (if any)
+def write_chunk(f, chunk, checksum=None):
+    # Write the chunk
+    f.write(chunk)
+    # If we are checking a checksum
+    if checksum is not None:
+        # Add the chunk to it
+        checksum.update(chunk)
+
+
+# Open and close a file with h5py (raises OSError if it is not a complete H5 file)
+def check_h5_file(file_path):
+    # Open and close the file
+    h5py.File(file_path, 'r').close()
+
+
+# Download a list of VIIRS H5 files from LAADS with up to max_in_flight transfers at once
+# file_checks is an optional dictionary of file name to expected (size, checksum), on_start an optional function called
+# with the URL as each request is sent, and on_complete an optional function called with (target_url, file path or
+# None) as each file finishes
+# Returns a dictionary of URL to file path (None for the files that failed)
+async def download_VIIRS_files(url_list,
+                               max_in_flight=64,
+                               file_checks=None,
+                               on_start=None,
+                               on_complete=None,
+                               chunk_size=64 * 1024,
+                               timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=120)):
+    # If there are no file checks
+    if file_checks is None:
+        # Use an empty dictionary
+        file_checks = {}
+    # Limit on the transfers in flight
+    in_flight = asyncio.Semaphore(max_in_flight)
+    # Dictionary for the results
+    results = {}
+    # Start time
+    stime = time()
+    # Open a session with the LAADS authorization header (its connector keeps the connections alive)
+    async with aiohttp.ClientSession(headers=t_laads_tools.get_laads_headers(),
+                                     connector=aiohttp.TCPConnector(limit=max_in_flight),
+                                     timeout=timeout) as session:
+
+        # Download a file and record the result
+        async def download(target_url):
+            # Get the expected size and checksum of the file (if any)
+            expected_size, expected_checksum = file_checks.get(target_url.split('/')[-1], (None, None))
+            # Download the file
+            file_path = await fetch_VIIRS_file(session,
+                                               target_url,
+                                               in_flight,
+                                               chunk_size=chunk_size,
+                                               expected_size=expected_size,
+                                               expected_checksum=expected_checksum,
+                                               on_start=on_start)
+            # Record the result
+            results[target_url] = file_path
+            # If there is a completion function
+            if on_complete is not None:
+                # Call it
+                on_complete(target_url, file_path)
+
+        # Download all the files
+        await asyncio.gather(*(download(target_url) for target_url in url_list))
+    # Print update
+    print(f"{sum(file_path is not None for file_path in results.values())}/{len(url_list)} files downloaded in "
+          f"{round(time() - stime, 2)} seconds.")
+    # Return the results
+    return results
+
+
+# Synchronous wrapper for download_VIIRS_files (runs the engine in its own event loop)
+def get_VIIRS_files(url_list,
+                    max_in_flight=64,
+                    file_checks=None,
+                    on_start=None,
+                    on_complete=None,
+                    chunk_size=64 * 1024):
+    # Run the engine and return the results
+    return asyncio.run(download_VIIRS_files(url_list,
+                                            max_in_flight=max_in_flight,
+                                            file_checks=file_checks,
+                                            on_start=on_start,
+                                            on_complete=on_complete,
+                                            chunk_size=chunk_size))
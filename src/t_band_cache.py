@@ -0,0 +1,148 @@
+import hashlib
+import dotenv
+import numpy as np
+import t_compare
+from os import environ, makedirs, replace, utime, getpid
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+
+# Class for an on-disk cache of decoded bands (scaled float32 arrays, NaN where fill or not best quality), as .npy files
+# Each entry is keyed by the granule file name, the band and quality flag dataset paths and the scale factor and fill
+# value, and tagged with the size and modification time of the granule, so an entry for a granule that has since
+# changed is removed instead of being used. Hits are read-only memory maps of the .npy files (no copy, no decoding).
+# The cache is kept under max_bytes by evicting the least recently used entries (by file modification time, which is
+# updated on every hit), so several processes can share it. Each entry is the size of a decoded band (about 23 MB for
+# a 2400 x 2400 tile), so the cache is opt-in (use_cache in the comparison scripts), lives in its own directory (the
+# band_cache_path environmental variable, or band_cache/ in the output files directory) and is capped at 2 GiB by
+# default.
+class DecodedBandCache:
+
+    __slots__ = ["cache_path", "max_bytes", "hits", "misses"]
+
+    def __init__(self, cache_path=None, max_bytes=2 * 1024 ** 3):
+
+        # If no cache path was provided
+        if cache_path is None:
+            # Use the cache directory (if one is set), otherwise a directory in the output files directory
+            cache_path = environ.get('band_cache_path', environ['output_files_path'] + 'band_cache/')
+        # Instantiate attributes
+        self.cache_path = Path(cache_path)
+        self.max_bytes = max_bytes
+        # Number of hits and misses
+        self.hits = 0
+        self.misses = 0
+        # Make the directory if there is none (several workers may try at once)
+        makedirs(self.cache_path, exist_ok=True)
+
+    # Get the path to the entry of a band of a granule (None if the granule is not a local file)
+    # Stale entries (for other versions of the granule) are removed
+    def get_entry_path(self, h5_file, band_path, quality_path, scale_factor, fill_value):
+        # Path to the granule (remote files opened from file objects have no path on disk)
+        file_path = Path(h5_file.filename)
+        # If it is not a local file
+        if not file_path.is_file():
+            # Return None
+            return None
+        # Hash of the entry's key (granule, datasets, scale factor and fill value)
+        key_hash = hashlib.md5(f"{file_path.name}|{band_path}|{quality_path}|{scale_factor}|{fill_value}"
+                               .encode()).hexdigest()
+        # Hash of the granule's version (size and modification time)
+        file_stat = file_path.stat()
+        version_hash = hashlib.md5(f"{file_stat.st_size}|{file_stat.st_mtime_ns}".encode()).hexdigest()[:8]
+        # For each entry of the key
+        for entry_path in self.cache_path.glob(f"{key_hash}_*.npy"):
+            # If it is for another version of the granule
+            if entry_path.stem != f"{key_hash}_{version_hash}":
+                # Remove it (missing_ok, in case another process got there first)
+                entry_path.unlink(missing_ok=True)
+        # Return the path
+        return self.cache_path / f"{key_hash}_{version_hash}.npy"
+
+    # Get a decoded band of an open granule (h5py File object) as a float32 array, from the cache if possible
+    # band_path and quality_path are the paths of the band and quality flag datasets in the file. The band is decoded
+    # block by block straight into a new entry on a miss. Returns a read-only memory map (or, for a granule that is
+    # not a local file, a decoded array)
+    def get_band(self, h5_file, band_path, quality_path, scale_factor, fill_value=32767, block_rows=256):
+        # Get the path to the entry
+        entry_path = self.get_entry_path(h5_file, band_path, quality_path, scale_factor, fill_value)
+        # If there is an entry
+        if entry_path is not None and entry_path.exists():
+            # Try to map it
+            try:
+                band_array = np.load(entry_path, mmap_mode='r')
+            # If it was evicted by another process in the meantime
+            except FileNotFoundError:
+                # Treat it as a miss
+                pass
+            # Otherwise
+            else:
+                # Mark it as recently used
+                utime(entry_path)
+                # Record the hit
+                self.hits += 1
+                # Return the memory map
+                return band_array
+        # Record the miss
+        self.misses += 1
+        # Get the band and quality flag datasets
+        band_dataset = h5_file[band_path]
+        quality_dataset = h5_file[quality_path]
+        # If the granule is not a local file
+        if entry_path is None:
+            # Decode the band into memory
+            band_array = np.empty(band_dataset.shape, dtype=np.float32)
+        # Otherwise
+        else:
+            # Decode the band into a new .npy file (temporary, so a partial entry is never read)
+            temp_path = entry_path.with_suffix(f".{getpid()}.tmp")
+            band_array = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=band_dataset.shape)
+        # For each block of rows (aligned with the band's chunks)
+        for block in t_compare.get_blocks(band_dataset, block_rows=block_rows):
+            # Decode it
+            band_array[block] = t_compare.scale_band(band_dataset[block],
+                                                     quality_dataset[block],
+                                                     scale_factor,
+                                                     fill_value=fill_value)[0]
+        # If the granule is not a local file
+        if entry_path is None:
+            # Return the decoded array
+            return band_array
+        # Write the entry out and move it into place
+        band_array.flush()
+        del band_array
+        replace(temp_path, entry_path)
+        # Evict entries until the cache is under its size
+        self.evict()
+        # Return the memory map of the entry
+        return np.load(entry_path, mmap_mode='r')
+
+    # Evict the least recently used entries until the cache is under its size (the newest entry is always kept)
+    def evict(self):
+        # Get the size and last use of each entry (skipping any removed by another process in the meantime)
+        entries = []
+        for entry_path in self.cache_path.glob("*.npy"):
+            try:
+                entry_stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry_path))
+        # Sort them from the least to the most recently used
+        entries.sort()
+        # Total size
+        total_size = sum(entry_size for entry_time, entry_size, entry_path in entries)
+        # While the cache is over its size (and there is more than the newest entry)
+        while total_size > self.max_bytes and len(entries) > 1:
+            # Remove the least recently used entry
+            entry_time, entry_size, entry_path = entries.pop(0)
+            entry_path.unlink(missing_ok=True)
+            total_size -= entry_size
+
+    # Remove every entry
+    def clear(self):
+        # For each entry
+        for entry_path in self.cache_path.glob("*.npy"):
+            # Remove it
+            entry_path.unlink(missing_ok=True)
@@ -0,0 +1,721 @@
+import h5py
+import dotenv
+import numpy as np
+from scipy import stats as st
+from os import environ
+from pathlib import Path
+import t_remote_h5
+
+# Load the environmental variables
+dotenv.load_dotenv()
+
+
+# Class for the comparison of a VNP band with the same VJ1 band
+# Holds the scaled float32 arrays (NaN where a pixel is fill or low quality) and the difference array (NaN where
+# either pixel is), with the valid pixel counts, the summary statistics of the differences and of the VNP/VJ1 pairs,
+# and (optionally) the joint histogram of the VNP/VJ1 pairs, the histogram of the differences and counts of each raw
+# value and raw difference (for the kernel density estimates and exact quantiles). The statistics are kept as counts,
+# means, sums of squared deviations (M2) and the co-moment of the pairs, so the t-test and regression do not need the
+# arrays and the comparisons of blocks can be merged.
+class BandComparison:
+
+    __slots__ = ["vnp_array", "vj1_array", "diff_array", "vnp_count", "vj1_count", "count", "diff_mean", "diff_m2",
+                 "diff_min", "diff_max", "overall_min", "overall_max", "vnp_mean", "vj1_mean", "vnp_m2", "vj1_m2",
+                 "co_moment", "value_bins", "diff_bins", "joint_hist", "diff_hist", "scale_factor",
+                 "vnp_value_counts", "vj1_value_counts", "diff_value_counts"]
+
+    def __init__(self, vnp_array=None, vj1_array=None, diff_array=None, value_bins=None, diff_bins=None,
+                 scale_factor=None, value_counts=False):
+
+        # Instantiate attributes
+        self.vnp_array = vnp_array
+        self.vj1_array = vj1_array
+        self.diff_array = diff_array
+        # Valid pixel counts (VNP, VJ1 and both)
+        self.vnp_count = 0
+        self.vj1_count = 0
+        self.count = 0
+        # Statistics of the differences
+        self.diff_mean = np.nan
+        self.diff_m2 = np.nan
+        self.diff_min = np.nan
+        self.diff_max = np.nan
+        # Range of the VNP and VJ1 values
+        self.overall_min = np.nan
+        self.overall_max = np.nan
+        # Means, sums of squared deviations and co-moment of the VNP/VJ1 pairs (pixels valid in both)
+        self.vnp_mean = np.nan
+        self.vj1_mean = np.nan
+        self.vnp_m2 = np.nan
+        self.vj1_m2 = np.nan
+        self.co_moment = np.nan
+        # Histogram bin edges (uniform, None for no histogram)
+        self.value_bins = value_bins
+        self.diff_bins = diff_bins
+        # Joint histogram counts of the VNP/VJ1 pairs (VNP bins on the rows, VJ1 bins on the columns)
+        self.joint_hist = np.zeros((len(value_bins) - 1, len(value_bins) - 1), dtype=np.int64) \
+            if value_bins is not None else None
+        # Histogram counts of the differences
+        self.diff_hist = np.zeros(len(diff_bins) - 1, dtype=np.int64) if diff_bins is not None else None
+        # Scale factor of the raw values
+        self.scale_factor = scale_factor
+        # Counts of each valid raw VNP and VJ1 value (indexed by value + 32768, None for no counts)
+        self.vnp_value_counts = np.zeros(65536, dtype=np.int64) if value_counts else None
+        self.vj1_value_counts = np.zeros(65536, dtype=np.int64) if value_counts else None
+        # Counts of each raw difference of the pixels valid in both (indexed by difference + 65535)
+        self.diff_value_counts = np.zeros(131071, dtype=np.int64) if value_counts else None
+
+    # Merge the comparison of another block into this one (counts and histograms are added, the moments combined)
+    def merge(self, other):
+        # If the other block has differences
+        if other.count:
+            # If this one has none
+            if not self.count:
+                # Take the other block's statistics
+                self.diff_mean = other.diff_mean
+                self.diff_m2 = other.diff_m2
+                self.vnp_mean = other.vnp_mean
+                self.vj1_mean = other.vj1_mean
+                self.vnp_m2 = other.vnp_m2
+                self.vj1_m2 = other.vj1_m2
+                self.co_moment = other.co_moment
+            # Otherwise
+            else:
+                # Combine the means, sums of squared deviations and co-moment (Chan et al.)
+                total = self.count + other.count
+                weight = self.count * other.count / total
+                delta = other.diff_mean - self.diff_mean
+                vnp_delta = other.vnp_mean - self.vnp_mean
+                vj1_delta = other.vj1_mean - self.vj1_mean
+                self.diff_mean += delta * other.count / total
+                self.diff_m2 += other.diff_m2 + delta ** 2 * weight
+                self.vnp_mean += vnp_delta * other.count / total
+                self.vj1_mean += vj1_delta * other.count / total
+                self.vnp_m2 += other.vnp_m2 + vnp_delta ** 2 * weight
+                self.vj1_m2 += other.vj1_m2 + vj1_delta ** 2 * weight
+                self.co_moment += other.co_moment + vnp_delta * vj1_delta * weight
+            # Combine the ranges of the differences (fmin/fmax ignore the NaN of an empty comparison)
+            self.diff_min = float(np.fmin(self.diff_min, other.diff_min))
+            self.diff_max = float(np.fmax(self.diff_max, other.diff_max))
+        # Add the counts
+        self.vnp_count += other.vnp_count
+        self.vj1_count += other.vj1_count
+        self.count += other.count
+        # Combine the ranges of the values
+        self.overall_min = float(np.fmin(self.overall_min, other.overall_min))
+        self.overall_max = float(np.fmax(self.overall_max, other.overall_max))
+        # If there is a joint histogram
+        if self.joint_hist is not None:
+            # Add it
+            self.joint_hist += other.joint_hist
+        # If there is a difference histogram
+        if self.diff_hist is not None:
+            # Add it
+            self.diff_hist += other.diff_hist
+        # If there are value counts
+        if self.vnp_value_counts is not None:
+            # Add them
+            self.vnp_value_counts += other.vnp_value_counts
+            self.vj1_value_counts += other.vj1_value_counts
+            self.diff_value_counts += other.diff_value_counts
+
+    # Get the histogram of the VNP values of the pairs (the joint histogram summed over the VJ1 bins)
+    # If bins are given (edges that fall on value_bins edges, e.g. coarser bins for plotting), it is rebinned into them
+    def get_vnp_hist(self, bins=None):
+        # Return the marginal histogram
+        return rebin_hist(self.joint_hist.sum(axis=1), self.value_bins, bins)
+
+    # Get the histogram of the VJ1 values of the pairs (the joint histogram summed over the VNP bins)
+    def get_vj1_hist(self, bins=None):
+        # Return the marginal histogram
+        return rebin_hist(self.joint_hist.sum(axis=0), self.value_bins, bins)
+
+    # Get quantiles of the differences (exact, from the counts of each raw difference, like np.quantile of the
+    # differences), or NaN for each if there are no counts
+    def get_diff_quantiles(self, quantiles):
+        # Return the quantiles
+        return get_count_quantiles(self.diff_value_counts, 65535, self.scale_factor, quantiles)
+
+    # Get quantiles of the valid VNP values (exact, from the counts of each raw value)
+    def get_vnp_quantiles(self, quantiles):
+        # Return the quantiles
+        return get_count_quantiles(self.vnp_value_counts, 32768, self.scale_factor, quantiles)
+
+    # Get quantiles of the valid VJ1 values (exact, from the counts of each raw value)
+    def get_vj1_quantiles(self, quantiles):
+        # Return the quantiles
+        return get_count_quantiles(self.vj1_value_counts, 32768, self.scale_factor, quantiles)
+
+    # Get the standard deviation of the differences (sample, like ttest_1samp)
+    def get_diff_std(self):
+        # If there are fewer than two differences
+        if self.count < 2:
+            # Return NaN
+            return np.nan
+        # Return the standard deviation
+        return np.sqrt(self.diff_m2 / (self.count - 1))
+
+    # Get the 1 sample 2-tailed t-test of whether the mean of the differences is non-zero
+    # Same result as scipy.stats.ttest_1samp(a=oned_diff, popmean=0, nan_policy='omit'), without the array
+    def get_t_test(self):
+        # If there are fewer than two differences
+        if self.count < 2:
+            # Return NaN for each
+            return np.nan, np.nan
+        # Standard error of the mean
+        std_error = self.get_diff_std() / np.sqrt(self.count)
+        # Get the t statistic (ignoring the division warning if the differences are constant)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_stat = self.diff_mean / std_error
+        # Get the 2-tailed p value
+        p_value = 2 * st.t.sf(np.abs(t_stat), self.count - 1)
+        # Return the t statistic and p value
+        return t_stat, p_value
+
+    # Get the root mean square difference
+    def get_rmse(self):
+        # If there are no differences
+        if not self.count:
+            # Return NaN
+            return np.nan
+        # Return the RMSE (the mean square is the variance plus the squared mean)
+        return np.sqrt(self.diff_m2 / self.count + self.diff_mean ** 2)
+
+    # Get the relative bias (mean difference over the mean VJ1 value, for the pixels valid in both)
+    def get_relative_bias(self):
+        # If there are no differences, or the VJ1 mean is 0
+        if not self.count or self.vj1_mean == 0:
+            # Return NaN
+            return np.nan
+        # Return the relative bias
+        return self.diff_mean / self.vj1_mean
+
+    # Get the least squares regression of the VJ1 values on the VNP values (the hexbin plot's axes)
+    # Returns the slope, intercept and correlation coefficient
+    def get_regression(self):
+        # If there are fewer than two pairs, or the VNP values are constant
+        if self.count < 2 or self.vnp_m2 == 0:
+            # Return NaN for each
+            return np.nan, np.nan, np.nan
+        # Get the slope and intercept
+        slope = self.co_moment / self.vnp_m2
+        intercept = self.vj1_mean - slope * self.vnp_mean
+        # Get the correlation coefficient (NaN if the VJ1 values are constant)
+        r_value = self.co_moment / np.sqrt(self.vnp_m2 * self.vj1_m2) if self.vj1_m2 else np.nan
+        # Return the regression
+        return slope, intercept, r_value
+
+
+# Scale a raw band (signed 16 bit integers) into a new float32 array, with NaN where the pixel is fill or its quality
+# flag is not 0 (best quality). Returns the scaled array and the valid mask.
+def scale_band(band_array, qual_array, scale_factor, fill_value=32767):
+    # Get the valid mask (not fill, best quality), combining in place
+    valid = band_array != fill_value
+    valid &= qual_array == 0
+    # Convert the band to float32 (the only copy) and apply the scale factor in place
+    scaled_array = band_array.astype(np.float32)
+    scaled_array *= np.float32(scale_factor)
+    # Swap the invalid pixels for numpy NaN values
+    scaled_array[~valid] = np.nan
+    # Return the scaled array and the valid mask
+    return scaled_array, valid
+
+
+# Get quantiles from the counts of each raw value (value_counts[i] is the count of raw value i - offset), interpolated
+# linearly between the sorted values like np.quantile. Returns an array of the scaled quantiles (NaN if no counts).
+def get_count_quantiles(value_counts, offset, scale_factor, quantiles):
+    # Make sure we have an array of quantiles
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    # Number of values
+    total = int(value_counts.sum()) if value_counts is not None else 0
+    # If there are none
+    if not total:
+        # Return NaN for each
+        return np.full(quantiles.shape, np.nan)
+    # Cumulative counts (the sorted position after each raw value)
+    cumulative = np.cumsum(value_counts)
+    # Positions of the quantiles in the sorted values, and the positions either side
+    positions = quantiles * (total - 1)
+    lower = np.floor(positions)
+    upper = np.minimum(lower + 1, total - 1)
+    # Raw values at the positions either side (the first raw value whose cumulative count passes the position)
+    lower_values = np.searchsorted(cumulative, lower, side='right') - offset
+    upper_values = np.searchsorted(cumulative, upper, side='right') - offset
+    # Return the interpolated, scaled quantiles
+    return (lower_values + (upper_values - lower_values) * (positions - lower)) * scale_factor
+
+
+# Get the bin index of each value by searching the bin edges, so values on an edge land in the same bin as with
+# np.histogram (each bin holds its lower edge, and the last bin its upper edge too)
+# Returns the indices and the mask of the values inside the bins (NaN is outside)
+def get_bin_indices(values, bins):
+    # Mask of the values inside the bins
+    inside = (values >= bins[0]) & (values <= bins[-1])
+    # Get the indices of the values inside (the last edge moved into the last bin)
+    indices = np.minimum(np.searchsorted(bins, values[inside], side='right') - 1, len(bins) - 2)
+    # Return the indices and mask
+    return indices, inside
+
+
+# Get the joint histogram of the VNP/VJ1 pairs and the histogram of their differences in one pass over the pairs
+# (compact arrays of the pixels valid in both). Either set of bins can be None, for no histogram.
+# Returns the joint histogram (VNP bins on the rows) and the difference histogram, or None for each without bins.
+def get_pair_histograms(vnp_values, vj1_values, diff_values, value_bins=None, diff_bins=None):
+    # Joint and difference histograms
+    joint_hist = None
+    diff_hist = None
+    # If there are value bins
+    if value_bins is not None:
+        # Number of value bins
+        bin_count = len(value_bins) - 1
+        # Get the bin indices of the VNP and VJ1 values
+        vnp_indices, vnp_inside = get_bin_indices(vnp_values, value_bins)
+        vj1_indices, vj1_inside = get_bin_indices(vj1_values, value_bins)
+        # Pairs with both values inside the bins
+        inside = vnp_inside & vj1_inside
+        # Count the pairs by flat (VNP bin, VJ1 bin) index
+        joint_hist = np.bincount(vnp_indices[inside[vnp_inside]] * bin_count + vj1_indices[inside[vj1_inside]],
+                                 minlength=bin_count * bin_count).reshape(bin_count, bin_count)
+    # If there are difference bins
+    if diff_bins is not None:
+        # Get the bin indices of the differences and count them
+        diff_hist = np.bincount(get_bin_indices(diff_values, diff_bins)[0], minlength=len(diff_bins) - 1)
+    # Return the histograms
+    return joint_hist, diff_hist
+
+
+# Rebin histogram counts into coarser bins whose edges fall on the original edges (the counts of each original bin are
+# added to the new bin holding its centre). Returns the counts unchanged if there are no new bins.
+def rebin_hist(counts, bins, new_bins=None):
+    # If there are no new bins
+    if new_bins is None:
+        # Return the counts
+        return counts
+    # Centres of the original bins
+    centres = (bins[:-1] + bins[1:]) / 2
+    # Return the counts added into the new bins
+    return np.histogram(centres, bins=new_bins, weights=counts)[0].astype(np.int64)
+
+
+# Compare a VNP band with the same VJ1 band from their raw arrays (signed 16 bit bands, 8 bit quality flags)
+# A single pass: each band is masked and scaled once into float32, the difference is taken once, and the statistics
+# and histograms are reduced over the pixels valid in both bands. value_bins and diff_bins are optional uniform
+# histogram bin edges (for the joint histogram of the pairs and the histogram of the differences), and value_counts
+# whether to count each valid raw value. Returns a BandComparison object.
+def compare_band(vnp_band, vj1_band, vnp_qual, vj1_qual, scale_factor, fill_value=32767, value_bins=None,
+                 diff_bins=None, value_counts=False):
+    # Scale the bands
+    vnp_array, vnp_valid = scale_band(vnp_band, vnp_qual, scale_factor, fill_value=fill_value)
+    vj1_array, vj1_valid = scale_band(vj1_band, vj1_qual, scale_factor, fill_value=fill_value)
+    # Return the comparison of the scaled bands
+    return compare_scaled_band(vnp_array,
+                               vj1_array,
+                               scale_factor,
+                               value_bins=value_bins,
+                               diff_bins=diff_bins,
+                               value_counts=value_counts,
+                               vnp_valid=vnp_valid,
+                               vj1_valid=vj1_valid,
+                               vnp_band=vnp_band,
+                               vj1_band=vj1_band)
+
+
+# Get the raw (integer) values of scaled values (exact, as the scaled values are float32 multiples of the scale factor)
+def get_raw_values(values, scale_factor):
+    # Return the raw values
+    return np.rint(values / np.float32(scale_factor)).astype(np.int32)
+
+
+# Compare a VNP band with the same VJ1 band from their scaled float32 arrays (NaN where the pixel is invalid)
+# The valid masks and raw bands can be passed in if they are already known (compare_band); otherwise the masks are
+# taken from the NaN values and the raw values (for the value counts) from the scaled values.
+# Returns a BandComparison object.
+def compare_scaled_band(vnp_array, vj1_array, scale_factor, value_bins=None, diff_bins=None, value_counts=False,
+                        vnp_valid=None, vj1_valid=None, vnp_band=None, vj1_band=None):
+    # If there are no valid masks
+    if vnp_valid is None:
+        # Get them from the NaN values (inverted in place)
+        vnp_valid = np.logical_not(np.isnan(vnp_array), out=np.empty(vnp_array.shape, dtype=bool))
+        vj1_valid = np.logical_not(np.isnan(vj1_array), out=np.empty(vj1_array.shape, dtype=bool))
+    # Subtract the VJ1 band values from the VNP values (NaN wherever either pixel is invalid)
+    diff_array = np.subtract(vnp_array, vj1_array)
+    # Start the comparison
+    comparison = BandComparison(vnp_array,
+                                vj1_array,
+                                diff_array,
+                                value_bins=value_bins,
+                                diff_bins=diff_bins,
+                                scale_factor=scale_factor,
+                                value_counts=value_counts)
+    # Count the valid pixels of each band
+    comparison.vnp_count = int(np.count_nonzero(vnp_valid))
+    comparison.vj1_count = int(np.count_nonzero(vj1_valid))
+    # If either band has valid pixels
+    if comparison.vnp_count or comparison.vj1_count:
+        # Get the overall max and mins between the arrays (NaN already marks the invalid pixels)
+        comparison.overall_min = float(np.fmin(np.nanmin(vnp_array) if comparison.vnp_count else np.nan,
+                                               np.nanmin(vj1_array) if comparison.vj1_count else np.nan))
+        comparison.overall_max = float(np.fmax(np.nanmax(vnp_array) if comparison.vnp_count else np.nan,
+                                               np.nanmax(vj1_array) if comparison.vj1_count else np.nan))
+    # If counting the raw values
+    if value_counts:
+        # Count each valid raw value (offset so the signed 16 bit values index from 0)
+        comparison.vnp_value_counts += np.bincount(get_valid_raw_values(vnp_array, vnp_valid, vnp_band, scale_factor)
+                                                   + 32768, minlength=65536)
+        comparison.vj1_value_counts += np.bincount(get_valid_raw_values(vj1_array, vj1_valid, vj1_band, scale_factor)
+                                                   + 32768, minlength=65536)
+    # Combine the valid masks in place (pixels valid in both bands)
+    valid = np.logical_and(vnp_valid, vj1_valid, out=vnp_valid)
+    # If counting the raw values
+    if value_counts:
+        # Count each raw difference of the pixels valid in both (offset so the differences index from 0)
+        raw_diffs = get_valid_raw_values(vnp_array, valid, vnp_band, scale_factor)
+        raw_diffs -= get_valid_raw_values(vj1_array, valid, vj1_band, scale_factor)
+        raw_diffs += 65535
+        comparison.diff_value_counts += np.bincount(raw_diffs, minlength=131071)
+    # Get the differences of the pixels valid in both (one compact copy, reduced several times)
+    diff_values = diff_array[valid]
+    # Count them
+    comparison.count = diff_values.size
+    # If there are any
+    if comparison.count:
+        # Get the mean of the differences (accumulated in float64)
+        comparison.diff_mean = float(diff_values.sum(dtype=np.float64) / comparison.count)
+        # Get the sum of squared deviations (in float64, in place)
+        deviations = diff_values.astype(np.float64)
+        deviations -= comparison.diff_mean
+        comparison.diff_m2 = float(np.dot(deviations, deviations))
+        # Get the range of the differences
+        comparison.diff_min = float(diff_values.min())
+        comparison.diff_max = float(diff_values.max())
+    # Get the VNP and VJ1 values of the pixels valid in both
+    vnp_values = vnp_array[valid]
+    vj1_values = vj1_array[valid]
+    # If there are value or difference bins
+    if value_bins is not None or diff_bins is not None:
+        # Get the joint and difference histograms (one pass over the pairs)
+        joint_hist, diff_hist = get_pair_histograms(vnp_values,
+                                                    vj1_values,
+                                                    diff_values,
+                                                    value_bins=value_bins,
+                                                    diff_bins=diff_bins)
+        # If there is a joint histogram
+        if joint_hist is not None:
+            # Add it
+            comparison.joint_hist += joint_hist
+        # If there is a difference histogram
+        if diff_hist is not None:
+            # Add it
+            comparison.diff_hist += diff_hist
+    # If there are any pairs
+    if comparison.count:
+        # Convert the pairs to float64 and get their means
+        vnp_values = vnp_values.astype(np.float64)
+        vj1_values = vj1_values.astype(np.float64)
+        comparison.vnp_mean = float(vnp_values.mean())
+        comparison.vj1_mean = float(vj1_values.mean())
+        # Get their sums of squared deviations and co-moment (deviations in place)
+        vnp_values -= comparison.vnp_mean
+        vj1_values -= comparison.vj1_mean
+        comparison.vnp_m2 = float(np.dot(vnp_values, vnp_values))
+        comparison.vj1_m2 = float(np.dot(vj1_values, vj1_values))
+        comparison.co_moment = float(np.dot(vnp_values, vj1_values))
+    # Return the comparison
+    return comparison
+
+
+# Get the raw values of the valid pixels of a band as int32 (from the raw band if there is one, or the scaled array)
+def get_valid_raw_values(scaled_array, valid, raw_band=None, scale_factor=None):
+    # If there is a raw band
+    if raw_band is not None:
+        # Return its valid values
+        return raw_band[valid].astype(np.int32)
+    # Return the raw values of the valid scaled values
+    return get_raw_values(scaled_array[valid], scale_factor)
+
+
+# Compare a VNP band with the same VJ1 band block by block from their full scaled float32 arrays (e.g. memory maps
+# from the decoded band cache), so only a block of the arrays is read and compared at once. If keep_arrays, the
+# comparison holds the arrays themselves (not copies) and a difference array filled in block by block.
+# Returns a BandComparison object.
+def compare_scaled_blocks(vnp_array,
+                          vj1_array,
+                          scale_factor,
+                          value_bins=None,
+                          diff_bins=None,
+                          value_counts=False,
+                          block_rows=256,
+                          keep_arrays=True):
+    # Start the comparison
+    comparison = BandComparison(value_bins=value_bins,
+                                diff_bins=diff_bins,
+                                scale_factor=scale_factor,
+                                value_counts=value_counts)
+    # If keeping the arrays
+    if keep_arrays:
+        # Use the scaled arrays and allocate the difference array
+        comparison.vnp_array = vnp_array
+        comparison.vj1_array = vj1_array
+        comparison.diff_array = np.empty(vnp_array.shape, dtype=np.float32)
+    # For each block of rows
+    for row in range(0, vnp_array.shape[0], block_rows):
+        # Slice of the block
+        block = slice(row, min(row + block_rows, vnp_array.shape[0]))
+        # Compare the block (as plain arrays, so a memory map's blocks are not wrapped as memory maps at every step)
+        block_comparison = compare_scaled_band(np.asarray(vnp_array[block]),
+                                               np.asarray(vj1_array[block]),
+                                               scale_factor,
+                                               value_bins=value_bins,
+                                               diff_bins=diff_bins,
+                                               value_counts=value_counts)
+        # Merge it into the comparison
+        comparison.merge(block_comparison)
+        # If keeping the arrays
+        if keep_arrays:
+            # Copy the block's differences in
+            comparison.diff_array[block] = block_comparison.diff_array
+    # Return the comparison
+    return comparison
+
+
+# Get the row blocks of an h5py dataset as slices, aligned with its on-disk chunks
+# Each block is the full width and a whole number of chunks tall (about block_rows rows, at least one chunk), so every
+# chunk is read and decompressed once. Contiguous datasets are split into blocks of block_rows rows.
+def get_blocks(dataset, block_rows=256):
+    # Rows per chunk (1 if the dataset is not chunked)
+    chunk_rows = dataset.chunks[0] if dataset.chunks is not None else 1
+    # Round the block down to a whole number of chunks (at least one)
+    block_rows = max(block_rows // chunk_rows, 1) * chunk_rows
+    # For each block
+    for row in range(0, dataset.shape[0], block_rows):
+        # Yield its slice
+        yield slice(row, min(row + block_rows, dataset.shape[0]))
+
+
+# Compare a VNP band with the same VJ1 band block by block, straight from their h5py datasets
+# Only one block of each dataset is in memory at once, and the statistics and histograms are merged as the blocks are
+# compared. If keep_arrays, the scaled and difference arrays are also filled in block by block (three float32 arrays
+# of the full band, for plotting); otherwise peak memory is a small multiple of one block.
+# Returns a BandComparison object.
+def compare_band_blocks(vnp_dataset,
+                        vj1_dataset,
+                        vnp_qual_dataset,
+                        vj1_qual_dataset,
+                        scale_factor,
+                        fill_value=32767,
+                        value_bins=None,
+                        diff_bins=None,
+                        value_counts=False,
+                        block_rows=256,
+                        keep_arrays=True):
+    # Start the comparison
+    comparison = BandComparison(value_bins=value_bins,
+                                diff_bins=diff_bins,
+                                scale_factor=scale_factor,
+                                value_counts=value_counts)
+    # If keeping the arrays
+    if keep_arrays:
+        # Allocate them (float32, filled in as the blocks are compared)
+        comparison.vnp_array = np.empty(vnp_dataset.shape, dtype=np.float32)
+        comparison.vj1_array = np.empty(vnp_dataset.shape, dtype=np.float32)
+        comparison.diff_array = np.empty(vnp_dataset.shape, dtype=np.float32)
+    # For each block (aligned with the VNP dataset's chunks)
+    for block in get_blocks(vnp_dataset, block_rows=block_rows):
+        # Compare the block
+        block_comparison = compare_band(vnp_dataset[block],
+                                        vj1_dataset[block],
+                                        vnp_qual_dataset[block],
+                                        vj1_qual_dataset[block],
+                                        scale_factor,
+                                        fill_value=fill_value,
+                                        value_bins=value_bins,
+                                        diff_bins=diff_bins,
+                                        value_counts=value_counts)
+        # Merge it into the comparison
+        comparison.merge(block_comparison)
+        # If keeping the arrays
+        if keep_arrays:
+            # Copy the block's arrays in
+            comparison.vnp_array[block] = block_comparison.vnp_array
+            comparison.vj1_array[block] = block_comparison.vj1_array
+            comparison.diff_array[block] = block_comparison.diff_array
+    # Return the comparison
+    return comparison
+
+
+# Get a Gaussian kernel density estimate from the counts of each raw value (BandComparison.vnp_value_counts etc.)
+# Matches seaborn.kdeplot(values, bw_adjust=bw_adjust): Scott's rule bandwidth (as scipy.stats.gaussian_kde) times
+# bw_adjust, evaluated at gridsize points from cut bandwidths below the lowest value to cut above the highest (or at
+# the given support points). The raw values are already binned on their integer lattice, so the density at every
+# lattice point is one FFT convolution of the counts with the kernel, which is then interpolated to the support. The
+# cost is linear in the pixels (counting) and independent of them after that. Returns the support and density arrays,
+# or None for each if there are no counts, fewer than two values or they are all the same.
+def get_kde(value_counts, scale_factor, bw_adjust=1, gridsize=200, cut=3, support=None):
+    # If there are no value counts (a comparison made or saved without them)
+    if value_counts is None:
+        # Return None for each
+        return None, None
+    # Get the raw values present (without the offset) and their counts
+    raw_values = np.flatnonzero(value_counts)
+    counts = value_counts[raw_values].astype(np.float64)
+    raw_values -= 32768
+    # Number of values
+    count = counts.sum()
+    # If there are fewer than two
+    if count < 2:
+        # Return None for each
+        return None, None
+    # Get the mean and (sample) standard deviation of the scaled values
+    values = raw_values * scale_factor
+    mean = np.dot(counts, values) / count
+    std = np.sqrt(np.dot(counts, (values - mean) ** 2) / (count - 1))
+    # If the values are all the same
+    if std == 0:
+        # Return None for each
+        return None, None
+    # Get the kernel bandwidth (standard deviation): Scott's factor, adjusted
+    bandwidth = std * count ** (-1 / 5) * bw_adjust
+    # If there are no support points
+    if support is None:
+        # Get them from the range of the values, extended by cut bandwidths
+        support = np.linspace(values[0] - cut * bandwidth, values[-1] + cut * bandwidth, gridsize)
+    # Kernel half-width in lattice steps (far enough to reach the support and for the kernel to vanish)
+    half_width = int(np.ceil(max(cut, 5) * bandwidth / scale_factor)) + 1
+    # Counts on the lattice from the lowest to the highest value
+    lattice_counts = np.zeros(raw_values[-1] - raw_values[0] + 1)
+    lattice_counts[raw_values - raw_values[0]] = counts
+    # Gaussian kernel on the lattice steps
+    kernel = np.exp(-0.5 * (np.arange(-half_width, half_width + 1) * scale_factor / bandwidth) ** 2)
+    # Convolve the counts with the kernel (FFT, zero padded so it does not wrap around)
+    fft_size = 1 << int(np.ceil(np.log2(lattice_counts.size + kernel.size - 1)))
+    convolved = np.fft.irfft(np.fft.rfft(lattice_counts, fft_size) * np.fft.rfft(kernel, fft_size), fft_size)
+    convolved = convolved[:lattice_counts.size + kernel.size - 1]
+    # Normalize to a density (clipping the rounding error below 0)
+    density = np.maximum(convolved, 0) / (count * bandwidth * np.sqrt(2 * np.pi))
+    # Values at the lattice points of the convolution
+    lattice_values = (raw_values[0] - half_width + np.arange(density.size)) * scale_factor
+    # Return the support and the density interpolated to it (0 beyond the kernel's reach)
+    return support, np.interp(support, lattice_values, density, left=0, right=0)
+
+
+# Get the overlap of the VNP and VJ1 kernel density estimates of a comparison, from 0 (none) to 1 (identical
+# distributions). Returns NaN if either estimate cannot be made (including a comparison without value counts).
+def get_kde_overlap(comparison, bw_adjust=1, gridsize=512, cut=3):
+    # Get the estimates on their own support points
+    vnp_support, vnp_density = get_kde(comparison.vnp_value_counts, comparison.scale_factor, bw_adjust=bw_adjust,
+                                       cut=cut)
+    vj1_support, vj1_density = get_kde(comparison.vj1_value_counts, comparison.scale_factor, bw_adjust=bw_adjust,
+                                       cut=cut)
+    # If either failed
+    if vnp_density is None or vj1_density is None:
+        # Return NaN
+        return np.nan
+    # Support points covering both
+    support = np.linspace(min(vnp_support[0], vj1_support[0]), max(vnp_support[-1], vj1_support[-1]), gridsize)
+    # Get both estimates on them
+    vnp_density = get_kde(comparison.vnp_value_counts, comparison.scale_factor, bw_adjust=bw_adjust,
+                          support=support)[1]
+    vj1_density = get_kde(comparison.vj1_value_counts, comparison.scale_factor, bw_adjust=bw_adjust,
+                          support=support)[1]
+    # Get the lower of the two densities
+    lower_density = np.minimum(vnp_density, vj1_density)
+    # Return its integral (trapezoidal rule)
+    return float((lower_density.sum() - (lower_density[0] + lower_density[-1]) / 2) * (support[1] - support[0]))
+
+
+# Parse the product, tile, year and DOY from a granule file name (or a path or URL)
+def get_file_details(file_name):
+    # Split the name for the different Archive Sets (or the URL)
+    file_name = file_name.split('\\')[-1].split('/')[-1]
+    # Split out the product, tile name and the date
+    split_name = file_name.split('.')
+    tile = split_name[2]
+    year = split_name[1][1:5]
+    doy = split_name[1][5:8]
+    product = split_name[0][3:]
+    # Return the details
+    return product, tile, year, doy
+
+
+# Get the band keyword, figure keyword and scale factor for a product
+def get_product_settings(product):
+    # Establish the keywords and scale factor for the product
+    # <> support dictionary?
+    keyword = "Albedo"
+    figure_keyword = "Albedo"
+    scale_factor = 0.001
+    if product == "43MA4":
+        keyword = "Nadir"
+        figure_keyword = "NBAR"
+        scale_factor = 0.0001
+    # Return the settings
+    return keyword, figure_keyword, scale_factor
+
+
+# Open the vnp and vj1 files as h5py File objects
+# If there is a session object, the file names are LAADS URLs and the files are read over HTTP Range requests
+# Returns the two File objects and the two remote file objects (None if local), or None for each if either failed
+def open_files(vnp_file_name, vj1_file_name, session_obj=None):
+    # If reading the files remotely
+    if session_obj is not None:
+        # Open the vnp and vj1 files as h5py File objects over HTTP Range requests
+        vnp_file, vnp_remote = t_remote_h5.open_remote_VIIRS_file(session_obj, vnp_file_name)
+        vj1_file, vj1_remote = t_remote_h5.open_remote_VIIRS_file(session_obj, vj1_file_name)
+        # If either file could not be opened
+        if vnp_file is None or vj1_file is None:
+            # Return None for each
+            return None, None, None, None
+        # Return the files
+        return vnp_file, vj1_file, vnp_remote, vj1_remote
+    # Open the vnp and vj1 files as h5py File objects
+    vnp_file = h5py.File(Path(environ['output_files_path'] + vnp_file_name))
+    vj1_file = h5py.File(Path(environ['output_files_path'] + vj1_file_name))
+    # Return the files
+    return vnp_file, vj1_file, None, None
+
+
+# Get the keys of the bands to compare in a file (the keys that begin with the product keyword)
+def get_band_keys(h5_file, keyword):
+    # Return the keys
+    return [key for key in h5_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'].keys()
+            if key.split('_')[0] == keyword]
+
+
+# Compare a band of two open VIIRS H5 files (vnp and vj1) with its quality flags, block by block
+# If there is a cache (t_band_cache.DecodedBandCache), the decoded bands are taken from it (decoded into it the first
+# time), and the comparison's arrays are its memory maps. Returns a BandComparison object
+def compare_file_band(vnp_file,
+                      vj1_file,
+                      key,
+                      scale_factor,
+                      value_bins=None,
+                      diff_bins=None,
+                      value_counts=False,
+                      keep_arrays=True,
+                      cache=None):
+    # Get the quality flag band key
+    quality_key = 'BRDF_Albedo_Band_Mandatory_Quality_' + key.split('_')[-1]
+    # If there is a cache
+    if cache is not None:
+        # Path to the data fields
+        fields_path = 'HDFEOS/GRIDS/VIIRS_Grid_BRDF/Data Fields/'
+        # Return the comparison of the decoded bands
+        return compare_scaled_blocks(cache.get_band(vnp_file, fields_path + key, fields_path + quality_key,
+                                                    scale_factor),
+                                     cache.get_band(vj1_file, fields_path + key, fields_path + quality_key,
+                                                    scale_factor),
+                                     scale_factor,
+                                     value_bins=value_bins,
+                                     diff_bins=diff_bins,
+                                     value_counts=value_counts,
+                                     keep_arrays=keep_arrays)
+    # Return the comparison
+    return compare_band_blocks(vnp_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][key],
+                               vj1_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][key],
+                               vnp_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][quality_key],
+                               vj1_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'][quality_key],
+                               scale_factor,
+                               value_bins=value_bins,
+                               diff_bins=diff_bins,
+                               value_counts=value_counts,
+                               keep_arrays=keep_arrays)
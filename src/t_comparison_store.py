@@ -0,0 +1,211 @@
+import sqlite3
+import datetime
+import dotenv
+import numpy as np
+import t_compare
+from os import environ
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+# Columns of the comparison statistics (BandComparison attributes saved as numbers)
+stat_columns = ["vnp_count", "vj1_count", "count", "diff_mean", "diff_m2", "diff_min", "diff_max", "overall_min",
+                "overall_max", "vnp_mean", "vj1_mean", "vnp_m2", "vj1_m2", "co_moment", "scale_factor"]
+# Columns of the comparison counts (BandComparison attributes saved as sparse blobs, None if not counted)
+count_columns = ["joint_hist", "diff_hist", "vnp_value_counts", "vj1_value_counts", "diff_value_counts"]
+
+
+# Class for the store of band comparisons (an indexed SQLite table in the output files directory)
+# Each comparison of a band for a product, tile and date is saved as its mergeable accumulators: the counts, means, sums
+# of squared deviations, co-moment and ranges, and the histogram and raw value/difference counts (sparse, so near-empty
+# counts take little space). Statistics for any subset of tiles, dates and bands are merged from the saved rows, without
+# reading the granules again.
+class ComparisonStore:
+
+    __slots__ = ["store", "root_path"]
+
+    def __init__(self, root_path=None):
+
+        # If no root path was provided
+        if root_path is None:
+            # Use the output files directory
+            root_path = environ["output_files_path"]
+        # Instantiate attributes
+        self.root_path = Path(root_path)
+        # Connect to the store
+        self.store = sqlite3.connect(self.root_path / "comparison_store.db")
+        # Create the table if it is new
+        self.store.execute("CREATE TABLE IF NOT EXISTS comparisons ("
+                           "product TEXT NOT NULL, "
+                           "tile TEXT NOT NULL, "
+                           "date TEXT NOT NULL, "
+                           "band TEXT NOT NULL, "
+                           + "".join(f"{column} REAL, " for column in stat_columns)
+                           + "value_bins BLOB, "
+                           "diff_bins BLOB, "
+                           + "".join(f"{column} BLOB, " for column in count_columns)
+                           + "PRIMARY KEY (product, tile, date, band))")
+        # Index for the band/date queries (the primary key covers product/tile)
+        self.store.execute("CREATE INDEX IF NOT EXISTS comparisons_product_band_date "
+                           "ON comparisons (product, band, date)")
+
+    # Add (or replace) the comparison of a band for a product, tile and date (year and DOY strings or integers)
+    def add_comparison(self, comparison, product, tile, year, doy, band, commit=True):
+        # Columns and values of the row
+        columns = ["product", "tile", "date", "band"] + stat_columns + ["value_bins", "diff_bins"] + count_columns
+        values = [product, tile, get_date(year, doy).isoformat(), band]
+        values += [getattr(comparison, column) for column in stat_columns]
+        values += [pack_bins(comparison.value_bins), pack_bins(comparison.diff_bins)]
+        values += [pack_counts(getattr(comparison, column)) for column in count_columns]
+        # Add the row
+        self.store.execute(f"INSERT OR REPLACE INTO comparisons ({', '.join(columns)}) "
+                           f"VALUES ({', '.join('?' * len(columns))})",
+                           values)
+        # If committing
+        if commit:
+            # Commit the row
+            self.store.commit()
+
+    # Add the comparisons of several bands of a product, tile and date (a dictionary of band to comparison) at once
+    def add_comparisons(self, comparisons, product, tile, year, doy):
+        # Inside a transaction
+        with self.store:
+            # For each band
+            for band, comparison in comparisons.items():
+                # Add it (without committing)
+                self.add_comparison(comparison, product, tile, year, doy, band, commit=False)
+
+    # Get the query and parameters selecting the rows for a product and (optionally) lists of tiles and bands and a
+    # range of dates (datetime.date objects, inclusive)
+    @staticmethod
+    def get_query(columns, product, tiles=None, bands=None, start_date=None, end_date=None):
+        # Query and parameters
+        query = f"SELECT {', '.join(columns)} FROM comparisons WHERE product = ?"
+        parameters = [product]
+        # If there are tiles
+        if tiles is not None:
+            query += f" AND tile IN ({', '.join('?' * len(tiles))})"
+            parameters += list(tiles)
+        # If there are bands
+        if bands is not None:
+            query += f" AND band IN ({', '.join('?' * len(bands))})"
+            parameters += list(bands)
+        # If there is a start date
+        if start_date is not None:
+            query += " AND date >= ?"
+            parameters.append(start_date.isoformat())
+        # If there is an end date
+        if end_date is not None:
+            query += " AND date <= ?"
+            parameters.append(end_date.isoformat())
+        # Return the query and parameters
+        return query, parameters
+
+    # Check whether there are saved comparisons for a product, tile and date (year and DOY strings or integers)
+    def has_date(self, product, tile, year, doy):
+        # Return whether there is a row for the date
+        return self.store.execute("SELECT 1 FROM comparisons WHERE product = ? AND tile = ? AND date = ? LIMIT 1",
+                                  (product, tile, get_date(year, doy).isoformat())).fetchone() is not None
+
+    # Get the (tile, date, band) keys of the saved comparisons for a product (optionally a subset, as get_comparison)
+    def get_keys(self, product, tiles=None, bands=None, start_date=None, end_date=None):
+        # Get the query
+        query, parameters = self.get_query(["tile", "date", "band"], product, tiles=tiles, bands=bands,
+                                           start_date=start_date, end_date=end_date)
+        # Return the keys
+        return [(tile, datetime.date.fromisoformat(date), band)
+                for tile, date, band in self.store.execute(query + " ORDER BY tile, date, band", parameters)]
+
+    # Get the merged comparison of the saved comparisons for a product and (optionally) lists of tiles and bands and a
+    # range of dates (datetime.date objects, inclusive). The comparisons must have been made with the same bins.
+    # Returns a BandComparison object without arrays, or None if there are no saved comparisons
+    def get_comparison(self, product, tiles=None, bands=None, start_date=None, end_date=None):
+        # Get the query
+        query, parameters = self.get_query(stat_columns + ["value_bins", "diff_bins"] + count_columns, product,
+                                           tiles=tiles, bands=bands, start_date=start_date, end_date=end_date)
+        # Merged comparison (statistics only) and merged counts (column to array)
+        merged = None
+        merged_counts = {}
+        # For each row
+        for row in self.store.execute(query, parameters):
+            # Split the row into the statistics, bins and counts
+            stats = row[:len(stat_columns)]
+            value_bins, diff_bins = (unpack_bins(blob) for blob in row[len(stat_columns):len(stat_columns) + 2])
+            counts = row[len(stat_columns) + 2:]
+            # Make a comparison of the statistics
+            comparison = t_compare.BandComparison(scale_factor=stats[-1])
+            for column, value in zip(stat_columns, stats):
+                setattr(comparison, column, int(value) if column.endswith("count") else
+                        np.nan if value is None else value)
+            # If this is the first row
+            if merged is None:
+                # Start the merged comparison with the row's bins
+                merged = t_compare.BandComparison(scale_factor=comparison.scale_factor)
+                merged.value_bins = value_bins
+                merged.diff_bins = diff_bins
+                # Empty counts of a comparison with the row's bins
+                empty = t_compare.BandComparison(value_bins=value_bins, diff_bins=diff_bins, value_counts=True)
+                # Start the merged counts the row has
+                merged_counts = {column: getattr(empty, column) for column, blob in zip(count_columns, counts)
+                                 if blob is not None}
+            # Merge the statistics
+            merged.merge(comparison)
+            # For each set of counts
+            for column, blob in zip(count_columns, counts):
+                # If the merged counts and the row have them
+                if column in merged_counts and blob is not None:
+                    # Add the row's counts
+                    add_counts(merged_counts[column], blob)
+        # For each set of merged counts
+        for column, column_counts in merged_counts.items():
+            # Put it in the merged comparison
+            setattr(merged, column, column_counts)
+        # Return the merged comparison
+        return merged
+
+    # Close the store
+    def close(self):
+        # Close the connection
+        self.store.close()
+
+
+# Get the date of a year and DOY (strings or integers)
+def get_date(year, doy):
+    # Return the date
+    return datetime.date(year=int(year), month=1, day=1) + datetime.timedelta(days=int(doy) - 1)
+
+
+# Pack bin edges into a blob (None for no bins)
+def pack_bins(bins):
+    # Return the float64 bytes
+    return np.asarray(bins, dtype=np.float64).tobytes() if bins is not None else None
+
+
+# Unpack bin edges from a blob (None for no bins)
+def unpack_bins(blob):
+    # Return the array
+    return np.frombuffer(blob, dtype=np.float64) if blob is not None else None
+
+
+# Pack counts into a sparse blob (the int32 flat indices of the non-zero counts followed by the int64 counts)
+def pack_counts(counts):
+    # If there are no counts
+    if counts is None:
+        # Return None
+        return None
+    # Get the flat indices of the non-zero counts
+    indices = np.flatnonzero(counts)
+    # Return the indices and counts
+    return indices.astype(np.int32).tobytes() + counts.ravel()[indices].astype(np.int64).tobytes()
+
+
+# Add the counts of a sparse blob (from pack_counts) into an array of counts, in place
+def add_counts(counts, blob):
+    # Number of non-zero counts (4 bytes for the index and 8 for the count of each)
+    count = len(blob) // 12
+    # Get the indices and counts
+    indices = np.frombuffer(blob, dtype=np.int32, count=count)
+    values = np.frombuffer(blob, dtype=np.int64, offset=count * 4)
+    # Add them (the indices are unique)
+    counts.ravel()[indices] += values
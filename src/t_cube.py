@@ -0,0 +1,306 @@
+import json
+import datetime
+import dotenv
+import numpy as np
+import t_compare
+from os import environ, makedirs, replace
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+
+# Class for a time-series cube of the paired VNP/VJ1 granules of a product and tile (date x row x col, for each layer)
+# The layers are the raw (signed 16 bit) bands of the product and their quality flag bands, for VNP and then VJ1,
+# copied out of the granules once. Each layer is its own memory-mapped file of chunks, each date_chunk dates of a small
+# block_rows x block_cols block of pixels, with the dates of a pixel next to each other:
+#   (date chunk, row block, column block, row in block, column in block, date in chunk)
+# The time series of a pixel in one layer is one contiguous run (date_chunk values) per chunk of dates, so a few
+# hundred dates are a few short reads. A map of one layer on one date reads one contiguous chunk per block (the
+# block's date_chunk dates, date_chunk times the map's size). Dates are appended in order as new granules arrive, the
+# files growing by a chunk of dates at a time (the date chunk is the outer axis, so the data already written never
+# moves); each date is written into the chunk a strip of block rows at a time, so the pages of the current chunk of
+# dates are written once per date. The list of dates and the layout are kept in a JSON file.
+class TimeSeriesCube:
+
+    __slots__ = ["cube_path", "product", "tile", "layers", "shape", "date_chunk", "block_rows", "block_cols",
+                 "dates", "data"]
+
+    def __init__(self, product, tile, cube_path=None):
+
+        # If no cube path was provided
+        if cube_path is None:
+            # Use a directory for the product and tile in the output files directory
+            cube_path = environ['output_files_path'] + f'cubes/{product}_{tile}/'
+        # Instantiate attributes
+        self.cube_path = Path(cube_path)
+        self.product = product
+        self.tile = tile
+        # Layout (set by create, or read from the JSON file)
+        self.layers = None
+        self.shape = None
+        self.date_chunk = None
+        self.block_rows = None
+        self.block_cols = None
+        # Dates in the cube (in order)
+        self.dates = []
+        # Memory-mapped chunks of each layer (None until there are any)
+        self.data = None
+        # If the cube exists
+        if (self.cube_path / "cube.json").exists():
+            # Read its layout and dates
+            with open(self.cube_path / "cube.json", 'r') as f:
+                cube_dict = json.load(f)
+            self.layers = cube_dict["layers"]
+            self.shape = tuple(cube_dict["shape"])
+            self.date_chunk = cube_dict["date_chunk"]
+            self.block_rows = cube_dict["block_rows"]
+            self.block_cols = cube_dict["block_cols"]
+            self.dates = [datetime.date.fromisoformat(date) for date in cube_dict["dates"]]
+            # Map the chunks
+            self.map_data()
+
+    # Set the layout of a new cube (the layer names and the shape of the maps)
+    def create(self, layers, shape, date_chunk=32, block_rows=16, block_cols=16):
+        # Set the layout
+        self.layers = list(layers)
+        self.shape = tuple(shape)
+        self.date_chunk = date_chunk
+        self.block_rows = block_rows
+        self.block_cols = block_cols
+        self.dates = []
+        # Make the directory if there is none
+        makedirs(self.cube_path, exist_ok=True)
+        # Start an empty data file for each layer
+        for layer_index in range(len(self.layers)):
+            open(self.get_layer_path(layer_index), 'wb').close()
+        self.data = None
+        # Save the layout
+        self.save()
+
+    # Get the path to the data file of a layer (by index)
+    def get_layer_path(self, layer_index):
+        # Return the path
+        return self.cube_path / f"layer_{layer_index:03d}.dat"
+
+    # Get the number of row and column blocks
+    def get_block_counts(self):
+        # Return the counts (the last blocks padded out past the edge of the maps)
+        return -(-self.shape[0] // self.block_rows), -(-self.shape[1] // self.block_cols)
+
+    # Get the shape of a chunk of dates of a layer (every block)
+    def get_chunk_shape(self):
+        # Number of row and column blocks
+        row_blocks, col_blocks = self.get_block_counts()
+        # Return the shape
+        return row_blocks, col_blocks, self.block_rows, self.block_cols, self.date_chunk
+
+    # Memory-map the data files (as many chunks of dates as they hold)
+    def map_data(self):
+        # Shape of a chunk of dates
+        chunk_shape = self.get_chunk_shape()
+        # Number of chunks of dates in the files
+        date_chunks = self.get_layer_path(0).stat().st_size // (np.prod(chunk_shape) * 2)
+        # Map the chunks of each layer (None if there are none)
+        self.data = [np.memmap(self.get_layer_path(layer_index), dtype=np.int16, mode='r+',
+                               shape=(date_chunks,) + chunk_shape) for layer_index in range(len(self.layers))] \
+            if date_chunks else None
+
+    # Save the layout and dates to the JSON file (replaced atomically, after the data is flushed)
+    def save(self):
+        # If there is data
+        if self.data is not None:
+            # Flush each layer to disk
+            for layer_data in self.data:
+                layer_data.flush()
+        # Write the layout and dates to a temporary file
+        with open(self.cube_path / "cube.json.tmp", 'w') as f:
+            json.dump({"product": self.product,
+                       "tile": self.tile,
+                       "layers": self.layers,
+                       "shape": list(self.shape),
+                       "date_chunk": self.date_chunk,
+                       "block_rows": self.block_rows,
+                       "block_cols": self.block_cols,
+                       "dates": [date.isoformat() for date in self.dates]}, f)
+        # Replace the JSON file with it
+        replace(self.cube_path / "cube.json.tmp", self.cube_path / "cube.json")
+
+    # Append the layers of a date (a list of 2D raw arrays or h5py datasets, in the order of the layers)
+    # Each layer is read and written a strip of block rows (at least read_rows rows) at a time, so a dataset is never
+    # read into memory whole. Returns whether the date was appended (dates already in the cube, or before its last
+    # date, are not)
+    def append_date(self, date, layer_arrays, save=True, read_rows=256):
+        # If the date is already in the cube
+        if date in self.dates:
+            # Return False
+            return False
+        # If the date is before the last date
+        if self.dates and date < self.dates[-1]:
+            # Print a warning
+            print(f'Warning: {date} is before the last date of cube {self.cube_path} and was not appended.')
+            # Return False
+            return False
+        # Index of the date
+        date_index = len(self.dates)
+        # If the date starts a new chunk of dates
+        if date_index % self.date_chunk == 0:
+            # Size of a chunk of dates of a layer in bytes
+            chunk_size = int(np.prod(self.get_chunk_shape())) * 2
+            # Release the old maps, grow each file by a chunk of dates and map them again
+            self.data = None
+            for layer_index in range(len(self.layers)):
+                with open(self.get_layer_path(layer_index), 'r+b') as f:
+                    f.truncate((date_index // self.date_chunk + 1) * chunk_size)
+            self.map_data()
+        # Get the chunk of dates, and the date within it
+        chunk, chunk_date = divmod(date_index, self.date_chunk)
+        # Number of row and column blocks, and of row blocks in a strip
+        row_blocks, col_blocks = self.get_block_counts()
+        strip_blocks = -(-read_rows // self.block_rows)
+        # Array for a strip of block rows padded out to whole blocks (the padding is fill values)
+        padded = np.full((strip_blocks * self.block_rows, col_blocks * self.block_cols), 32767, dtype=np.int16)
+        # For each layer
+        for layer_index, layer_array in enumerate(layer_arrays):
+            # For each strip of block rows
+            for strip_start in range(0, row_blocks, strip_blocks):
+                # Row blocks in the strip
+                strip_end = min(strip_start + strip_blocks, row_blocks)
+                # Rows of the map in the strip
+                row_start = strip_start * self.block_rows
+                row_end = min(strip_end * self.block_rows, self.shape[0])
+                # Fill the padding and copy the rows in (reading only these rows of a dataset)
+                padded.fill(32767)
+                padded[:row_end - row_start, :self.shape[1]] = layer_array[row_start:row_end]
+                # Copy them into the blocks (row block, column block, row, column)
+                self.data[layer_index][chunk, strip_start:strip_end, :, :, :, chunk_date] = \
+                    padded[:(strip_end - strip_start) * self.block_rows].reshape(strip_end - strip_start,
+                                                                                 self.block_rows,
+                                                                                 col_blocks,
+                                                                                 self.block_cols).transpose(0, 2, 1, 3)
+        # Add the date
+        self.dates.append(date)
+        # If saving
+        if save:
+            # Save the dates
+            self.save()
+        # Return True
+        return True
+
+    # Get the raw map of a layer (name) on a date as a 2D array
+    def get_map(self, date, layer):
+        # Get the chunk of dates, and the date within it
+        chunk, chunk_date = divmod(self.dates.index(date), self.date_chunk)
+        # Get the blocks of the layer on the date
+        blocks = self.data[self.layers.index(layer)][chunk, :, :, :, :, chunk_date]
+        # Return them as a map (without the padding)
+        return blocks.transpose(0, 2, 1, 3).reshape(blocks.shape[0] * self.block_rows,
+                                                    blocks.shape[1] * self.block_cols)[:self.shape[0], :self.shape[1]]
+
+    # Get the raw time series of a pixel for a list of layers (names, every layer if None)
+    # Returns the dates and an array of the values (date x layer)
+    def get_time_series(self, row, col, layers=None):
+        # Get the layer indices
+        layer_indices = list(range(len(self.layers))) if layers is None else \
+            [self.layers.index(layer) for layer in layers]
+        # If there are no dates
+        if not self.dates:
+            # Return no dates and an empty array
+            return [], np.empty((0, len(layer_indices)), dtype=np.int16)
+        # Get the pixel's values in each layer from every chunk of dates (without the dates past the last one)
+        values = np.stack([self.data[layer_index][:, row // self.block_rows, col // self.block_cols,
+                                                  row % self.block_rows, col % self.block_cols, :].reshape(-1)
+                           [:len(self.dates)] for layer_index in layer_indices], axis=1)
+        # Return the dates and the values
+        return list(self.dates), values
+
+    # Get the scaled time series of a band of a pixel for VNP and VJ1 (NaN where fill or not best quality)
+    # Returns the dates and the VNP and VJ1 arrays
+    def get_band_time_series(self, row, col, key, scale_factor, fill_value=32767):
+        # Get the quality flag band key
+        quality_key = 'BRDF_Albedo_Band_Mandatory_Quality_' + key.split('_')[-1]
+        # Get the raw time series
+        dates, values = self.get_time_series(row, col, layers=[f'VNP/{key}', f'VNP/{quality_key}', f'VJ1/{key}',
+                                                                f'VJ1/{quality_key}'])
+        # Scale the VNP and VJ1 values
+        vnp_array = t_compare.scale_band(values[:, 0], values[:, 1], scale_factor, fill_value=fill_value)[0]
+        vj1_array = t_compare.scale_band(values[:, 2], values[:, 3], scale_factor, fill_value=fill_value)[0]
+        # Return the dates and arrays
+        return dates, vnp_array, vj1_array
+
+
+# Get the cube layer names of a product's bands and their quality flag bands in a granule (VNP and VJ1)
+def get_cube_layers(h5_file, keyword):
+    # Get the band keys
+    band_keys = t_compare.get_band_keys(h5_file, keyword)
+    # Get their quality flag band keys (once each, in order)
+    quality_keys = list(dict.fromkeys('BRDF_Albedo_Band_Mandatory_Quality_' + key.split('_')[-1]
+                                      for key in band_keys))
+    # Return the layer names
+    return [f'{satellite}/{key}' for satellite in ['VNP', 'VJ1'] for key in band_keys + quality_keys]
+
+
+# Add a list of [vnp file, vj1 file] pairs (of any products and tiles) to the time-series cube of each product and tile
+# (made if there is none). The pairs are added in date order, and dates already in a cube are skipped, so the cubes can
+# be updated as new granules arrive; granules whose maps are not the shape of their cube are skipped with a warning.
+# Returns a dictionary of (product, tile) to its TimeSeriesCube object
+def update_cube(comparisons_list, date_chunk=32, block_rows=16, block_cols=16):
+    # Dictionary of (product, tile) to its pairs
+    groups = {}
+    # Group the pairs by the product and tile of the VNP file
+    for pair in comparisons_list:
+        groups.setdefault(tuple(t_compare.get_file_details(pair[0])[:2]), []).append(pair)
+    # Dictionary for the cubes
+    cubes = {}
+    # For each product and tile
+    for (product, tile), pairs in groups.items():
+        # Get the band keyword for the product
+        keyword = t_compare.get_product_settings(product)[0]
+        # Open the cube
+        cube = TimeSeriesCube(product, tile)
+        # For each pair (sorted by date: the year and DOY of the VNP file)
+        for vnp_file_name, vj1_file_name in sorted(pairs, key=lambda pair: t_compare.get_file_details(pair[0])[2:]):
+            # If the VJ1 file is not of the same product and tile
+            if tuple(t_compare.get_file_details(vj1_file_name)[:2]) != (product, tile):
+                # Print a warning
+                print(f'Warning: {vj1_file_name} is not a {product} {tile} granule and was not added to the cube.')
+                # Skip the pair
+                continue
+            # Get the date
+            year, doy = t_compare.get_file_details(vnp_file_name)[2:]
+            date = datetime.date(year=int(year), month=1, day=1) + datetime.timedelta(days=int(doy) - 1)
+            # If the date is already in the cube
+            if date in cube.dates:
+                # Skip it
+                continue
+            # Open the vnp and vj1 files as h5py File objects
+            vnp_file, vj1_file = t_compare.open_files(vnp_file_name, vj1_file_name)[:2]
+            # Get the data fields of each
+            fields = {'VNP': vnp_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields'],
+                      'VJ1': vj1_file['HDFEOS']['GRIDS']['VIIRS_Grid_BRDF']['Data Fields']}
+            # If the cube is new
+            if cube.layers is None:
+                # Create it with the layers and shape of the first granule
+                layers = get_cube_layers(vnp_file, keyword)
+                cube.create(layers,
+                            fields['VNP'][layers[0].split('/')[1]].shape,
+                            date_chunk=date_chunk,
+                            block_rows=block_rows,
+                            block_cols=block_cols)
+            # Get each layer's dataset from its granule (read a strip at a time as it is appended)
+            layer_datasets = [fields[layer.split('/')[0]][layer.split('/')[1]] for layer in cube.layers]
+            # If any layer is not the shape of the cube
+            if any(dataset.shape != cube.shape for dataset in layer_datasets):
+                # Print a warning
+                print(f'Warning: {vnp_file_name} and {vj1_file_name} are not the shape of the cube and were not added.')
+            # Otherwise
+            else:
+                # Append the date
+                cube.append_date(date, layer_datasets)
+            # Close the files
+            vnp_file.close()
+            vj1_file.close()
+        # Add the cube
+        cubes[(product, tile)] = cube
+    # Return the cubes
+    return cubes
@@ -0,0 +1,148 @@
+import sqlite3
+import threading
+import dotenv
+from time import time
+from os import environ
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+
+# Class for the journal of a batch download job (an SQLite table in the output files directory)
+# Each granule of the job is recorded as queued, in_flight, done or failed, with its expected size and checksum, the
+# bytes written, the number of attempts and the times. Every change is committed straight away (with a write-ahead
+# log), so if the process dies the job can be resumed from the journal without rebuilding its URL list.
+class DownloadJournal:
+
+    __slots__ = ["journal", "job_name", "lock"]
+
+    def __init__(self, job_name, root_path=None):
+
+        # If no root path was provided
+        if root_path is None:
+            # Use the output files directory
+            root_path = environ["output_files_path"]
+        # Instantiate attributes
+        self.job_name = job_name
+        # Lock for the journal (the download threads update it too)
+        self.lock = threading.Lock()
+        # Connect to the journal (shared by the threads, under the lock)
+        self.journal = sqlite3.connect(Path(root_path) / "download_journal.db", check_same_thread=False)
+        # Use a write-ahead log (cheap commits that survive a crash)
+        self.journal.execute("PRAGMA journal_mode=WAL")
+        self.journal.execute("PRAGMA synchronous=NORMAL")
+        # Create the table if it is new
+        self.journal.execute("CREATE TABLE IF NOT EXISTS granules ("
+                             "job TEXT NOT NULL, "
+                             "target_url TEXT NOT NULL, "
+                             "status TEXT NOT NULL, "
+                             "expected_size INTEGER, "
+                             "expected_checksum TEXT, "
+                             "bytes INTEGER, "
+                             "attempts INTEGER NOT NULL DEFAULT 0, "
+                             "queued_time REAL, "
+                             "start_time REAL, "
+                             "end_time REAL, "
+                             "PRIMARY KEY (job, target_url))")
+        # Index for the status queries
+        self.journal.execute("CREATE INDEX IF NOT EXISTS granules_job_status ON granules (job, status)")
+        self.journal.commit()
+
+    # Execute a statement for the job and commit it (under the lock)
+    def execute(self, statement, parameters=()):
+        # Lock the journal
+        with self.lock:
+            # Inside a transaction
+            with self.journal:
+                # Execute the statement
+                self.journal.execute(statement, parameters)
+
+    # Check whether the job has been queued before
+    def has_job(self):
+        # Lock the journal
+        with self.lock:
+            # Return whether there is a row for the job
+            return self.journal.execute("SELECT 1 FROM granules WHERE job = ? LIMIT 1",
+                                        (self.job_name,)).fetchone() is not None
+
+    # Queue a list of URLs (file_checks is an optional dictionary of file name to expected (size, checksum))
+    def queue(self, url_list, file_checks=None):
+        # If there are no file checks
+        if file_checks is None:
+            # Use an empty dictionary
+            file_checks = {}
+        # Time queued
+        queued_time = time()
+        # Lock the journal
+        with self.lock:
+            # Inside a transaction (all or nothing)
+            with self.journal:
+                # Add the URLs (ignoring any already in the job)
+                self.journal.executemany("INSERT OR IGNORE INTO granules (job, target_url, status, expected_size, "
+                                         "expected_checksum, queued_time) VALUES (?, ?, 'queued', ?, ?, ?)",
+                                         [(self.job_name,
+                                           target_url,
+                                           *file_checks.get(target_url.split('/')[-1], (None, None)),
+                                           queued_time) for target_url in url_list])
+
+    # Get the URLs still to download and their expected (size, checksum), keyed by file name
+    # Granules left in flight by a crash are included (their partial files resume), and failed ones if requested
+    def get_pending(self, retry_failed=False):
+        # Statuses to download
+        statuses = ("queued", "in_flight", "failed") if retry_failed else ("queued", "in_flight")
+        # Lock the journal
+        with self.lock:
+            # Get the rows
+            rows = self.journal.execute(f"SELECT target_url, expected_size, expected_checksum FROM granules "
+                                        f"WHERE job = ? AND status IN ({', '.join('?' * len(statuses))}) "
+                                        f"ORDER BY queued_time, target_url",
+                                        (self.job_name, *statuses)).fetchall()
+        # Return the URL list and the file checks
+        return [row[0] for row in rows], {row[0].split('/')[-1]: (row[1], row[2]) for row in rows}
+
+    # Record that a granule's download has started
+    def mark_in_flight(self, target_url):
+        # Update the row
+        self.execute("UPDATE granules SET status = 'in_flight', attempts = attempts + 1, start_time = ? "
+                     "WHERE job = ? AND target_url = ?",
+                     (time(), self.job_name, target_url))
+
+    # Record that a granule has been downloaded (with the bytes written)
+    def mark_done(self, target_url, byte_count=None):
+        # Update the row
+        self.execute("UPDATE granules SET status = 'done', bytes = ?, end_time = ? WHERE job = ? AND target_url = ?",
+                     (byte_count, time(), self.job_name, target_url))
+
+    # Record that a granule failed to download
+    def mark_failed(self, target_url):
+        # Update the row
+        self.execute("UPDATE granules SET status = 'failed', end_time = ? WHERE job = ? AND target_url = ?",
+                     (time(), self.job_name, target_url))
+
+    # Get a dictionary of the number of granules with each status
+    def get_counts(self):
+        # Lock the journal
+        with self.lock:
+            # Return the counts
+            return dict(self.journal.execute("SELECT status, COUNT(*) FROM granules WHERE job = ? GROUP BY status",
+                                             (self.job_name,)).fetchall())
+
+    # Print the job's progress
+    def report(self):
+        # Get the counts
+        counts = self.get_counts()
+        # Lock the journal
+        with self.lock:
+            # Get the bytes written
+            byte_count = self.journal.execute("SELECT COALESCE(SUM(bytes), 0) FROM granules WHERE job = ?",
+                                              (self.job_name,)).fetchone()[0]
+        # Print the update
+        print(f"Job {self.job_name}: {counts.get('done', 0)} done, {counts.get('failed', 0)} failed, "
+              f"{counts.get('in_flight', 0)} in flight, {counts.get('queued', 0)} queued "
+              f"({round(byte_count / 1e6, 2)} MB written).")
+
+    # Close the journal
+    def close(self):
+        # Close the connection
+        self.journal.close()
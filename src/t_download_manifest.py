@@ -0,0 +1,277 @@
+import sqlite3
+import datetime
+import dotenv
+import t_laads_tools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import environ, walk
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+
+# Class for the manifest of downloaded granules (an indexed SQLite table in the output files directory)
+# Each granule has its file name, path (relative to the output directory), size, MD5 checksum and the product, tile
+# and date parsed from its name. The manifest is built from the output directory once, then updated as downloads
+# finish, so checking for files is a set lookup rather than a walk of the directory. The checksums are the catalog's
+# (already verified while streaming), so granules are never hashed just to be listed; entries whose files have since
+# been removed are dropped when the manifest is opened.
+class DownloadManifest:
+
+    __slots__ = ["manifest", "root_path"]
+
+    def __init__(self, root_path=None, rebuild=False):
+
+        # If no root path was provided
+        if root_path is None:
+            # Use the output files directory
+            root_path = environ["output_files_path"]
+        # Instantiate attributes
+        self.root_path = Path(root_path)
+        # Path to the manifest
+        manifest_path = self.root_path / "download_manifest.db"
+        # Whether there was a manifest already
+        manifest_existed = manifest_path.exists()
+        # Connect to the manifest
+        self.manifest = sqlite3.connect(manifest_path)
+        # Create the table if it is new
+        self.manifest.execute("CREATE TABLE IF NOT EXISTS files ("
+                              "file_name TEXT PRIMARY KEY, "
+                              "path TEXT NOT NULL, "
+                              "size INTEGER NOT NULL, "
+                              "checksum TEXT, "
+                              "product TEXT, "
+                              "tile TEXT, "
+                              "date TEXT)")
+        # Index for the product/tile/date queries
+        self.manifest.execute("CREATE INDEX IF NOT EXISTS files_product_tile_date ON files (product, tile, date)")
+        # If there was no manifest, or a rebuild was requested
+        if not manifest_existed or rebuild:
+            # Build the manifest from the directory
+            self.build()
+        # Otherwise
+        else:
+            # Drop the entries whose files no longer exist
+            self.prune()
+
+    # Build the manifest by walking the root directory (a single transaction, so it is all or nothing)
+    # The checksums come from the URL catalogs (any granule not in a catalog, or not matching its size, has none)
+    def build(self):
+        # Print update
+        print(f"Building download manifest for {self.root_path}")
+        # Get the granule paths from a walk of the root directory
+        file_paths = [Path(root) / name for root, dirs, files in walk(self.root_path)
+                      for name in files if name.endswith(".h5")]
+        # Get the catalog sizes and checksums of the granules
+        file_checks = get_catalog_checks([file_path.name for file_path in file_paths])
+        # Inside a transaction
+        with self.manifest:
+            # Clear the old entries
+            self.manifest.execute("DELETE FROM files")
+            # For each granule
+            for file_path in file_paths:
+                # Get its catalog size and checksum (if any)
+                expected_size, expected_checksum = file_checks.get(file_path.name, (None, None))
+                # Add it (with the checksum only if the file is the catalog's size, without committing)
+                self.add_file(file_path,
+                              checksum=expected_checksum if expected_size == file_path.stat().st_size else None,
+                              commit=False)
+
+    # Drop the entries whose files no longer exist (a single transaction)
+    def prune(self):
+        # Get the entries whose files are missing
+        missing = [(file_name,) for file_name, path in self.manifest.execute("SELECT file_name, path FROM files")
+                   if not (self.root_path / path).exists()]
+        # If there are any
+        if missing:
+            # Print update
+            print(f"Dropping {len(missing)} missing files from the download manifest.")
+            # Delete them
+            with self.manifest:
+                self.manifest.executemany("DELETE FROM files WHERE file_name = ?", missing)
+
+    # Add (or replace) a granule in the manifest, with its verified checksum and size if known (the size is read from
+    # the file otherwise; the file is never hashed here, so a granule without a checksum has none in the manifest)
+    def add_file(self, file_path, checksum=None, size=None, commit=True):
+        # Make sure we have a path object
+        file_path = Path(file_path)
+        # Parse the product, tile and date from the name
+        product, tile, date = parse_granule_name(file_path.name)
+        # Add the row
+        self.manifest.execute("INSERT OR REPLACE INTO files (file_name, path, size, checksum, product, tile, date) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (file_path.name,
+                               str(file_path.relative_to(self.root_path)),
+                               size if size is not None else file_path.stat().st_size,
+                               checksum,
+                               product,
+                               tile,
+                               date.isoformat() if date else None))
+        # If committing
+        if commit:
+            # Commit the row
+            self.manifest.commit()
+
+    # Remove a granule from the manifest
+    def remove_file(self, file_name):
+        # Inside a transaction
+        with self.manifest:
+            # Delete the row
+            self.manifest.execute("DELETE FROM files WHERE file_name = ?", (file_name,))
+
+    # Check whether a granule is in the manifest
+    def has_file(self, file_name):
+        # Return whether there is a row for the file
+        return self.manifest.execute("SELECT 1 FROM files WHERE file_name = ?", (file_name,)).fetchone() is not None
+
+    # Get the full path to a granule in the manifest (or None)
+    def get_file_path(self, file_name):
+        # Look up the path
+        row = self.manifest.execute("SELECT path FROM files WHERE file_name = ?", (file_name,)).fetchone()
+        # If the file was found
+        if row is not None:
+            # Return the full path
+            return self.root_path / row[0]
+        # Return None
+        return None
+
+    # Get the size and checksum of a granule in the manifest (or None)
+    def get_file_info(self, file_name):
+        # Return the row
+        return self.manifest.execute("SELECT size, checksum FROM files WHERE file_name = ?", (file_name,)).fetchone()
+
+    # Get the set of granule names in the manifest (optionally for a product and/or tile)
+    def get_file_names(self, product=None, tile=None):
+        # Query and parameters
+        query = "SELECT file_name FROM files WHERE 1 = 1"
+        parameters = []
+        # If there is a product
+        if product is not None:
+            query += " AND product = ?"
+            parameters.append(product)
+        # If there is a tile
+        if tile is not None:
+            query += " AND tile = ?"
+            parameters.append(tile)
+        # Return the set
+        return {row[0] for row in self.manifest.execute(query, parameters)}
+
+    # Get the list of granule paths in the manifest (relative to the root directory)
+    def get_file_paths(self):
+        # Return the paths
+        return [row[0] for row in self.manifest.execute("SELECT path FROM files")]
+
+    # Close the manifest
+    def close(self):
+        # Close the connection
+        self.manifest.close()
+
+
+# Get the catalog (size, checksum) of a list of granule names from the URL catalogs in the support files directory
+# (every archive set with a catalog of each granule's product). Returns a dictionary of file name to (size, checksum)
+def get_catalog_checks(file_names):
+    # Dictionary of product to its granule names
+    product_names = {}
+    for file_name in file_names:
+        product_names.setdefault(parse_granule_name(file_name)[0], []).append(file_name)
+    # Dictionary for the checks
+    file_checks = {}
+    # For each product
+    for product, names in product_names.items():
+        # If the name did not parse
+        if product is None:
+            # Skip it
+            continue
+        # For each catalog of the product (the archive set is the start of its name)
+        for catalog_path in sorted(Path(environ["support_files_path"]).glob(f"*_{product}_laads_urls.db")):
+            # Open the catalog (without spidering)
+            urls_dict = t_laads_tools.LaadsUrlsDict(product,
+                                                    archive_set=catalog_path.name.split('_')[0],
+                                                    spider_if_missing=False)
+            # Add the checks of the names not found yet
+            file_checks.update(urls_dict.get_file_checks([name for name in names if name not in file_checks]))
+            # Close the catalog
+            urls_dict.close()
+    # Return the checks
+    return file_checks
+
+
+# Get the MD5 checksum of a file, reading it in chunks
+def get_file_checksum(file_path, chunk_size=1024 * 1024):
+    # Return the hex digest
+    return t_laads_tools.hash_file(file_path, chunk_size=chunk_size).hexdigest()
+
+
+# Check a file on disk against an expected size and/or MD5 checksum (without opening it with h5py)
+def verify_file(file_path, expected_size=None, expected_checksum=None):
+    # If the file is missing
+    if file_path is None or not Path(file_path).exists():
+        # Return False
+        return False
+    # If the size does not match (cheap, so checked first)
+    if expected_size is not None and Path(file_path).stat().st_size != expected_size:
+        # Return False
+        return False
+    # If the checksum does not match
+    if expected_checksum is not None and get_file_checksum(file_path) != expected_checksum:
+        # Return False
+        return False
+    # Return True
+    return True
+
+
+# Verify the granules in a manifest against the sizes and checksums in their catalogs (URL dict objects), hashing
+# the files with a pool of worker threads. Returns the names of the files that failed, which are removed from the
+# manifest if requested (so the next download run fetches them again).
+def verify_files(manifest, urls_dicts, max_workers=4, remove_failed=False):
+    # Dictionary of file name to expected (size, checksum)
+    file_checks = {}
+    # For each URL dict
+    for urls_dict in urls_dicts:
+        # Get the checks for the product's files in the manifest
+        file_checks.update(urls_dict.get_file_checks(manifest.get_file_names(product=urls_dict.data_product)))
+    # Get the paths of the files (only files with something to check against)
+    file_paths = {file_name: manifest.get_file_path(file_name) for file_name, checks in file_checks.items()
+                  if checks[0] is not None or checks[1] is not None}
+    # Print update
+    print(f"Verifying {len(file_paths)} files ({len(file_checks) - len(file_paths)} have no catalog size/checksum).")
+    # List of the failed files
+    failed_list = []
+    # Start a ThreadPoolExecutor (hashing releases the GIL, so the threads read and hash in parallel)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Submit the files
+        future_events = {executor.submit(verify_file, file_path, *file_checks[file_name]): file_name
+                         for file_name, file_path in file_paths.items()}
+        # As each file is verified
+        for completed_event in as_completed(future_events):
+            # If it failed
+            if not completed_event.result():
+                # Add it to the list
+                failed_list.append(future_events[completed_event])
+    # Print update
+    print(f"{len(failed_list)} files failed verification.")
+    # If removing the failed files from the manifest
+    if remove_failed:
+        # For each failed file
+        for file_name in failed_list:
+            # Remove it
+            manifest.remove_file(file_name)
+    # Return the failed files
+    return sorted(failed_list)
+
+
+# Parse the product, tile and date from a granule name (e.g. VNP43MA3.A2021201.h09v05.001.2021277141246.h5)
+def parse_granule_name(file_name):
+    # Split the name on the periods
+    split_name = file_name.split('.')
+    # Try to parse the name
+    try:
+        # Get the date from the year and DOY
+        date = datetime.date(year=int(split_name[1][1:5]), month=1, day=1) + \
+            datetime.timedelta(days=int(split_name[1][5:8]) - 1)
+        # Return the product, tile and date
+        return split_name[0], split_name[2], date
+    # If the name does not follow the convention
+    except (IndexError, ValueError):
+        # Return None for each
+        return None, None, None
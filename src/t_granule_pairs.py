@@ -0,0 +1,179 @@
+import datetime
+import dotenv
+from os import environ, walk
+from pathlib import Path
+
+# Load the .env file
+dotenv.load_dotenv()
+
+# Satellite prefixes of the granule names (SNPP and NOAA-20)
+satellites = ["VNP", "VJ1"]
+
+
+# Class for the details of a granule parsed from its name (e.g. 3194/VJ143MA3.A2021201.h09v05.002.2021209072428.h5)
+class Granule:
+
+    __slots__ = ["path", "satellite", "product", "date", "tile", "collection", "production", "archive_set"]
+
+    def __init__(self, path, satellite, product, date, tile, collection, production, archive_set=None):
+
+        # Instantiate attributes
+        self.path = path
+        self.satellite = satellite
+        self.product = product
+        self.date = date
+        self.tile = tile
+        self.collection = collection
+        self.production = production
+        self.archive_set = archive_set
+
+    # Get the version of the granule (newer collections first, then newer production times)
+    def get_version(self):
+        # Return the collection and production time
+        return self.collection, self.production
+
+
+# Parse a granule from its path (relative to the output directory, the archive set being its directory, if any) or its
+# LAADS URL (the archive set following allData). Returns a Granule object, or None if the name does not follow the
+# convention
+def parse_granule(file_path):
+    # Split the path (or URL) into its parts
+    path_parts = str(file_path).replace('\\', '/').split('/')
+    # Split the name on the periods
+    split_name = path_parts[-1].split('.')
+    # If it is not a VNP/VJ1 H5 granule name (product, date, tile, collection, production time, extension)
+    if len(split_name) != 6 or split_name[-1] != 'h5' or split_name[0][:3] not in satellites:
+        # Return None
+        return None
+    # Try to parse the date (AYYYYDDD) and production time (YYYYDDDHHMMSS)
+    try:
+        date = datetime.date(year=int(split_name[1][1:5]), month=1, day=1) + \
+            datetime.timedelta(days=int(split_name[1][5:8]) - 1)
+        production = datetime.datetime.strptime(split_name[4], '%Y%j%H%M%S')
+    # If either is malformed
+    except ValueError:
+        # Return None
+        return None
+    # If it is a LAADS URL
+    if 'allData' in path_parts[:-1]:
+        # The archive set follows allData
+        archive_set = path_parts[path_parts.index('allData') + 1]
+    # Otherwise
+    else:
+        # The archive set is the directory (if any)
+        archive_set = path_parts[-2] if len(path_parts) > 1 else None
+    # Return the granule
+    return Granule(str(file_path),
+                   split_name[0][:3],
+                   split_name[0][3:],
+                   date,
+                   split_name[2],
+                   split_name[3],
+                   production,
+                   archive_set=archive_set)
+
+
+# Class for the index of VNP/VJ1 granule pairs, keyed by (product, tile, date)
+# Granules are added in a single pass; for each key and satellite only the newest version (collection, then production
+# time) is kept, and the older ones are recorded as superseded. Keys with only one satellite are unpaired.
+class GranulePairIndex:
+
+    __slots__ = ["granules", "superseded", "skipped"]
+
+    def __init__(self):
+
+        # Dictionary of (product, tile, date) to a dictionary of satellite to Granule
+        self.granules = {}
+        # Superseded granules and the paths that were not granule names
+        self.superseded = []
+        self.skipped = []
+
+    # Add a granule by its path (relative to the output directory)
+    def add(self, file_path):
+        # Parse the granule
+        granule = parse_granule(file_path)
+        # If it is not a granule
+        if granule is None:
+            # Record it as skipped
+            self.skipped.append(str(file_path))
+            # Return
+            return
+        # Get the satellites of its key
+        key_granules = self.granules.setdefault((granule.product, granule.tile, granule.date), {})
+        # Get the granule already there for its satellite (if any)
+        current = key_granules.get(granule.satellite)
+        # If there is none, or this one is newer
+        if current is None or granule.get_version() > current.get_version():
+            # Keep this one
+            key_granules[granule.satellite] = granule
+            # If there was one
+            if current is not None:
+                # Record it as superseded
+                self.superseded.append(current)
+        # Otherwise
+        else:
+            # Record this one as superseded
+            self.superseded.append(granule)
+
+    # Check whether a key matches the (optional) lists of products and tiles and range of dates (inclusive)
+    @staticmethod
+    def key_matches(key, products=None, tiles=None, start_date=None, end_date=None):
+        # Split the key
+        product, tile, date = key
+        # Return whether it matches
+        return (products is None or product in products) and (tiles is None or tile in tiles) and \
+            (start_date is None or date >= start_date) and (end_date is None or date <= end_date)
+
+    # Get the [vnp file, vj1 file] pairs (sorted by product, tile and date), for run_comparisons and the like
+    def get_pairs(self, products=None, tiles=None, start_date=None, end_date=None):
+        # Return the pairs
+        return [[key_granules['VNP'].path, key_granules['VJ1'].path]
+                for key, key_granules in sorted(self.granules.items())
+                if len(key_granules) == 2 and self.key_matches(key, products, tiles, start_date, end_date)]
+
+    # Get the unpaired granules (sorted by product, tile and date)
+    def get_unpaired(self, products=None, tiles=None, start_date=None, end_date=None):
+        # Return the granules
+        return [granule for key, key_granules in sorted(self.granules.items())
+                if len(key_granules) == 1 and self.key_matches(key, products, tiles, start_date, end_date)
+                for granule in key_granules.values()]
+
+    # Print a summary of the index (the number of pairs, and each unpaired granule)
+    def report(self):
+        # Get the unpaired granules
+        unpaired = self.get_unpaired()
+        # Print update
+        print(f"{len(self.get_pairs())} VNP/VJ1 pairs, {len(unpaired)} unpaired and {len(self.superseded)} superseded "
+              f"granules.")
+        # For each unpaired granule
+        for granule in unpaired:
+            # Print a warning
+            print(f"Warning: {granule.path} has no {'VJ1' if granule.satellite == 'VNP' else 'VNP'} pair.")
+
+
+# Build the index of granule pairs from the granules in the output directory (its archive set subdirectories), in a
+# single walk, or from the download manifest if there is one (a DownloadManifest object). archive_sets optionally
+# limits the index to granules in those archive set directories.
+# Returns a GranulePairIndex object
+def build_pair_index(manifest=None, archive_sets=None):
+    # Start the index
+    pair_index = GranulePairIndex()
+    # If there is a manifest
+    if manifest is not None:
+        # Get the granule paths from it
+        file_paths = manifest.get_file_paths()
+    # Otherwise
+    else:
+        # Root of the output directory
+        root_path = Path(environ['output_files_path'])
+        # Get the granule paths (relative to the output directory) from a walk of the directory
+        file_paths = [str((Path(root) / name).relative_to(root_path)) for root, dirs, files in walk(root_path)
+                      for name in files if name.endswith('.h5')]
+    # For each path
+    for file_path in file_paths:
+        # If it is in one of the archive sets (or there are none)
+        if archive_sets is None or Path(file_path).parent.name in archive_sets:
+            # Add it
+            pair_index.add(file_path)
+    # Return the index
+    return pair_index
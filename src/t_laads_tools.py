@@ -1,11 +1,18 @@
 import requests
+import requests.adapters
 import json
-from time import sleep
+import hashlib
+import sqlite3
 import h5py
 import io
 import datetime
 import dotenv
-from os import environ, walk
+import threading
+import email.utils
+from random import uniform
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import sleep, time
+from os import environ, walk, replace
 from pathlib import Path
 
 # Load the .env file
@@ -13,63 +20,80 @@ dotenv.load_dotenv()
 
 
 # Class for URL dictionary (to load when you need it)
+# The URLs are held in an indexed SQLite catalog (tile, year, DOY -> file name) in the support files directory, so
+# opening it is instant and lookups only read the rows they need. Older JSON URL files are imported on first use.
 class LaadsUrlsDict:
 
-    __slots__ = ["dictionary", "data_product", "archive_set"]
+    __slots__ = ["catalog", "data_product", "archive_set"]
 
-    def __init__(self, data_product, archive_set="5000"):
+    def __init__(self, data_product, archive_set="5000", spider_if_missing=True, update=False):
 
         # Instantiate attributes
-        self.dictionary = None
         self.data_product = data_product
         self.archive_set = archive_set
-        # Latest date
-        latest_date = None
-        # URl dictionary instantiation
-        urls_dict = None
-        # Walk the support file directory
-        for root, dirs, files in walk(environ["support_files_path"]):
-            # For each file name
-            for name in files:
-                # If the file is one of the URL files
-                if f"{archive_set}_{data_product}_laads_urls" in name:
-                    # Split the name
-                    split_name = name.split('_')
-                    # Make a datetime date object from the name
-                    file_date = datetime.date(year=int(split_name[-1][4:8]),
-                                              month=int(split_name[-1][0:2]),
-                                              day=int(split_name[-1][2:4]))
-                    # If there is no latest date yet
-                    if latest_date is None:
-                        # Set the file's date
-                        latest_date = file_date
-                    # Otherwise, if the file's date is later
-                    elif file_date > latest_date:
-                        # Set the file's date as latest
-                        latest_date = file_date
-        # If there was a file (as indicated by the presence of a latest date)
-        if latest_date is not None:
-            # Print update
-            print(f"Opening URLs file from {latest_date}")
-            # Assemble the path to the file
-            latest_file_path = Path(
-                environ["support_files_path"] + f'{self.archive_set}_{self.data_product}_laads_urls_' + latest_date.strftime(
-                    "%m%d%Y") + ".json")
-            # Open the file
-            with open(latest_file_path, 'r') as f:
-                # Load as dictionary
-                urls_dict = json.load(f)
-            # Reference dictionary
-            self.dictionary = urls_dict
-        # Otherwise (no file)
-        else:
-            # Update the file (this will reference the dictionary)
+        # Path to the catalog for the product and archive set
+        catalog_path = get_urls_catalog_path(data_product, archive_set)
+        # Whether there was a catalog already
+        catalog_existed = catalog_path.exists()
+        # Open (or create) the catalog
+        self.catalog = open_urls_catalog(catalog_path)
+        # If there was no catalog
+        if not catalog_existed:
+            # Get the old JSON URL files for the product and archive set (oldest first)
+            urls_files = get_urls_dict_files(data_product, archive_set)
+            # If there was a file
+            if urls_files:
+                # Import the latest one
+                import_urls_json(self, urls_files[-1][1])
+        # If there are URLs in the catalog
+        if self.get_high_water_mark() is not None:
+            # If an update was requested
+            if update:
+                # Fetch only the days after the catalog's high-water mark
+                get_VIIRS_availability(data_product,
+                                       existing_dict=self,
+                                       archive_set=self.archive_set,
+                                       cleanup_old_files=True)
+        # Otherwise, if the catalog is empty and we are allowed to spider LAADS for it
+        elif spider_if_missing:
+            # Update the catalog
             get_VIIRS_availability(data_product,
                                    existing_dict=self,
                                    archive_set=self.archive_set)
 
-    # Get a LAADS url from a datetime object
-    def get_url_from_date(self, tile, date, file_only=False):
+    # Get the latest (year, DOY) in the catalog as LAADS listing names, or None if it is empty
+    def get_high_water_mark(self):
+        # Get the latest row
+        row = self.catalog.execute("SELECT year, doy FROM urls ORDER BY year DESC, doy DESC LIMIT 1").fetchone()
+        # If the catalog is empty
+        if row is None:
+            # Return None
+            return None
+        # Return the high-water mark
+        return str(row[0]), zero_pad_number(row[1])
+
+    # Get the set of (year, DOY) pairs that have at least one tile in the catalog
+    def get_known_days(self):
+        # Return the set over all tiles
+        return {(str(year), zero_pad_number(doy))
+                for year, doy in self.catalog.execute("SELECT DISTINCT year, doy FROM urls")}
+
+    # Check whether a tile is in the catalog
+    def has_tile(self, tile):
+        # Return whether there is a row for the tile
+        return self.catalog.execute("SELECT 1 FROM urls WHERE tile = ? LIMIT 1", (tile,)).fetchone() is not None
+
+    # Assemble the full LAADS URL for a file
+    def get_full_url(self, year, doy, file_name):
+        # Assemble the full URL
+        full_url = environ["laads_alldata_url"]
+        full_url += self.archive_set + '/' + self.data_product + '/' + str(year) + '/'
+        full_url += zero_pad_number(doy) + '/' + file_name
+        # Return the full url
+        return full_url
+
+    # Get the date the catalog will hold a product's file under (monthly and annual products use the period start)
+    def get_period_date(self, date):
         # <> Generalized to a support database/table that contains keywords like "monthly", "annual"
         # If the data product is VNP46A3
         if self.data_product == "VNP46A3":
@@ -80,116 +104,477 @@ class LaadsUrlsDict:
             # Set the day and month to 1
             date = date.replace(day=1)
             date = date.replace(month=1)
-        # If the tile is in the dictionary
-        if tile in self.dictionary.keys():
-            # If the year is in the subdictionary
-            if str(date.year) in self.dictionary[tile].keys():
-                # Get the day of year
-                doy = zero_pad_number((date - datetime.date(year=date.year, month=1, day=1)).days + 1)
-                # If the doy is in the subdictionary
-                if doy in self.dictionary[tile][str(date.year)].keys():
-                    # Get the file name
-                    file_name = self.dictionary[tile][str(date.year)][doy]
-                    # If only the file name was request
-                    if file_only:
-                        # Return the filename
-                        return file_name
-                    # Otherwise (full URL)
-                    else:
-                        # Assemble the full URL
-                        full_url = environ["laads_alldata_url"]
-                        full_url += self.archive_set + '/' + self.data_product + '/' + str(date.year) + '/'
-                        full_url += doy + '/' + file_name
-                        # Return the full url
-                        return full_url
+        # Return the date
+        return date
+
+    # Get a LAADS url from a datetime object
+    def get_url_from_date(self, tile, date, file_only=False):
+        # Get the date of the product's period
+        date = self.get_period_date(date)
+        # Get the day of year
+        doy = get_doy_from_date(date)
+        # Look up the file name
+        row = self.catalog.execute("SELECT file_name FROM urls WHERE tile = ? AND year = ? AND doy = ?",
+                                   (tile, date.year, doy)).fetchone()
+        # If there was a file
+        if row is not None:
+            # If only the file name was request
+            if file_only:
+                # Return the filename
+                return row[0]
+            # Otherwise (full URL)
+            else:
+                # Return the full url
+                return self.get_full_url(date.year, doy, row[0])
         # Return None
         return None
 
+    # Get the files for several tiles over a date range or date list in one catalog query
+    # Returns a list of (tile, date, file name, URL) tuples sorted by tile then date, where the date is the start of the
+    # product's period (so monthly and annual products give one file per period, however many dates fall in it)
+    def get_files_from_dates(self, tiles, start_date=None, end_date=None, dates=None):
+        # List for the files
+        files_list = []
+        # If a date list was provided
+        if dates is not None:
+            # Get the (year, DOY) of each period in the list
+            period_keys = {(period_date.year, get_doy_from_date(period_date))
+                           for period_date in (self.get_period_date(date) for date in dates)}
+            # If there are no dates
+            if not period_keys:
+                # Return the empty list
+                return files_list
+            # Years to query
+            start_year = min(period_keys)[0]
+            end_year = max(period_keys)[0]
+        # Otherwise (date range)
+        else:
+            # <> Min year is based on VIIRS life span
+            if start_date is None:
+                start_date = datetime.date(year=2011, month=1, day=1)
+            if end_date is None:
+                end_date = datetime.date.today()
+            # Get the (year, DOY) bounds of the range's periods
+            start_key = (self.get_period_date(start_date).year, get_doy_from_date(self.get_period_date(start_date)))
+            end_key = (end_date.year, get_doy_from_date(end_date))
+            # Years to query
+            start_year = start_key[0]
+            end_year = end_key[0]
+        # Query the catalog for the tiles and years (uses the primary key index)
+        rows = self.catalog.execute(f"SELECT tile, year, doy, file_name FROM urls "
+                                    f"WHERE tile IN ({', '.join('?' * len(tiles))}) AND year BETWEEN ? AND ? "
+                                    f"ORDER BY tile, year, doy",
+                                    (*tiles, start_year, end_year))
+        # For each file in the catalog
+        for tile, year, doy, file_name in rows:
+            # If the file is in the date list, or the date range
+            if (dates is not None and (year, doy) in period_keys) or \
+                    (dates is None and start_key <= (year, doy) <= end_key):
+                # Add the file to the list
+                files_list.append((tile,
+                                   datetime.date(year=year, month=1, day=1) + datetime.timedelta(days=doy - 1),
+                                   file_name,
+                                   self.get_full_url(year, doy, file_name)))
+        # Return the file list
+        return files_list
+
     # Get the urls for a specified date range, or date list
-    # <> Min year is based on VIIRS life span
     def get_urls_from_date_range(self,
                                  tile="h00v00",
-                                 start_date=datetime.date(year=2011, month=1, day=1),
-                                 end_date=datetime.datetime.now()):
-        # List for URLs
-        urls_list = []
+                                 start_date=None,
+                                 end_date=None,
+                                 dates=None):
         # Check we have information for the tile
-        if tile not in self.dictionary.keys():
+        if not self.has_tile(tile):
             # Print a warning
-            print(f"Warning tile {tile} not found in the URL dictionary.")
+            print(f"Warning tile {tile} not found in the URL catalog.")
             # End
-            return urls_list
-        # Specify target date
-        target_date = start_date
-        # While the target date is before end date
-        while target_date <= end_date:
-            # Get the URL (if any)
-            target_url = self.get_url_from_date(tile, target_date)
-            # If there was a URL
-            if target_url:
-                # Append the URL to the list
-                urls_list.append(target_url)
-            # Add a day to target date
-            target_date += datetime.timedelta(days=1)
-        # Return the url list
-        return urls_list
-
-
-# Function to submit request to LAADS and keep trying until we get a response
-def try_try_again(r, s, target_url):
-
-    # Back-off timer
-    back_off = 5
-    # If we get timed out
-    while r.status_code != 200:
-        # Print a warning
-        print(f'Warning, bad response for {target_url}.')
-        # Wait a hot second
-        sleep(back_off)
-        # Try again
-        r = s.get(target_url)
-        # Add to back off timer
-        back_off += 1
-    # Return the completed request
-    return r
-
-
-# Connect to LAADS and return a session object
-def connect_to_laads():
-    # Header command utilizing security token
-    authToken = {'Authorization': f'Bearer {environ["laads_token"]}'}
+            return []
+        # Return the URLs for the tile
+        return [target_url for tile_name, date, file_name, target_url in
+                self.get_files_from_dates([tile], start_date=start_date, end_date=end_date, dates=dates)]
+
+    # Get a dictionary of file name to expected (size, checksum) for a list of file names
+    def get_file_checks(self, file_names):
+        # Dictionary for the checks
+        file_checks = {}
+        # For each file name
+        for file_name in file_names:
+            # Split the name on the periods (the tile, year and DOY are in the name, so we can use the index)
+            split_name = file_name.split('.')
+            # Look up the size and checksum
+            row = self.catalog.execute("SELECT size, checksum FROM urls WHERE tile = ? AND year = ? AND doy = ? "
+                                       "AND file_name = ?",
+                                       (split_name[2], int(split_name[1][1:5]), int(split_name[1][5:8]), file_name)
+                                       ).fetchone()
+            # If the file was found
+            if row is not None:
+                # Add the check
+                file_checks[file_name] = row
+        # Return the dictionary
+        return file_checks
+
+    # Close the catalog
+    def close(self):
+        # Close the connection
+        self.catalog.close()
+
+
+# Class to schedule requests to LAADS (shared by the spider and the downloader threads)
+# Concurrency is limited to a number of slots that grows by one after a run of healthy responses and halves on a
+# throttled (429), server error (5xx) or failed (timeout/connection) request. Failed requests are retried with capped
+# exponential backoff and jitter (or the server's Retry-After), during which no new requests start, up to a maximum
+# number of attempts.
+class RequestScheduler:
+
+    __slots__ = ["limit", "min_limit", "max_limit", "active", "successes", "paused_until", "max_attempts",
+                 "base_back_off", "max_back_off", "timeout", "requests", "bytes", "start_time", "condition"]
+
+    def __init__(self,
+                 initial_limit=4,
+                 min_limit=1,
+                 max_limit=16,
+                 max_attempts=8,
+                 base_back_off=1,
+                 max_back_off=120,
+                 timeout=(10, 120)):
+
+        # Current, minimum and maximum number of concurrent requests
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # Number of requests in progress and healthy responses since the limit last changed
+        self.active = 0
+        self.successes = 0
+        # Time before which no new requests start (while backing off)
+        self.paused_until = 0
+        # Maximum attempts per request
+        self.max_attempts = max_attempts
+        # Base and maximum back off (seconds)
+        self.base_back_off = base_back_off
+        self.max_back_off = max_back_off
+        # Timeout for each request (seconds to connect, seconds between bytes)
+        self.timeout = timeout
+        # Number of requests and bytes received, and the start time (for throughput)
+        self.requests = 0
+        self.bytes = 0
+        self.start_time = time()
+        # Condition for the slots (shared by the worker threads)
+        self.condition = threading.Condition()
+
+    # Take a slot (used as a context manager around each request or download)
+    def __enter__(self):
+        # Lock the slots
+        with self.condition:
+            # Until we get a slot
+            while True:
+                # Time left to back off
+                wait = self.paused_until - time()
+                # If we are backing off
+                if wait > 0:
+                    # Wait it out
+                    self.condition.wait(wait)
+                # Otherwise, if there is a free slot
+                elif self.active < self.limit:
+                    # Take it
+                    self.active += 1
+                    # Return the scheduler
+                    return self
+                # Otherwise
+                else:
+                    # Wait for a slot to be released
+                    self.condition.wait()
+
+    # Release a slot
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Lock the slots
+        with self.condition:
+            # Release the slot
+            self.active -= 1
+            # Wake the waiting threads
+            self.condition.notify_all()
+
+    # Record a healthy response (raises the limit by one after a limit's worth of them)
+    def record_success(self):
+        # Lock the slots
+        with self.condition:
+            # Add to the healthy responses
+            self.successes += 1
+            # If there have been enough
+            if self.successes >= self.limit:
+                # Raise the limit
+                self.limit = min(self.limit + 1, self.max_limit)
+                self.successes = 0
+                # Wake the waiting threads
+                self.condition.notify_all()
+
+    # Record a failed request, halve the limit, pause new requests and return the back off (seconds)
+    def record_failure(self, attempt=0, retry_after=None):
+        # If the server told us how long to wait
+        if retry_after is not None:
+            # Use it (capped)
+            back_off = min(retry_after, self.max_back_off)
+        # Otherwise
+        else:
+            # Exponential back off with full jitter (capped)
+            back_off = uniform(0, min(self.max_back_off, self.base_back_off * 2 ** attempt))
+        # Lock the slots
+        with self.condition:
+            # Halve the limit
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.successes = 0
+            # Pause new requests
+            self.paused_until = max(self.paused_until, time() + back_off)
+        # Return the back off
+        return back_off
+
+    # Record bytes received
+    def add_bytes(self, count):
+        # Lock the counters
+        with self.condition:
+            # Add to the byte count
+            self.bytes += count
+
+    # Get the throughput (requests per second, bytes per second) since the scheduler started
+    def get_throughput(self):
+        # Time elapsed (guarding against division by zero)
+        elapsed = max(time() - self.start_time, 1e-6)
+        # Return the rates
+        return self.requests / elapsed, self.bytes / elapsed
+
+    # Print the current limit and throughput
+    def report(self):
+        # Get the throughput
+        request_rate, byte_rate = self.get_throughput()
+        # Print the update
+        print(f"{self.active}/{self.limit} requests in progress, {round(request_rate, 2)} requests/s, "
+              f"{round(byte_rate / 1e6, 2)} MB/s.")
+
+    # Submit one attempt at a GET request (attempt is the number of attempts already made, for the back off)
+    # Returns the response and None if it was healthy (or a client error such as 404, for the caller to handle),
+    # otherwise None and the back off (seconds) after recording the failure
+    def try_get(self, session_obj, target_url, attempt=0, stream=False, headers=None):
+        # Try the request
+        try:
+            # Submit the request
+            r = session_obj.get(target_url, stream=stream, headers=headers, timeout=self.timeout)
+        # If the request failed (timeout or connection error)
+        except requests.RequestException as e:
+            # Print a warning
+            print(f'Warning, request for {target_url} failed ({type(e).__name__}).')
+            # Return the back off
+            return None, self.record_failure(attempt=attempt)
+        # Record the request
+        with self.condition:
+            self.requests += 1
+        # If we are being throttled or there was a server error
+        if r.status_code == 429 or r.status_code >= 500:
+            # Print a warning
+            print(f'Warning, bad response ({r.status_code}) for {target_url}.')
+            # Release the connection
+            r.close()
+            # Return the back off
+            return None, self.record_failure(attempt=attempt, retry_after=get_retry_after(r))
+        # Record the success
+        self.record_success()
+        # Return the response
+        return r, None
+
+    # Submit a GET request, retrying throttled, server error and failed requests with back off
+    # Returns the response (which may be a client error such as 404, for the caller to handle)
+    def get(self, session_obj, target_url, stream=False, headers=None):
+        # For each attempt
+        for attempt in range(self.max_attempts):
+            # Try the request
+            r, back_off = self.try_get(session_obj, target_url, attempt=attempt, stream=stream, headers=headers)
+            # If it was healthy
+            if r is not None:
+                # Return the response
+                return r
+            # Wait before trying again
+            sleep(back_off)
+        # Out of attempts, raise an error
+        raise requests.exceptions.RetryError(f"Request for {target_url} failed after {self.max_attempts} attempts.")
+
+
+# Get the seconds to wait from a response's Retry-After header (seconds or an HTTP date), or None
+def get_retry_after(r):
+    # Get the header
+    retry_after = r.headers.get("Retry-After")
+    # If there is no header
+    if retry_after is None:
+        # Return None
+        return None
+    # If it is a number of seconds
+    if retry_after.strip().isdigit():
+        # Return the seconds
+        return int(retry_after)
+    # Try to parse it as a date
+    try:
+        # Return the seconds until the date
+        return max(0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time())
+    # If it is not a date
+    except (TypeError, ValueError):
+        # Return None
+        return None
+
+
+# Scheduler shared by all LAADS requests unless another is provided
+laads_scheduler = RequestScheduler()
+
+
+# Get the LAADS authorization header (utilizing security token)
+def get_laads_headers():
+    # Return the header
+    return {'Authorization': f'Bearer {environ["laads_token"]}'}
+
+
+# Connect to LAADS and return a session object (optionally with its connection pool sized for a number of workers)
+def connect_to_laads(pool_size=None):
     # Create session
     s = requests.session()
     # Update header with authorization
-    s.headers.update(authToken)
+    s.headers.update(get_laads_headers())
+    # If a pool size was requested
+    if pool_size is not None:
+        # Mount an adapter that keeps that many connections alive
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
     # Return the session object
     return s
 
 
+# Class for a pool of LAADS sessions, one per worker thread (requests sessions are not thread-safe)
+# Each thread reuses its session, and so its kept-alive connections, for every request it makes, rather than paying a
+# new TCP/TLS handshake per file. The sessions are closed together when the run ends.
+class LaadsSessionPool:
+
+    __slots__ = ["local", "sessions", "pool_size", "lock"]
+
+    def __init__(self, pool_size=None):
+
+        # Thread-local storage for the sessions
+        self.local = threading.local()
+        # List of all the sessions opened (so they can be closed)
+        self.sessions = []
+        # Connection pool size for each session
+        self.pool_size = pool_size
+        # Lock for the session list
+        self.lock = threading.Lock()
+
+    # Get the calling thread's session (connecting to LAADS if it does not have one yet)
+    def get_session(self):
+        # If this thread does not have a session yet
+        if getattr(self.local, "session", None) is None:
+            # Connect to LAADS
+            self.local.session = connect_to_laads(pool_size=self.pool_size)
+            # Add the session to the list
+            with self.lock:
+                self.sessions.append(self.local.session)
+        # Return the session
+        return self.local.session
+
+    # Close all the sessions
+    def close(self):
+        # Lock the session list
+        with self.lock:
+            # Close each session
+            for session_obj in self.sessions:
+                session_obj.close()
+            # Empty the list
+            self.sessions = []
+        # Start new thread-local storage (so threads reconnect if the pool is used again)
+        self.local = threading.local()
+
+    # Use the pool as a context manager
+    def __enter__(self):
+        # Return the pool
+        return self
+
+    # Close the sessions on exit
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Close the sessions
+        self.close()
+
+
 # Get a VIIRS H5 file from laads and return it in some form
-def get_VIIRS_file(session_obj, target_url, write_local=False, return_content=False, return_file=True):
-    # Request the H5 file from the provided URL
-    r = session_obj.get(target_url)
-    # If the request failed
+# Files written locally (without returning the content) are streamed to disk, so memory use is one chunk
+# If the expected size and/or MD5 checksum (from the catalog) are provided they are used to check the file, otherwise
+# the file is checked by opening it with h5py
+# Local files are written to the output directory, or to output_path (a directory path ending in a separator)
+def get_VIIRS_file(session_obj,
+                   target_url,
+                   write_local=False,
+                   return_content=False,
+                   return_file=True,
+                   chunk_size=64 * 1024,
+                   expected_size=None,
+                   expected_checksum=None,
+                   scheduler=None,
+                   output_path=None):
+    # If no scheduler was provided
+    if scheduler is None:
+        # Use the shared scheduler
+        scheduler = laads_scheduler
+    # If no output directory was provided
+    if output_path is None:
+        # Use the output files directory
+        output_path = environ["output_files_path"]
+    # If we are writing to disk and do not need the content
+    if write_local is True and return_content is not True:
+        # Stream the file to disk
+        return stream_VIIRS_file(session_obj,
+                                 target_url,
+                                 return_file=return_file,
+                                 chunk_size=chunk_size,
+                                 expected_size=expected_size,
+                                 expected_checksum=expected_checksum,
+                                 scheduler=scheduler,
+                                 output_path=output_path)
+    # Try to request the H5 file from the provided URL (in one of the scheduler's slots, reading all the content)
+    try:
+        with scheduler:
+            r = scheduler.get(session_obj, target_url)
+            r.content
+    # If we ran out of attempts
+    except requests.RequestException:
+        # Print a warning
+        print(f'Warning: File {target_url} could not be downloaded.')
+        # Return None
+        return None
+    # If the request failed (client error)
     if r.status_code != 200:
-        # Send to repeated submission function
-        r = try_try_again(r, session_obj, target_url)
+        # Print a warning
+        print(f'Warning: Bad response ({r.status_code}) for {target_url}.')
+        # Return None
+        return None
+    # Record the bytes received
+    scheduler.add_bytes(len(r.content))
+    # If there is an expected size or checksum, and the content does not match
+    if (expected_size is not None and len(r.content) != expected_size) or \
+            (expected_checksum is not None and hashlib.md5(r.content).hexdigest() != expected_checksum):
+        # Print a warning
+        print(f'Warning: File {target_url} does not match its catalog size/checksum. Possibly incomplete.')
+        # Return None
+        return None
     # Try to convert into an h5 object
     try:
         # If write to disk
         if write_local is True:
-            with open(environ["output_files_path"] + target_url.split('/')[-1], 'wb') as f:
+            with open(output_path + target_url.split('/')[-1], 'wb') as f:
                 f.write(r.content)
         # If content
         if return_content is True:
             return r.content
-        # Convert to h5 file object (checks integrity)
-        # <> Replace with checksum
-        h5file = h5py.File(io.BytesIO(r.content), 'r')
-        # If we are returning the file
-        if return_file:
-            # Convert the response content to an H5py File object and return
-            return h5file
+        # If we are returning the file, or there is nothing to check the content against
+        if return_file or (expected_size is None and expected_checksum is None):
+            # Convert to h5 file object (checks integrity)
+            h5file = h5py.File(io.BytesIO(r.content), 'r')
+            # If we are returning the file
+            if return_file:
+                # Return the H5py File object
+                return h5file
         # If returning nothing else, but successfully reached this point, return True
         return True
     # If it fails (incomplete file)
@@ -200,94 +585,585 @@ def get_VIIRS_file(session_obj, target_url, write_local=False, return_content=Fa
         return None
 
 
+# Stream a VIIRS H5 file from LAADS to the output directory (or output_path), chunk by chunk, and return it in some form
+# The file is written to a .part file, checked with h5py from disk, and only then renamed to its final name
+# If the transfer drops, or a .part file was left by an earlier run, the download resumes with an HTTP Range request
+# With an expected size and/or MD5 checksum the file is checked by hashing the bytes as they arrive instead of with h5py
+# Failed requests and dropped transfers share the scheduler's attempts and back off (there is no second retry loop)
+def stream_VIIRS_file(session_obj,
+                      target_url,
+                      return_file=True,
+                      chunk_size=64 * 1024,
+                      expected_size=None,
+                      expected_checksum=None,
+                      scheduler=None,
+                      output_path=None):
+    # If no scheduler was provided
+    if scheduler is None:
+        # Use the shared scheduler
+        scheduler = laads_scheduler
+    # If no output directory was provided
+    if output_path is None:
+        # Use the output files directory
+        output_path = environ["output_files_path"]
+    # Path to the output file and its partial file
+    file_path = Path(output_path + target_url.split('/')[-1])
+    part_path = get_partial_path(file_path)
+    # Checksum of the bytes in the partial file
+    checksum = None
+    # Take one of the scheduler's slots for the download
+    with scheduler:
+        # For each attempt
+        for attempt in range(scheduler.max_attempts):
+            # Get the number of bytes we already have
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            # Request the rest of the file (all of it if we have nothing yet)
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            # Try the request for the H5 file (without reading the body yet)
+            r, back_off = scheduler.try_get(session_obj, target_url, attempt=attempt, stream=True, headers=headers)
+            # If it failed (throttled, server error or no connection)
+            if r is None:
+                # Wait before trying again
+                sleep(back_off)
+                # Try again
+                continue
+            # If the range starts at or past the end of the file (the partial file should be complete)
+            if r.status_code == 416:
+                # Release the connection
+                r.close()
+                # Size of the file (the expected size, or the total of a "bytes */total" content range, if any)
+                remote_size = expected_size if expected_size is not None else \
+                    int(r.headers.get("Content-Range", "/-1").split('/')[-1])
+                # If we are checking a checksum
+                if expected_checksum is not None:
+                    # Hash the partial file
+                    checksum = hash_file(part_path, chunk_size=chunk_size)
+                # If the partial file does not match the size or checksum
+                if (remote_size >= 0 and offset != remote_size) or \
+                        (checksum is not None and checksum.hexdigest() != expected_checksum):
+                    # Print a warning
+                    print(f'Warning: Partial download of {target_url} does not match the file, restarting.')
+                    # Remove the partial file (so the next attempt starts from zero)
+                    part_path.unlink(missing_ok=True)
+                    checksum = None
+                    # Try again
+                    continue
+                # Stop downloading
+                break
+            # If the request failed (client error)
+            if r.status_code not in (200, 206):
+                # Release the connection
+                r.close()
+                # Print a warning
+                print(f'Warning: Bad response ({r.status_code}) for {target_url}.')
+                # Return None
+                return None
+            # If the server sent the whole file (it ignored or did not receive the range)
+            if r.status_code == 200:
+                # Start the partial file again
+                offset = 0
+                # Size of the file from the response
+                response_size = int(r.headers.get("Content-Length", -1))
+            # Otherwise (partial content)
+            else:
+                # Size of the file (from the "bytes start-end/total" content range)
+                response_size = int(r.headers.get("Content-Range", "/-1").split('/')[-1])
+            # If we are checking a checksum
+            if expected_checksum is not None:
+                # Hash the bytes we already have (if resuming)
+                checksum = hash_file(part_path, chunk_size=chunk_size) if offset else hashlib.md5()
+            # Try to write the rest of the file
+            try:
+                # Write the response to the partial file a chunk at a time (appending if resuming)
+                # A dropped connection loses the chunk in progress, so the chunks are kept small
+                with r, open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        # Record the bytes received
+                        scheduler.add_bytes(len(chunk))
+                        # If we are checking a checksum
+                        if checksum is not None:
+                            # Add the chunk to it
+                            checksum.update(chunk)
+            # If the connection dropped
+            except requests.RequestException:
+                # Print a warning
+                print(f'Warning: Download of {target_url} was interrupted, resuming.')
+            # Otherwise
+            else:
+                # If the size is unknown, or the partial file has reached it
+                if response_size < 0 or part_path.stat().st_size >= response_size:
+                    # Stop downloading
+                    break
+                # Print a warning
+                print(f'Warning: Download of {target_url} ended early, resuming.')
+            # Record the failure and back off
+            sleep(scheduler.record_failure(attempt=attempt))
+        # If we ran out of attempts
+        else:
+            # Print a warning (the partial file is kept, so the next run resumes it)
+            print(f'Warning: Download of {target_url} did not finish after {scheduler.max_attempts} attempts.')
+            # Return None
+            return None
+    # If there is an expected size or checksum
+    if expected_size is not None or expected_checksum is not None:
+        # If we are checking a checksum but did not hash the file as it arrived (it was already complete)
+        if expected_checksum is not None and checksum is None:
+            # Hash the file
+            checksum = hash_file(part_path, chunk_size=chunk_size)
+        # If the size or checksum does not match
+        if (expected_size is not None and part_path.stat().st_size != expected_size) or \
+                (expected_checksum is not None and checksum.hexdigest() != expected_checksum):
+            # Print a warning
+            print(f'Warning: File {target_url} does not match its catalog size/checksum. Possibly incomplete.')
+            # Remove the partial file (so the next attempt starts from scratch)
+            part_path.unlink(missing_ok=True)
+            # Return None
+            return None
+    # Otherwise, try to convert into an h5 object
+    else:
+        try:
+            # Open with h5py from disk (checks integrity), then close so the file can be renamed
+            h5py.File(part_path, 'r').close()
+        # If it fails (corrupt file)
+        except OSError:
+            # Print a warning
+            print(f'Warning: File {target_url} could not be converted to h5. Possibly incomplete.')
+            # Remove the partial file (so the next attempt starts from scratch)
+            part_path.unlink(missing_ok=True)
+            # Return None
+            return None
+    # Rename the partial file to the output file (atomic on the same filesystem)
+    replace(part_path, file_path)
+    # If we are returning the file
+    if return_file:
+        # Open the output file as an H5py File object and return
+        return h5py.File(file_path, 'r')
+    # If returning nothing else, but successfully reached this point, return True
+    return True
+
+
+# Hash a file with MD5, reading it in chunks (adds to an existing checksum object if one is provided)
+def hash_file(file_path, checksum=None, chunk_size=64 * 1024):
+    # If there is no checksum object
+    if checksum is None:
+        # Start one
+        checksum = hashlib.md5()
+    # Open the file
+    with open(file_path, 'rb') as f:
+        # For each chunk
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            # Add it to the checksum
+            checksum.update(chunk)
+    # Return the checksum object
+    return checksum
+
+
+# Get the path of the partial file for an output file
+def get_partial_path(file_path):
+    # Return the path
+    return Path(file_path).with_name(Path(file_path).name + ".part")
+
+
+# Get the paths of the partial (unfinished) downloads in the output directory
+def get_partial_downloads():
+    # Return the list of partial files
+    return [Path(root) / name
+            for root, dirs, files in walk(environ["output_files_path"])
+            for name in files if name.endswith(".part")]
+
+
+# Class to track the progress and request rate of a spider run (shared by the worker threads)
+class SpiderProgress:
+
+    __slots__ = ["total", "completed", "requests", "start_time", "last_report", "report_interval", "lock"]
+
+    def __init__(self, report_interval=10):
+
+        # Number of day listings expected and completed
+        self.total = 0
+        self.completed = 0
+        # Number of requests submitted to LAADS (including retries)
+        self.requests = 0
+        # Start time of the run and time of the last progress report
+        self.start_time = time()
+        self.last_report = self.start_time
+        # Seconds between progress reports
+        self.report_interval = report_interval
+        # Lock for updates from the worker threads
+        self.lock = threading.Lock()
+
+    # Record a request submitted to LAADS
+    def add_request(self, count=1):
+        # Lock the counters
+        with self.lock:
+            # Add to the request count
+            self.requests += count
+
+    # Get the overall requests per second for the run
+    def get_request_rate(self):
+        # Time elapsed (guarding against division by zero)
+        elapsed = max(time() - self.start_time, 1e-6)
+        # Return the rate
+        return self.requests / elapsed
+
+    # Record a completed day listing and report progress if the interval has passed
+    def add_completed(self, count=1):
+        # Add to the completed count
+        self.completed += count
+        # If the report interval has passed, or everything is complete
+        if time() - self.last_report >= self.report_interval or self.completed == self.total:
+            # Report the progress
+            self.report()
+
+    # Print a progress update
+    def report(self):
+        # Reset the report timer
+        self.last_report = time()
+        # Print the update
+        print(f"Spidered {self.completed}/{self.total} day listings "
+              f"({self.requests} requests, {round(self.get_request_rate(), 2)} requests/s).")
+
+
+# Get a JSON listing from LAADS using the calling thread's session from a session pool
+def get_LAADS_json(target_url, session_pool, progress=None, scheduler=None):
+    # If no scheduler was provided
+    if scheduler is None:
+        # Use the shared scheduler
+        scheduler = laads_scheduler
+    # Request the listing (in one of the scheduler's slots)
+    with scheduler:
+        r = scheduler.get(session_pool.get_session(), target_url)
+    # If the request failed (client error)
+    r.raise_for_status()
+    # If we are tracking progress
+    if progress is not None:
+        # Record the request
+        progress.add_request()
+    # Return the loaded listing
+    return json.loads(r.text)
+
+
+# Get the listing from a completed get_LAADS_json future, or None (with a warning) if the request failed
+def get_listing_result(completed_event, listing_url):
+    # Try to get the listing
+    try:
+        # Return the listing
+        return completed_event.result()
+    # If the request failed (client error, the scheduler ran out of attempts or the listing was not JSON)
+    except (requests.RequestException, ValueError) as e:
+        # Print a warning
+        print(f'Warning: Listing {listing_url} failed ({type(e).__name__}), skipping it.')
+        # Return None
+        return None
+
+
+# Add the tiles from a LAADS day listing to a URLs dict object
+def add_day_to_dict(urls_dict, year_value, day_value, tiles):
+    # Add or replace the filename, size and MD5 checksum for the DOY, for the year, for each tile (the tile name is the
+    # third part of the file name)
+    urls_dict.catalog.executemany("INSERT OR REPLACE INTO urls (tile, year, doy, file_name, size, checksum) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(tile["name"].split('.')[2],
+                                    int(year_value),
+                                    int(day_value),
+                                    tile["name"],
+                                    tile.get("size"),
+                                    tile.get("md5sum")) for tile in tiles])
+
+
+# Get the path to the URLs catalog for a product and archive set
+def get_urls_catalog_path(data_product, archive_set="5000"):
+    # Return the path
+    return Path(environ["support_files_path"] + f'{archive_set}_{data_product}_laads_urls.db')
+
+
+# Open (or create) a URLs catalog and return the connection
+def open_urls_catalog(catalog_path):
+    # Connect to the catalog
+    catalog = sqlite3.connect(catalog_path)
+    # Create the table if it is new (the primary key is the (tile, date) index, WITHOUT ROWID keeps it compact)
+    catalog.execute("CREATE TABLE IF NOT EXISTS urls ("
+                    "tile TEXT NOT NULL, "
+                    "year INTEGER NOT NULL, "
+                    "doy INTEGER NOT NULL, "
+                    "file_name TEXT NOT NULL, "
+                    "size INTEGER, "
+                    "checksum TEXT, "
+                    "PRIMARY KEY (tile, year, doy)) WITHOUT ROWID")
+    # Get the catalog's columns
+    columns = [row[1] for row in catalog.execute("PRAGMA table_info(urls)")]
+    # If the catalog predates the size and checksum columns
+    if "checksum" not in columns:
+        # Add them (the values fill in as the days are spidered again)
+        catalog.execute("ALTER TABLE urls ADD COLUMN size INTEGER")
+        catalog.execute("ALTER TABLE urls ADD COLUMN checksum TEXT")
+    # Index for the high-water mark and known days queries (the primary key leads with the tile, so without it they
+    # scan the whole table; built once for older catalogs)
+    catalog.execute("CREATE INDEX IF NOT EXISTS urls_year_doy ON urls (year, doy)")
+    # Return the connection
+    return catalog
+
+
+# Import an old JSON URL file (tile -> year -> DOY -> file name) into a URLs dict object's catalog
+def import_urls_json(urls_dict, json_path):
+    # Print update
+    print(f"Importing URLs file {Path(json_path).name}")
+    # Open the file
+    with open(json_path, 'r') as f:
+        # Load as dictionary
+        json_dict = json.load(f)
+    # Insert the rows
+    urls_dict.catalog.executemany("INSERT OR REPLACE INTO urls (tile, year, doy, file_name) VALUES (?, ?, ?, ?)",
+                                  [(tile, int(year_value), int(day_value), file_name)
+                                   for tile, years_dict in json_dict.items()
+                                   for year_value, days_dict in years_dict.items()
+                                   for day_value, file_name in days_dict.items()])
+    # Commit the import
+    urls_dict.catalog.commit()
+
+
+# Get the (date, path) of each old JSON URL file for a product and archive set, sorted oldest first
+def get_urls_dict_files(data_product, archive_set="5000"):
+    # List for the files
+    urls_files = []
+    # Walk the support file directory
+    for root, dirs, files in walk(environ["support_files_path"]):
+        # For each file name
+        for name in files:
+            # If the file is one of the URL files
+            if f"{archive_set}_{data_product}_laads_urls_" in name and name.endswith(".json"):
+                # Split the name
+                split_name = name.split('_')
+                # Make a datetime date object from the name
+                file_date = datetime.date(year=int(split_name[-1][4:8]),
+                                          month=int(split_name[-1][0:2]),
+                                          day=int(split_name[-1][2:4]))
+                # Add the date and path to the list
+                urls_files.append((file_date, Path(root) / name))
+    # Return the files, oldest first
+    return sorted(urls_files)
+
+
+# Delete the old JSON URL files superseded by the catalog for a URLs dict object
+def cleanup_urls_dict_files(urls_dict):
+    # For each file
+    for file_date, file_path in get_urls_dict_files(urls_dict.data_product, urls_dict.archive_set):
+        # Print update
+        print(f"Removing superseded URLs file {file_path.name}")
+        # Delete the file
+        file_path.unlink()
+
+
+# Write a URLs dict object's updates to its catalog
+def save_urls_dict(urls_dict):
+    # Commit the catalog
+    urls_dict.catalog.commit()
+
+
+# Spider LAADS for several URL dict objects at once, fetching the listings with a bounded pool of worker threads
+# Unless starting fresh, only the days from each catalog's high-water mark onward are fetched (the high-water
+# day itself is re-fetched as it may have been incomplete), plus any missing days if checking old gaps
+# A failed listing is skipped with a warning and the rest of the run is still saved; the days it covered are left as
+# gaps, which a later run with check_old_gaps fills
+def update_VIIRS_availability(urls_dicts,
+                              start_fresh=False,
+                              check_old_gaps=False,
+                              cleanup_old_files=False,
+                              max_workers=8,
+                              report_interval=10,
+                              save=True,
+                              scheduler=None,
+                              session_pool=None):
+    # Progress tracker for the run
+    progress = SpiderProgress(report_interval=report_interval)
+    # Whether the sessions are ours to close at the end of the run
+    close_sessions = session_pool is None
+    # If no session pool was provided
+    if session_pool is None:
+        # Start one for the worker threads
+        session_pool = LaadsSessionPool(pool_size=max_workers)
+    # Number of failed listings
+    failures = 0
+    # Dictionaries of the high-water marks and known days for each URL dict
+    high_water_marks = {}
+    known_days = {}
+    # For each URL dict
+    for urls_dict in urls_dicts:
+        # If we are starting fresh
+        if start_fresh:
+            # Empty the catalog
+            urls_dict.catalog.execute("DELETE FROM urls")
+        # Get the high-water mark (None for an empty catalog, meaning fetch everything)
+        high_water_marks[urls_dict] = urls_dict.get_high_water_mark()
+        # If checking old gaps, get the days we already know about
+        if check_old_gaps:
+            known_days[urls_dict] = urls_dict.get_known_days()
+        # If there is a high-water mark
+        if high_water_marks[urls_dict] is not None:
+            # Print update
+            print(f"Updating archive set {urls_dict.archive_set}, product {urls_dict.data_product} from "
+                  f"{high_water_marks[urls_dict][0]}, day of year: {high_water_marks[urls_dict][1]}.")
+    # Start a ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Submit the product listings (years) for each URL dict
+        future_events = {}
+        for urls_dict in urls_dicts:
+            # Target URL for laads data
+            target_url = environ["laads_alldata_url"] + urls_dict.archive_set + '/' + urls_dict.data_product + ".json"
+            future_events[executor.submit(get_LAADS_json,
+                                          target_url,
+                                          session_pool,
+                                          progress,
+                                          scheduler)] = (urls_dict, target_url)
+        # Submit the year listings (days) as each product listing arrives
+        year_events = {}
+        for completed_event in as_completed(future_events):
+            urls_dict, target_url = future_events[completed_event]
+            # Get the listing
+            listing = get_listing_result(completed_event, target_url)
+            # If it failed
+            if listing is None:
+                # Count the failure and skip the product
+                failures += 1
+                continue
+            # High-water mark for the URL dict
+            high_water_mark = high_water_marks[urls_dict]
+            # For each year in the data
+            for year in listing:
+                # Get year value
+                year_value = year["name"]
+                # If the year is before the high-water mark and we are not checking for gaps
+                if high_water_mark is not None and year_value < high_water_mark[0] and not check_old_gaps:
+                    # Skip the year
+                    continue
+                # Construct year URL
+                year_url = target_url.replace(".json", f"/{year_value}.json")
+                year_events[executor.submit(get_LAADS_json,
+                                            year_url,
+                                            session_pool,
+                                            progress,
+                                            scheduler)] = (urls_dict, target_url, year_value, year_url)
+        # Submit the day listings (tiles) as each year listing arrives
+        day_events = {}
+        for completed_event in as_completed(year_events):
+            urls_dict, target_url, year_value, year_url = year_events[completed_event]
+            # Get the listing
+            listing = get_listing_result(completed_event, year_url)
+            # If it failed
+            if listing is None:
+                # Count the failure and skip the year
+                failures += 1
+                continue
+            # High-water mark for the URL dict
+            high_water_mark = high_water_marks[urls_dict]
+            # For each day
+            for day in listing:
+                # Retrieve day value
+                day_value = day["name"]
+                # If the day is before the high-water mark
+                if high_water_mark is not None and (year_value, day_value) < high_water_mark:
+                    # If we are not checking for gaps, or the day is already known
+                    if not check_old_gaps or (year_value, day_value) in known_days[urls_dict]:
+                        # Skip the day
+                        continue
+                # Construct day URL
+                day_url = target_url.replace(".json", f"/{year_value}/{day_value}.json")
+                day_events[executor.submit(get_LAADS_json,
+                                           day_url,
+                                           session_pool,
+                                           progress,
+                                           scheduler)] = (urls_dict, year_value, day_value, day_url)
+        # Set the expected number of day listings
+        progress.total = len(day_events)
+        # Merge the day listings into the catalogs as they arrive (only this thread touches the catalogs)
+        for completed_event in as_completed(day_events):
+            urls_dict, year_value, day_value, day_url = day_events[completed_event]
+            # Get the listing
+            listing = get_listing_result(completed_event, day_url)
+            # If it failed
+            if listing is None:
+                # Count the failure
+                failures += 1
+            # Otherwise
+            else:
+                # Add the tiles to the catalog
+                add_day_to_dict(urls_dict, year_value, day_value, listing)
+            # Record the completed listing
+            progress.add_completed()
+    # If the sessions are ours
+    if close_sessions:
+        # Close the sessions
+        session_pool.close()
+    # If any listings failed
+    if failures:
+        # Print a warning
+        print(f'Warning: {failures} listings failed and were skipped, run again with check_old_gaps=True to fill '
+              f'the gaps.')
+    # If saving
+    if save:
+        # Write each catalog
+        for urls_dict in urls_dicts:
+            save_urls_dict(urls_dict)
+            # If cleaning up old files
+            if cleanup_old_files:
+                # Delete the superseded URL files
+                cleanup_urls_dict_files(urls_dict)
+    # Return the URL dict objects
+    return urls_dicts
+
+
+# Spider LAADS for a list of (data product, archive set) pairs in one run and return their URL dict objects
+def spider_VIIRS_availability(product_list,
+                              start_fresh=False,
+                              check_old_gaps=False,
+                              cleanup_old_files=False,
+                              max_workers=8,
+                              report_interval=10,
+                              save=True,
+                              scheduler=None,
+                              session_pool=None):
+    # Open the URL dict objects (existing files are merged into, missing ones start empty)
+    urls_dicts = [LaadsUrlsDict(data_product, archive_set=archive_set, spider_if_missing=False)
+                  for data_product, archive_set in product_list]
+    # Spider and return the URL dict objects
+    return update_VIIRS_availability(urls_dicts,
+                                     start_fresh=start_fresh,
+                                     check_old_gaps=check_old_gaps,
+                                     cleanup_old_files=cleanup_old_files,
+                                     max_workers=max_workers,
+                                     report_interval=report_interval,
+                                     save=save,
+                                     scheduler=scheduler,
+                                     session_pool=session_pool)
+
+
 # Function to return a dictionary of URLs to a VIIRS product on LAADS (will update existing)
 def get_VIIRS_availability(data_product,
                            start_fresh=False,
                            check_old_gaps=False,
                            cleanup_old_files=False,
                            existing_dict=None,
-                           archive_set="5000"):
+                           archive_set="5000",
+                           max_workers=8,
+                           session_pool=None):
     # If there is no existing URLs dict object
     if existing_dict is None:
         # Instantiate a URLs dict object
-        urls_dict = LaadsUrlsDict(data_product, archive_set=archive_set)
+        urls_dict = LaadsUrlsDict(data_product, archive_set=archive_set, spider_if_missing=False)
     # Otherwise (existing dictionary triggered this availability update)
     else:
         # Use the dictionary
         urls_dict = existing_dict
-    # If there is no urls dict yet
-    if urls_dict.dictionary is None:
-        # Turn it into an empty dictionary
-        urls_dict.dictionary = {}
-    # Target URL for laads data
-    target_url = environ["laads_alldata_url"] + archive_set + '/' + data_product + ".json"
-    # Get a laads session
-    laads_session = connect_to_laads()
-    # Get the years in json format from the target URL
-    r = laads_session.get(target_url)
-    # If the request failed
-    if r.status_code != 200:
-        # Send to repeated submission function
-        r = try_try_again(r, laads_session, target_url)
-    # Load the content of the response
-    years = json.loads(r.text)
-    # For each year in the data
-    for year in years:
-        # Get year value
-        year_value = year["name"]
-        # Construct year URL
-        year_url = target_url.replace(".json", f"/{year_value}.json")
-        # Get the days (adding the year to the original URL
-        r = laads_session.get(year_url)
-        # If the request failed
-        if r.status_code != 200:
-            # Send to repeated submission function
-            r = try_try_again(r, laads_session, year_url)
-        # Load the data as text
-        days = json.loads(r.text)
-        # For each day
-        for day in days:
-            # Retrieve day value
-            day_value = day["name"]
-            # Construct day URL
-            day_url = target_url.replace(".json", f"/{year_value}/{day_value}.json")
-            # Get the tiles (adding the day and year to the URL)
-            r = laads_session.get(day_url)
-            print(f"Processing: Archive set {archive_set}, product {data_product}, for {year_value}, day of year: {day_value}.")
-            # If the request failed
-            if r.status_code != 200:
-                # Send to repeated submission function
-                r = try_try_again(r, laads_session, day_url)
-            # Load the data as text
-            tiles = json.loads(r.text)
-            # For each of the tiles
-            for tile in tiles:
-                # Pull the file name of the tile
-                file_name = tile["name"]
-                # Split the name on the periods
-                split_name = file_name.split('.')
-                # Extract the tile name
-                tile_name = split_name[2]
-                # Store the filename in the urls dictionary
-                # If the tile is not in the dict yet
-                if tile_name not in urls_dict.dictionary.keys():
-                    # Add it as a key with an empty subdict value
-                    urls_dict.dictionary[tile_name] = {}
-                # If the year is not in the tile subdict as a key
-                if year_value not in urls_dict.dictionary[tile_name].keys():
-                    # Add it as a key with an empty subdict value
-                    urls_dict.dictionary[tile_name][year_value] = {}
-                # Add or replace the filename for the DOY, for the year, for the tile
-                urls_dict.dictionary[tile_name][year_value][day_value] = file_name
-    # Get today's date as a string
-    file_date = datetime.datetime.now().strftime("%m%d%Y")
-    # Construct save path
-    save_path = environ["support_files_path"] + f'{archive_set}_{data_product}_laads_urls_{file_date}.json'
-    # Write the dictionary
-    with open(save_path, 'w') as of:
-        json.dump(urls_dict.dictionary, of, indent=4)
-    # Close the session
-    laads_session.close()
+    # Spider LAADS for the product
+    update_VIIRS_availability([urls_dict],
+                              start_fresh=start_fresh,
+                              check_old_gaps=check_old_gaps,
+                              cleanup_old_files=cleanup_old_files,
+                              max_workers=max_workers,
+                              session_pool=session_pool)
+    # Return the URLs dict object
+    return urls_dict
 
 
 def zero_pad_number(input_number, digits=3):
@@ -0,0 +1,164 @@
+import io
+import h5py
+import dotenv
+import requests
+import t_laads_tools
+from collections import OrderedDict
+
+# Load the .env file
+dotenv.load_dotenv()
+
+
+# Class for a read-only, seekable file object over HTTP Range requests, with an LRU cache of fixed-size blocks
+# h5py can open it like a local file, so only the blocks holding the metadata and the datasets that are actually read
+# get transferred. Adjacent missing blocks are fetched with a single request.
+class LaadsRemoteFile(io.RawIOBase):
+
+    def __init__(self, session_obj, target_url, block_size=1024 * 1024, max_blocks=64, scheduler=None):
+
+        # Initialize the base class
+        super().__init__()
+        # Instantiate attributes
+        self.session_obj = session_obj
+        self.target_url = target_url
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        # If no scheduler was provided
+        if scheduler is None:
+            # Use the shared scheduler
+            scheduler = t_laads_tools.laads_scheduler
+        self.scheduler = scheduler
+        # Cache of blocks (block index -> bytes), most recently used last
+        self.blocks = OrderedDict()
+        # Current position
+        self.position = 0
+        # Number of bytes and requests transferred
+        self.bytes_transferred = 0
+        self.requests = 0
+        # Size of the file (from the first block's content range)
+        self.size = None
+        self.fetch_blocks(0, 0)
+
+    # Fetch a run of blocks (inclusive) with one Range request, add them to the cache and return them as a dictionary
+    def fetch_blocks(self, first_block, last_block):
+        # Byte range of the blocks
+        start = first_block * self.block_size
+        end = (last_block + 1) * self.block_size - 1
+        # Request the range (in one of the scheduler's slots)
+        with self.scheduler:
+            r = self.scheduler.get(self.session_obj, self.target_url, headers={"Range": f"bytes={start}-{end}"})
+        # If the server did not send partial content
+        if r.status_code != 206:
+            # Raise an error (h5py reports it as a failure to read)
+            raise OSError(f"Range request for {self.target_url} failed ({r.status_code}).")
+        # If we do not know the size yet
+        if self.size is None:
+            # Get it from the "bytes start-end/total" content range
+            self.size = int(r.headers["Content-Range"].split('/')[-1])
+        # Record the transfer
+        self.bytes_transferred += len(r.content)
+        self.requests += 1
+        # Split the content into the blocks
+        fetched = {block: r.content[(block - first_block) * self.block_size:
+                                    (block - first_block + 1) * self.block_size]
+                   for block in range(first_block, last_block + 1)}
+        # For each block
+        for block, block_bytes in fetched.items():
+            # Add it to the cache
+            self.blocks[block] = block_bytes
+            self.blocks.move_to_end(block)
+        # While the cache is over its size
+        while len(self.blocks) > self.max_blocks:
+            # Evict the least recently used block
+            self.blocks.popitem(last=False)
+        # Return the blocks
+        return fetched
+
+    # The file can be read
+    def readable(self):
+        return True
+
+    # The file can be seeked
+    def seekable(self):
+        return True
+
+    # Get the current position
+    def tell(self):
+        return self.position
+
+    # Move to a position
+    def seek(self, offset, whence=io.SEEK_SET):
+        # If relative to the current position
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        # Otherwise, if relative to the end
+        elif whence == io.SEEK_END:
+            offset += self.size
+        # Set the position
+        self.position = offset
+        # Return the position
+        return self.position
+
+    # Read into a buffer from the current position and return the number of bytes read
+    def readinto(self, buffer):
+        # Bytes to read (stopping at the end of the file)
+        count = max(0, min(len(buffer), self.size - self.position))
+        # If there is nothing to read
+        if count == 0:
+            # Return 0 (end of file)
+            return 0
+        # Blocks covering the read
+        first_block = self.position // self.block_size
+        last_block = (self.position + count - 1) // self.block_size
+        # Get the cached blocks (marking them as recently used)
+        read_blocks = {}
+        for block in range(first_block, last_block + 1):
+            if block in self.blocks:
+                self.blocks.move_to_end(block)
+                read_blocks[block] = self.blocks[block]
+        # Missing blocks
+        missing = [block for block in range(first_block, last_block + 1) if block not in read_blocks]
+        # While there are missing blocks
+        while missing:
+            # Find the run of adjacent missing blocks
+            run_end = 0
+            while run_end + 1 < len(missing) and missing[run_end + 1] == missing[run_end] + 1:
+                run_end += 1
+            # Fetch the run (kept here too, in case a large read evicts it from the cache)
+            read_blocks.update(self.fetch_blocks(missing[0], missing[run_end]))
+            # Remove it from the missing blocks
+            missing = missing[run_end + 1:]
+        # Copy the blocks into the buffer
+        view = memoryview(buffer)
+        written = 0
+        for block in range(first_block, last_block + 1):
+            # Part of the block to copy
+            block_start = max(self.position + written - block * self.block_size, 0)
+            block_bytes = read_blocks[block][block_start:block_start + count - written]
+            # Copy it
+            view[written:written + len(block_bytes)] = block_bytes
+            written += len(block_bytes)
+        # Move the position
+        self.position += written
+        # Return the number of bytes read
+        return written
+
+
+# Open a VIIRS H5 file on LAADS with h5py, reading only the blocks that are needed over HTTP Range requests
+# Returns the h5py File object and the remote file object (for its transfer counts), or None for each if it failed
+def open_remote_VIIRS_file(session_obj, target_url, block_size=1024 * 1024, max_blocks=64, scheduler=None):
+    # Try to open the remote file
+    try:
+        remote_file = LaadsRemoteFile(session_obj,
+                                      target_url,
+                                      block_size=block_size,
+                                      max_blocks=max_blocks,
+                                      scheduler=scheduler)
+        # Return the h5py File object and the remote file object
+        return h5py.File(remote_file, 'r'), remote_file
+    # If it fails
+    except (OSError, requests.RequestException):
+        # Print a warning
+        print(f'Warning: File {target_url} could not be opened remotely.')
+        # Return None for each
+        return None, None
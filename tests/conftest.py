@@ -0,0 +1,123 @@
+import sys
+import threading
+import time
+import h5py
+import numpy as np
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Make the modules in src importable (they import each other by name)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+
+# Request handler for the mock LAADS server: serves its files with HTTP Range support, after any queued faults
+class MockLaadsHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # Name of the file requested
+        name = self.path.split('/')[-1]
+        # Record the request
+        self.server.requests.append((name, self.headers.get("Range")))
+        # Next fault queued for the file (if any)
+        fault = self.server.faults[name].pop(0) if self.server.faults.get(name) else None
+        # If the fault is a status (throttled, server error)
+        if isinstance(fault, int):
+            # Send it without a body
+            self.send_response(fault)
+            self.send_header("Content-Length", "0")
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        # Get the file
+        data = self.server.files.get(name)
+        # If there is no such file
+        if data is None:
+            # Send a not found
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # Get the byte range requested (all of the file if none)
+        range_header = self.headers.get("Range")
+        start, end = 0, len(data) - 1
+        if range_header is not None:
+            range_start, range_end = range_header.split('=')[1].split('-')
+            start = int(range_start)
+            end = min(int(range_end), len(data) - 1) if range_end else len(data) - 1
+            # If the range starts at or past the end of the file
+            if start >= len(data):
+                # Send a range not satisfiable with the size
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        # Send the headers for the range
+        self.send_response(206 if range_header is not None else 200)
+        if range_header is not None:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        # If the fault is a dropped connection after a number of bytes
+        if isinstance(fault, tuple) and fault[0] == "drop":
+            # Send that many bytes, give the client time to read them and close the connection
+            self.wfile.write(data[start:start + fault[1]])
+            self.wfile.flush()
+            time.sleep(0.2)
+            self.close_connection = True
+            return
+        # Send the range
+        self.wfile.write(data[start:end + 1])
+
+    # Keep the test output quiet
+    def log_message(self, *args):
+        pass
+
+
+# Mock LAADS server in a thread, with its files (name -> bytes), queued faults (name -> list of statuses or
+# ("drop", byte count)) and a log of the (name, Range header) of each request
+@pytest.fixture
+def laads_server():
+    # Start the server on a free port
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockLaadsHandler)
+    server.daemon_threads = True
+    server.files = {}
+    server.faults = {}
+    server.requests = []
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/archive/allData/5000/VNP43MA3/2021/201/"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    # Stop the server
+    server.shutdown()
+    server.server_close()
+
+
+# Point the output directory at a temporary directory, with a dummy LAADS token
+@pytest.fixture
+def output_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("output_files_path", str(tmp_path) + '/')
+    monkeypatch.setenv("laads_token", "test")
+    return tmp_path
+
+
+# Bytes of a small H5 granule (a few chunked int16 bands and their quality flags), and its local path
+@pytest.fixture
+def granule(tmp_path):
+    # Path to the granule
+    file_path = tmp_path / "source" / "VNP43MA3.A2021201.h09v05.001.2021277141246.h5"
+    file_path.parent.mkdir()
+    # Write the bands
+    rng = np.random.default_rng(0)
+    with h5py.File(file_path, 'w') as h5_file:
+        fields = h5_file.create_group("HDFEOS/GRIDS/VIIRS_Grid_BRDF/Data Fields")
+        for band in ["M1", "M2", "M3"]:
+            fields.create_dataset(f"Albedo_BSA_{band}", data=rng.integers(0, 1000, (240, 240), dtype=np.int16),
+                                  chunks=(60, 240))
+            fields.create_dataset(f"BRDF_Albedo_Band_Mandatory_Quality_{band}",
+                                  data=rng.integers(0, 2, (240, 240), dtype=np.int16), chunks=(60, 240))
+    # Return the bytes and path
+    return file_path.read_bytes(), file_path
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import threading
+import aiohttp
+import t_async_download
+
+
+# Fetch a file from the mock server with its catalog size and checksum (no waiting between attempts)
+def fetch(server, name, data, **kwargs):
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await t_async_download.fetch_VIIRS_file(session, server.base_url + name, asyncio.Semaphore(4),
+                                                           chunk_size=1024, base_back_off=0,
+                                                           expected_size=len(data),
+                                                           expected_checksum=hashlib.md5(data).hexdigest(),
+                                                           **kwargs)
+
+    return asyncio.run(run())
+
+
+def test_fetch_resumes_dropped_transfer(laads_server, output_path, granule):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    laads_server.faults[file_path.name] = [("drop", 5000)]
+    assert fetch(laads_server, file_path.name, data) == output_path / file_path.name
+    assert (output_path / file_path.name).read_bytes() == data
+    assert len(laads_server.requests) == 2 and laads_server.requests[0][1] is None
+    assert 0 < int(laads_server.requests[1][1][6:-1]) <= 5000
+
+
+def test_fetch_resumes_partial_file_from_earlier_run(laads_server, output_path, granule):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    (output_path / (file_path.name + ".part")).write_bytes(data[:7000])
+    assert fetch(laads_server, file_path.name, data) == output_path / file_path.name
+    assert (output_path / file_path.name).read_bytes() == data
+    assert laads_server.requests == [(file_path.name, "bytes=7000-")]
+
+
+def test_fetch_416_with_mismatched_partial_file_restarts(laads_server, output_path, granule):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    (output_path / (file_path.name + ".part")).write_bytes(b"\0" * len(data))
+    assert fetch(laads_server, file_path.name, data) == output_path / file_path.name
+    assert (output_path / file_path.name).read_bytes() == data
+    assert [header for name, header in laads_server.requests] == [f"bytes={len(data)}-", None]
+
+
+def test_fetch_checksum_mismatch(laads_server, output_path, granule):
+    data, file_path = granule
+    laads_server.files[file_path.name] = bytes(reversed(data))
+    assert fetch(laads_server, file_path.name, data) is None
+    assert not (output_path / file_path.name).exists()
+    assert not (output_path / (file_path.name + ".part")).exists()
+
+
+def test_fetch_retries_with_back_off(laads_server, output_path, granule):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    laads_server.faults[file_path.name] = [503, 429, 500]
+    assert fetch(laads_server, file_path.name, data) == output_path / file_path.name
+    assert len(laads_server.requests) == 4
+
+
+def test_fetch_gives_up_after_max_attempts(laads_server, output_path, granule):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    laads_server.faults[file_path.name] = [503] * 100
+    assert fetch(laads_server, file_path.name, data, max_attempts=3) is None
+    assert len(laads_server.requests) == 3
+
+
+def test_fetch_writes_off_the_event_loop(laads_server, output_path, granule, monkeypatch):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    # Record the thread of each write
+    threads = set()
+    write_chunk = t_async_download.write_chunk
+
+    def record_write(f, chunk, checksum=None):
+        threads.add(threading.get_ident())
+        write_chunk(f, chunk, checksum)
+
+    monkeypatch.setattr(t_async_download, "write_chunk", record_write)
+    assert fetch(laads_server, file_path.name, data) == output_path / file_path.name
+    assert threads and threading.get_ident() not in threads
+
+
+def test_download_files(laads_server, output_path, granule):
+    data, file_path = granule
+    names = [file_path.name, "VJ143MA3.A2021201.h09v05.002.2021209072428.h5"]
+    laads_server.files[names[0]] = data
+    laads_server.files[names[1]] = data[::-1]
+    completed = {}
+    results = t_async_download.get_VIIRS_files([laads_server.base_url + name for name in names],
+                                               file_checks={names[0]: (len(data), hashlib.md5(data).hexdigest()),
+                                                            names[1]: (len(data), hashlib.md5(data).hexdigest())},
+                                               on_complete=completed.__setitem__)
+    assert results == completed
+    assert results[laads_server.base_url + names[0]] == output_path / names[0]
+    assert results[laads_server.base_url + names[1]] is None
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+from scipy import stats as st
+import t_compare
+
+# Scale factor with exact float32 multiples, so scaled values and differences fall exactly on the bin edges below
+SCALE_FACTOR = 0.25
+VALUE_BINS = np.arange(0, 101) * 1.25
+DIFF_BINS = np.arange(-100, 101) * 1.25
+
+
+# Raw VNP and VJ1 bands (int16) with fill values and quality flags, the first rows all low quality in VNP (so the
+# first blocks compared have no pairs)
+@pytest.fixture
+def bands():
+    rng = np.random.default_rng(0)
+    vnp_band = rng.integers(0, 101, (97, 53)).astype(np.int16) * 5
+    vj1_band = np.clip(vnp_band + rng.integers(-20, 21, vnp_band.shape), 0, 500).astype(np.int16)
+    vnp_band[rng.random(vnp_band.shape) < 0.05] = 32767
+    vj1_band[rng.random(vj1_band.shape) < 0.05] = 32767
+    vnp_qual = (rng.random(vnp_band.shape) < 0.1).astype(np.int16)
+    vj1_qual = (rng.random(vj1_band.shape) < 0.1).astype(np.int16)
+    vnp_qual[:20] = 1
+    return vnp_band, vj1_band, vnp_qual, vj1_qual
+
+
+# Comparison of the whole bands in one pass, with histograms and value counts
+@pytest.fixture
+def comparison(bands):
+    return t_compare.compare_band(*bands, SCALE_FACTOR, value_bins=VALUE_BINS, diff_bins=DIFF_BINS, value_counts=True)
+
+
+# Valid VNP and VJ1 values, and the pairs valid in both (float64, like the scipy reference functions use)
+def get_valid_values(bands):
+    vnp_band, vj1_band, vnp_qual, vj1_qual = bands
+    vnp_valid = (vnp_band != 32767) & (vnp_qual == 0)
+    vj1_valid = (vj1_band != 32767) & (vj1_qual == 0)
+    valid = vnp_valid & vj1_valid
+    return (vnp_band[vnp_valid] * SCALE_FACTOR, vj1_band[vj1_valid] * SCALE_FACTOR, vnp_band[valid] * SCALE_FACTOR,
+            vj1_band[valid] * SCALE_FACTOR)
+
+
+def test_block_merge_matches_single_pass(bands, comparison):
+    vnp_array = t_compare.scale_band(bands[0], bands[2], SCALE_FACTOR)[0]
+    vj1_array = t_compare.scale_band(bands[1], bands[3], SCALE_FACTOR)[0]
+    merged = t_compare.compare_scaled_blocks(vnp_array, vj1_array, SCALE_FACTOR, value_bins=VALUE_BINS,
+                                             diff_bins=DIFF_BINS, value_counts=True, block_rows=16)
+    for name in ["vnp_count", "vj1_count", "count", "diff_min", "diff_max", "overall_min", "overall_max"]:
+        assert getattr(merged, name) == getattr(comparison, name)
+    for name in ["diff_mean", "diff_m2", "vnp_mean", "vj1_mean", "vnp_m2", "vj1_m2", "co_moment"]:
+        assert getattr(merged, name) == pytest.approx(getattr(comparison, name), rel=1e-12)
+    for name in ["joint_hist", "diff_hist", "vnp_value_counts", "vj1_value_counts", "diff_value_counts"]:
+        np.testing.assert_array_equal(getattr(merged, name), getattr(comparison, name))
+    np.testing.assert_array_equal(merged.diff_array, comparison.diff_array)
+
+
+def test_merge_of_empty_comparisons():
+    empty = t_compare.BandComparison(diff_bins=DIFF_BINS)
+    empty.merge(t_compare.BandComparison(diff_bins=DIFF_BINS))
+    assert empty.count == 0 and np.isnan(empty.diff_mean) and np.isnan(empty.diff_min)
+    assert empty.get_t_test() == (pytest.approx(np.nan, nan_ok=True), pytest.approx(np.nan, nan_ok=True))
+
+
+def test_t_test_matches_scipy(comparison):
+    # The statistics are accumulated in float64, so they match scipy on the float64 differences exactly, and on the
+    # float32 differences (reduced in float32) to float32 precision
+    t_stat, p_value = st.ttest_1samp(a=comparison.diff_array.ravel().astype(np.float64), popmean=0, nan_policy='omit')
+    assert comparison.get_t_test() == (pytest.approx(t_stat, rel=1e-9), pytest.approx(p_value, rel=1e-9))
+    t_stat, p_value = st.ttest_1samp(a=comparison.diff_array.ravel(), popmean=0, nan_policy='omit')
+    assert comparison.get_t_test() == (pytest.approx(t_stat, rel=1e-5), pytest.approx(p_value, rel=1e-5))
+    assert comparison.get_diff_std() == pytest.approx(np.nanstd(comparison.diff_array.astype(np.float64), ddof=1),
+                                                      rel=1e-9)
+
+
+def test_regression_matches_scipy(bands, comparison):
+    vnp_pairs, vj1_pairs = get_valid_values(bands)[2:]
+    regression = st.linregress(vnp_pairs, vj1_pairs)
+    assert comparison.get_regression() == (pytest.approx(regression.slope, rel=1e-9),
+                                           pytest.approx(regression.intercept, rel=1e-9),
+                                           pytest.approx(regression.rvalue, rel=1e-9))
+    assert comparison.get_rmse() == pytest.approx(np.sqrt(np.mean((vnp_pairs - vj1_pairs) ** 2)), rel=1e-9)
+
+
+def test_histograms_match_numpy(bands, comparison):
+    vnp_pairs, vj1_pairs = get_valid_values(bands)[2:]
+    # Many values lie exactly on the edges, including the last one
+    assert np.isin(vnp_pairs, VALUE_BINS).any() and vnp_pairs.max() == VALUE_BINS[-1]
+    np.testing.assert_array_equal(comparison.diff_hist, np.histogram(vnp_pairs - vj1_pairs, bins=DIFF_BINS)[0])
+    np.testing.assert_array_equal(comparison.joint_hist, np.histogram2d(vnp_pairs, vj1_pairs, bins=VALUE_BINS)[0])
+    np.testing.assert_array_equal(comparison.get_vnp_hist(), np.histogram(vnp_pairs, bins=VALUE_BINS)[0])
+    np.testing.assert_array_equal(comparison.get_vj1_hist(VALUE_BINS[::10]),
+                                  np.histogram(vj1_pairs, bins=VALUE_BINS[::10])[0])
+
+
+def test_bin_indices_on_edges_match_numpy():
+    # Decimal edges (an edge over the bin width is not always a whole number, so edge values are where arithmetic
+    # binning goes wrong)
+    bins = np.linspace(-0.5, 0.5, 101)
+    values = np.concatenate([bins, bins[:-1] + 0.005, [-1, 1, np.nan]])
+    indices, inside = t_compare.get_bin_indices(values, bins)
+    np.testing.assert_array_equal(np.bincount(indices, minlength=len(bins) - 1), np.histogram(values, bins=bins)[0])
+    assert inside.sum() == 2 * len(bins) - 1
+
+
+def test_histograms_with_decimal_scale_factor_match_numpy(bands):
+    # A product's scale factor and bins: the float32 values land on (or next to) the float64 edges
+    value_bins = np.linspace(0, 0.5, 101)
+    diff_bins = np.linspace(-0.1, 0.1, 41)
+    comparison = t_compare.compare_band(*bands, 0.001, value_bins=value_bins, diff_bins=diff_bins)
+    valid = ~np.isnan(comparison.diff_array)
+    vnp_pairs, vj1_pairs = comparison.vnp_array[valid], comparison.vj1_array[valid]
+    np.testing.assert_array_equal(comparison.diff_hist, np.histogram(comparison.diff_array[valid], bins=diff_bins)[0])
+    np.testing.assert_array_equal(comparison.joint_hist, np.histogram2d(vnp_pairs, vj1_pairs, bins=value_bins)[0])
+
+
+def test_quantiles_match_numpy(bands, comparison):
+    vnp_values, vj1_values, vnp_pairs, vj1_pairs = get_valid_values(bands)
+    quantiles = [0, 0.01, 0.25, 0.5, 0.9, 0.999, 1]
+    np.testing.assert_allclose(comparison.get_diff_quantiles(quantiles), np.quantile(vnp_pairs - vj1_pairs, quantiles))
+    np.testing.assert_allclose(comparison.get_vnp_quantiles(quantiles), np.quantile(vnp_values, quantiles))
+    np.testing.assert_allclose(comparison.get_vj1_quantiles(quantiles), np.quantile(vj1_values, quantiles))
+    assert np.isnan(t_compare.BandComparison().get_diff_quantiles(quantiles)).all()
+
+
+def test_kde_matches_scipy(bands, comparison):
+    vnp_values = get_valid_values(bands)[0]
+    # Evaluate on the lattice of raw values, where the estimate is not interpolated
+    support = np.arange(-40, 541) * SCALE_FACTOR
+    density = t_compare.get_kde(comparison.vnp_value_counts, SCALE_FACTOR, support=support)[1]
+    expected = st.gaussian_kde(vnp_values)(support)
+    np.testing.assert_allclose(density, expected, rtol=1e-6, atol=1e-6 * expected.max())
+    assert t_compare.get_kde(None, SCALE_FACTOR) == (None, None)
+    assert 0.9 < t_compare.get_kde_overlap(comparison) <= 1
@@ -0,0 +1,99 @@
+import hashlib
+import requests
+import pytest
+import t_laads_tools
+
+
+# Scheduler that does not wait between attempts
+@pytest.fixture
+def scheduler():
+    return t_laads_tools.RequestScheduler(max_attempts=4, base_back_off=0, max_back_off=0)
+
+
+# Stream a file from the mock server with its catalog size and checksum
+def stream(server, name, scheduler, data, **kwargs):
+    with requests.Session() as s:
+        return t_laads_tools.stream_VIIRS_file(s, server.base_url + name, return_file=False, chunk_size=1024,
+                                               expected_size=len(data),
+                                               expected_checksum=hashlib.md5(data).hexdigest(),
+                                               scheduler=scheduler, **kwargs)
+
+
+def test_stream_resumes_dropped_transfer(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    laads_server.faults[file_path.name] = [("drop", 5000)]
+    assert stream(laads_server, file_path.name, scheduler, data) is True
+    assert (output_path / file_path.name).read_bytes() == data
+    assert not (output_path / (file_path.name + ".part")).exists()
+    # The second request resumed from the bytes already written (less the chunk in progress when it dropped)
+    assert len(laads_server.requests) == 2 and laads_server.requests[0][1] is None
+    assert 0 < int(laads_server.requests[1][1][6:-1]) <= 5000
+
+
+def test_stream_resumes_partial_file_from_earlier_run(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    (output_path / (file_path.name + ".part")).write_bytes(data[:7000])
+    assert stream(laads_server, file_path.name, scheduler, data) is True
+    assert (output_path / file_path.name).read_bytes() == data
+    assert laads_server.requests == [(file_path.name, "bytes=7000-")]
+
+
+def test_stream_416_with_complete_partial_file(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    (output_path / (file_path.name + ".part")).write_bytes(data)
+    assert stream(laads_server, file_path.name, scheduler, data) is True
+    assert (output_path / file_path.name).read_bytes() == data
+    assert len(laads_server.requests) == 1
+
+
+def test_stream_416_with_mismatched_partial_file_restarts(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    # A partial file of the right size but the wrong bytes (the range is past its end, so the server sends a 416)
+    (output_path / (file_path.name + ".part")).write_bytes(b"\0" * len(data))
+    assert stream(laads_server, file_path.name, scheduler, data) is True
+    assert (output_path / file_path.name).read_bytes() == data
+    assert [header for name, header in laads_server.requests] == [f"bytes={len(data)}-", None]
+
+
+def test_stream_416_with_oversized_partial_file_restarts(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    (output_path / (file_path.name + ".part")).write_bytes(data + b"extra")
+    assert stream(laads_server, file_path.name, scheduler, data) is True
+    assert (output_path / file_path.name).read_bytes() == data
+
+
+def test_stream_checksum_mismatch(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    # The server sends different bytes of the same size
+    laads_server.files[file_path.name] = bytes(reversed(data))
+    assert stream(laads_server, file_path.name, scheduler, data) is None
+    assert not (output_path / file_path.name).exists()
+    assert not (output_path / (file_path.name + ".part")).exists()
+
+
+def test_stream_retries_server_errors(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    laads_server.faults[file_path.name] = [503, 429]
+    assert stream(laads_server, file_path.name, scheduler, data) is True
+    assert len(laads_server.requests) == 3
+
+
+def test_stream_attempts_are_bounded_by_scheduler(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    laads_server.faults[file_path.name] = [503] * 100
+    assert stream(laads_server, file_path.name, scheduler, data) is None
+    # One retry layer: the scheduler's attempts, not the scheduler's attempts per download attempt
+    assert len(laads_server.requests) == scheduler.max_attempts
+
+
+def test_stream_client_error(laads_server, output_path, granule, scheduler):
+    data, file_path = granule
+    assert stream(laads_server, file_path.name, scheduler, data) is None
+    assert len(laads_server.requests) == 1
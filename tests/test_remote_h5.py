@@ -0,0 +1,103 @@
+import h5py
+import numpy as np
+import requests
+import pytest
+import t_laads_tools
+import t_remote_h5
+
+
+# Scheduler that does not wait between attempts
+@pytest.fixture
+def scheduler():
+    return t_laads_tools.RequestScheduler(max_attempts=2, base_back_off=0, max_back_off=0)
+
+
+# Remote file over the mock server's copy of the granule (small blocks, so reads span several)
+@pytest.fixture
+def remote(laads_server, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    with requests.Session() as s:
+        yield t_remote_h5.LaadsRemoteFile(s, laads_server.base_url + file_path.name, block_size=4096, max_blocks=8,
+                                          scheduler=scheduler), data
+
+
+def test_open_remote_matches_local(laads_server, granule, scheduler):
+    data, file_path = granule
+    laads_server.files[file_path.name] = data
+    with requests.Session() as s:
+        remote_h5, remote_file = t_remote_h5.open_remote_VIIRS_file(s, laads_server.base_url + file_path.name,
+                                                                    block_size=4096, scheduler=scheduler)
+        with h5py.File(file_path, 'r') as local_h5:
+            fields = "HDFEOS/GRIDS/VIIRS_Grid_BRDF/Data Fields/"
+            for band in ["M1", "M2", "M3"]:
+                np.testing.assert_array_equal(remote_h5[fields + f"Albedo_BSA_{band}"][()],
+                                              local_h5[fields + f"Albedo_BSA_{band}"][()])
+            # A hyperslab reads only part of the band
+            np.testing.assert_array_equal(remote_h5[fields + "Albedo_BSA_M2"][60:120, 10:20],
+                                          local_h5[fields + "Albedo_BSA_M2"][60:120, 10:20])
+        remote_h5.close()
+    # Each request is for a run of whole blocks
+    for name, header in laads_server.requests:
+        start, end = (int(value) for value in header[6:].split('-'))
+        assert start % 4096 == 0 and (end + 1) % 4096 == 0
+
+
+def test_open_remote_missing_file(laads_server, scheduler):
+    with requests.Session() as s:
+        assert t_remote_h5.open_remote_VIIRS_file(s, laads_server.base_url + "missing.h5",
+                                                  scheduler=scheduler) == (None, None)
+
+
+def test_readinto_matches_local_bytes(remote):
+    remote_file, data = remote
+    rng = np.random.default_rng(1)
+    for offset, count in zip(rng.integers(0, len(data), 50), rng.integers(1, 20000, 50)):
+        remote_file.seek(int(offset))
+        assert remote_file.read(int(count)) == data[offset:offset + count]
+    # Reads stop at the end of the file
+    remote_file.seek(len(data) - 10)
+    assert remote_file.read(100) == data[-10:]
+    assert remote_file.read(100) == b""
+
+
+def test_readinto_coalesces_adjacent_blocks(laads_server, remote):
+    remote_file, data = remote
+    # Opening fetched block 0; a read over blocks 2-6 is one request
+    laads_server.requests.clear()
+    remote_file.seek(2 * 4096 + 100)
+    assert remote_file.read(4 * 4096) == data[2 * 4096 + 100:6 * 4096 + 100]
+    assert [header for name, header in laads_server.requests] == [f"bytes={2 * 4096}-{7 * 4096 - 1}"]
+
+
+def test_readinto_splits_runs_around_cached_blocks(laads_server, remote):
+    remote_file, data = remote
+    # Cache block 4
+    remote_file.seek(4 * 4096)
+    remote_file.read(10)
+    laads_server.requests.clear()
+    # A read over blocks 2-6 fetches the runs either side of it
+    remote_file.seek(2 * 4096)
+    assert remote_file.read(5 * 4096) == data[2 * 4096:7 * 4096]
+    assert [header for name, header in laads_server.requests] == [f"bytes={2 * 4096}-{4 * 4096 - 1}",
+                                                                  f"bytes={5 * 4096}-{7 * 4096 - 1}"]
+
+
+def test_cache_hits_and_eviction(laads_server, remote):
+    remote_file, data = remote
+    remote_file.seek(4096)
+    remote_file.read(3 * 4096)
+    laads_server.requests.clear()
+    # Reading the same bytes again is served from the cache
+    remote_file.seek(4096)
+    assert remote_file.read(3 * 4096) == data[4096:4 * 4096]
+    assert laads_server.requests == []
+    # Reading more than the cache holds evicts the least recently used blocks
+    remote_file.seek(10 * 4096)
+    remote_file.read(8 * 4096)
+    assert len(remote_file.blocks) == remote_file.max_blocks
+    assert 1 not in remote_file.blocks
+    laads_server.requests.clear()
+    remote_file.seek(4096)
+    assert remote_file.read(10) == data[4096:4106]
+    assert len(laads_server.requests) == 1